@@ -0,0 +1,8 @@
+'''
+Miscellaneous routines written during MapAction responses: downloading US
+Census, USGS 3DEP and MCDWD flood data, and combining them.
+The download scripts are run with the 'hrmd-ma-misc' command (see cli.py).
+Importing the package or any of its modules has no side effects.
+'''
+
+__version__ = '0.1.0'
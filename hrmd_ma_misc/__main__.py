@@ -0,0 +1,7 @@
+'''
+Run the command-line interface with 'python -m hrmd_ma_misc' (see cli.py).
+'''
+# Imports: Local.
+from .cli import main
+
+main()
@@ -0,0 +1,377 @@
+'''
+Benchmark the download and conversion steps of download_US_census_data.py
+against a local stand-in for the US Census API, with no API key or network
+access needed.
+
+The stand-in server generates synthetic responses for any number of states,
+counties, tracts, block groups and blocks, with configurable latency and error
+rate. The benchmark reports wall time, rows per second and peak memory (RSS)
+for each stage (fetch, convert to CSV, convert to Parquet).
+
+Usage:
+
+python -m hrmd_ma_misc.benchmark_US_census_data --adm_level "block group" --n_counties 20
+
+Or run only the stand-in server (e.g. to try the download script against it):
+
+python -m hrmd_ma_misc.benchmark_US_census_data --serve --port 8080
+'''
+# Imports: Standard library.
+import argparse
+import json
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def define_synthetic_geography(n_counties, n_tracts, n_block_groups, n_blocks):
+    '''
+    Define the number of each geography inside the one above it, and the
+    function giving the code of the i-th one (e.g. county codes are odd
+    numbers, as they are for most real counties).
+    '''
+
+    synthetic_geography = {
+        'county'      : (n_counties,     lambda i : '{:03d}'.format(2 * i + 1)),
+        'place'       : (n_counties,     lambda i : '{:05d}'.format(100 * (i + 1))),
+        'tract'       : (n_tracts,       lambda i : '{:06d}'.format(100 * (i + 1))),
+        'block group' : (n_block_groups, lambda i : '{:d}'.format(i + 1)),
+        'block'       : (n_blocks,       lambda i : '{:d}'.format(i)),
+    }
+
+    return synthetic_geography
+
+def iter_synthetic_geographies(synthetic_geography, adm_level, in_clauses):
+    '''
+    Yield the geography codes (as a list of (level, code) tuples) of every
+    geography at 'adm_level' in the region given by the "IN" clauses, e.g.
+        {'state' : '12,13', 'county' : '*', 'tract' : '*'}
+    '''
+
+    if adm_level in ['county', 'place']:
+        levels = [adm_level]
+    else:
+        levels = ['county', 'tract', 'block group']
+        if adm_level == 'block':
+            levels = levels + ['block']
+        elif adm_level == 'tract':
+            levels = levels[:2]
+
+    def iter_level(i_level, prefix):
+
+        if i_level == len(levels):
+            yield prefix
+            return
+
+        level = levels[i_level]
+        n, get_code = synthetic_geography[level]
+        if level == 'block':
+            # Block codes start with the block group code.
+            block_group = prefix[-1][1]
+            codes = ['{:}{:03d}'.format(block_group, i) for i in range(n)]
+        else:
+            codes = [get_code(i) for i in range(n)]
+
+        selected = in_clauses.get(level, '*')
+        if selected != '*':
+            codes = [code for code in codes if code in selected.split(',')]
+
+        for code in codes:
+
+            yield from iter_level(i_level + 1, prefix + [(level, code)])
+
+    for state in in_clauses['state'].split(','):
+
+        yield from iter_level(0, [('state', state)])
+
+def make_synthetic_value(geography, i_variable):
+    '''
+    A deterministic, plausible-looking count for a variable in a geography.
+    '''
+
+    seed = int(''.join([code for _, code in geography]))
+    value = (seed * 2654435761 + i_variable * 40503) % 5000
+
+    return '{:d}'.format(value)
+
+class CensusAPIStandIn(ThreadingHTTPServer):
+    '''
+    A local HTTP server which answers queries like the census API, e.g.
+        /data/2022/acs/acs5?get=NAME,B01001_001E&for=tract:*&in=state:12&in=county:001
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, port = 0, n_counties = 10, n_tracts = 10, n_block_groups = 3,
+            n_blocks = 20, latency = 0.0, jitter = 0.0, error_rate = 0.0, seed = 0):
+
+        self.synthetic_geography = define_synthetic_geography(n_counties, n_tracts,
+                                        n_block_groups, n_blocks)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.n_requests = 0
+        self.n_errors = 0
+
+        super().__init__(('127.0.0.1', port), CensusAPIStandInHandler)
+
+        return
+
+    def get_endpoint(self):
+
+        return 'http://127.0.0.1:{:d}/data/2022/acs/acs5'.format(self.server_address[1])
+
+    def start(self):
+
+        thread = threading.Thread(target = self.serve_forever, daemon = True)
+        thread.start()
+
+        return
+
+class CensusAPIStandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+
+        return
+
+    def send_body(self, status, body, headers = None):
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+        return
+
+    def do_GET(self):
+
+        server = self.server
+        with server.random_lock:
+            server.n_requests = server.n_requests + 1
+            delay = server.latency + server.random.uniform(0.0, server.jitter)
+            is_error = server.random.random() < server.error_rate
+            if is_error:
+                server.n_errors = server.n_errors + 1
+                status = server.random.choice([429, 500, 503])
+
+        time.sleep(delay)
+
+        # Simulate a server under load, which asks clients to come back later.
+        if is_error:
+            self.send_body(status, b'"Service unavailable"', {'Retry-After' : '1'})
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            variable_keys = query['get'][0].split(',')
+            adm_level = query['for'][0].split(':')[0]
+            in_clauses = dict([in_clause.split(':') for in_clause in query.get('in', [])])
+        except (KeyError, ValueError):
+            self.send_body(400, b'"error: invalid query"')
+            return
+
+        rows = []
+        for geography in iter_synthetic_geographies(server.synthetic_geography,
+                                adm_level, in_clauses):
+
+            row = []
+            for i_variable, variable_key in enumerate(variable_keys):
+
+                if variable_key == 'NAME':
+                    row.append(', '.join(['{:} {:}'.format(level, code) for
+                                            level, code in reversed(geography)]))
+                else:
+                    row.append(make_synthetic_value(geography, i_variable))
+
+            rows.append(row + [code for _, code in geography])
+
+        # The real API returns 'No Content' when there are no geographies.
+        if not rows:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        header = variable_keys + [level for level, _ in
+                    next(iter_synthetic_geographies(server.synthetic_geography,
+                        adm_level, in_clauses))]
+        lines = [json.dumps(row) for row in [header] + rows]
+        body = ('[' + ',\n'.join(lines) + ']').encode('utf-8')
+        self.send_body(200, body)
+
+        return
+
+def get_peak_rss_MB():
+    '''
+    Peak resident memory of this process so far, in MB (Linux reports KB,
+    macOS reports bytes).
+    '''
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss_MB = peak_rss / 1024.0 ** 2
+    else:
+        peak_rss_MB = peak_rss / 1024.0
+
+    return peak_rss_MB
+
+def count_json_rows(path_json):
+
+    with open(path_json, 'r') as file:
+        n_rows = sum(1 for _ in file) - 1
+
+    return n_rows
+
+def time_stage(name, function, n_rows = None):
+    '''
+    Run one stage of the benchmark and return its timings.
+    '''
+
+    time_start = time.perf_counter()
+    result = function()
+    wall_time = time.perf_counter() - time_start
+
+    if callable(n_rows):
+        n_rows = n_rows(result)
+
+    timing = {'stage' : name, 'wall_time_s' : wall_time, 'n_rows' : n_rows,
+                'rows_per_s' : (n_rows / wall_time) if n_rows else None,
+                'peak_rss_MB' : get_peak_rss_MB()}
+
+    return result, timing
+
+def run_benchmark(server, adm_level, states, max_workers = 8, stages = ('fetch', 'csv', 'csv_vectorized', 'parquet')):
+    '''
+    Download one admin level from the stand-in server and convert it, timing
+    each stage. Note that peak RSS is for the whole process so far, so it never
+    decreases from one stage to the next.
+    '''
+
+    from . import download_US_census_data as census
+    from .fetch_scheduler import FetchScheduler
+
+    dir_bench = tempfile.mkdtemp(prefix = 'benchmark_census_')
+    census.dir_output = dir_bench
+    variable_keys, variable_headers = census.define_headers()
+
+    timings = []
+    try:
+
+        paths_json, timing = time_stage('fetch', lambda : census.request_data('benchmark',
+                                overwrite = True, max_workers = max_workers,
+                                endpoint = server.get_endpoint(),
+                                target_states = states,
+                                target_adm_levels = [adm_level],
+                                scheduler = FetchScheduler(max_per_host = max_workers,
+                                                requests_per_second = None)),
+                                n_rows = lambda paths : count_json_rows(paths[0]))
+        timings.append(timing)
+        path_json = paths_json[0]
+        n_rows = timing['n_rows']
+
+        if 'csv' in stages:
+            _, timing = time_stage('csv', lambda : census.convert_json_to_csv(
+                            path_json, variable_keys, variable_headers,
+                            overwrite = True), n_rows = n_rows)
+            timings.append(timing)
+
+        if 'csv_vectorized' in stages:
+            _, timing = time_stage('csv_vectorized', lambda : census.convert_json_to_csv(
+                            path_json, variable_keys, variable_headers,
+                            overwrite = True, vectorized = True), n_rows = n_rows)
+            timings.append(timing)
+
+        if 'parquet' in stages:
+            _, timing = time_stage('parquet', lambda : census.convert_json_to_columnar(
+                            path_json, variable_keys, variable_headers,
+                            file_format = 'parquet', overwrite = True), n_rows = n_rows)
+            timings.append(timing)
+
+    finally:
+
+        shutil.rmtree(dir_bench, ignore_errors = True)
+
+    return timings
+
+def print_timings(timings):
+
+    print('{:<16} {:>10} {:>10} {:>12} {:>12}'.format('stage', 'wall (s)',
+            'rows', 'rows/s', 'peak RSS (MB)'))
+    for timing in timings:
+
+        print('{:<16} {:>10.3f} {:>10} {:>12} {:>12.1f}'.format(timing['stage'],
+                timing['wall_time_s'], timing['n_rows'],
+                '{:.0f}'.format(timing['rows_per_s']) if timing['rows_per_s'] else '-',
+                timing['peak_rss_MB']))
+
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark the US census download against a local stand-in for the API.")
+    parser.add_argument("--adm_level", default = 'block group', help = "Admin level to request, e.g. 'county', 'tract', 'block group' or 'block'.")
+    parser.add_argument("--states", default = 'Florida,Georgia', help = "Comma-separated list of state names.")
+    parser.add_argument("--n_counties", type = int, default = 10, help = "Counties (or places) per state.")
+    parser.add_argument("--n_tracts", type = int, default = 10, help = "Tracts per county.")
+    parser.add_argument("--n_block_groups", type = int, default = 3, help = "Block groups per tract.")
+    parser.add_argument("--n_blocks", type = int, default = 20, help = "Blocks per block group.")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Delay before each response (seconds).")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "Extra random delay, up to this value (seconds).")
+    parser.add_argument("--error_rate", type = float, default = 0.0, help = "Fraction of requests which fail with 429 or 5xx.")
+    parser.add_argument("--max_workers", type = int, default = 8, help = "Maximum number of requests sent at the same time.")
+    parser.add_argument("--stages", default = 'fetch,csv,csv_vectorized,parquet', help = "Comma-separated list of stages to run after fetching.")
+    parser.add_argument("--path_results", default = None, help = "Append the timings to this JSON-lines file.")
+    parser.add_argument("--serve", action = 'store_true', help = "Only run the stand-in server, until interrupted.")
+    parser.add_argument("--port", type = int, default = 0, help = "Port for the stand-in server (default: any free port).")
+    args = parser.parse_args()
+
+    server = CensusAPIStandIn(port = args.port, n_counties = args.n_counties,
+                n_tracts = args.n_tracts, n_block_groups = args.n_block_groups,
+                n_blocks = args.n_blocks, latency = args.latency,
+                jitter = args.jitter, error_rate = args.error_rate)
+
+    if args.serve:
+        print('Serving census API stand-in at {:}'.format(server.get_endpoint()))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    server.start()
+    timings = run_benchmark(server, args.adm_level, args.states.split(','),
+                    max_workers = args.max_workers,
+                    stages = args.stages.split(','))
+    server.shutdown()
+
+    print('\n{:d} requests to the stand-in server ({:d} errors).\n'.format(
+            server.n_requests, server.n_errors))
+    print_timings(timings)
+
+    if args.path_results is not None:
+        with open(args.path_results, 'a') as file:
+            for timing in timings:
+                timing.update({'adm_level' : args.adm_level, 'states' : args.states,
+                    'n_counties' : args.n_counties, 'n_tracts' : args.n_tracts,
+                    'n_block_groups' : args.n_block_groups, 'n_blocks' : args.n_blocks,
+                    'latency' : args.latency, 'max_workers' : args.max_workers,
+                    'time' : time.time()})
+                file.write(json.dumps(timing) + '\n')
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,331 @@
+'''
+A local, searchable catalog of US Census API variables, used by
+download_US_census_data.py.
+
+The catalog downloads variables.json and groups.json for a dataset once and
+stores them in an SQLite database with a full-text index, so that variables
+can be searched, requests checked, and column headers generated for any group
+without network access.
+
+Usage:
+
+python -m hrmd_ma_misc.census_catalog build
+python -m hrmd_ma_misc.census_catalog search "sex by age"
+python -m hrmd_ma_misc.census_catalog group B01001
+
+(Add --endpoint https://api.census.gov/data/2019/acs/acs1 etc. for other
+datasets.)
+'''
+# Imports: Standard library.
+import argparse
+import re
+import sqlite3
+import time
+
+# Imports: Third party.
+import requests
+
+# Define global variables.
+path_catalog_default = 'census_catalog.sqlite'
+endpoint_default = 'https://api.census.gov/data/2022/acs/acs5'
+
+class VariableCatalog:
+
+    def __init__(self, path_db = path_catalog_default):
+
+        self.path_db = path_db
+        self.connection = sqlite3.connect(path_db)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS datasets (
+                    endpoint TEXT PRIMARY KEY,
+                    built    REAL
+                )''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS variables (
+                    endpoint       TEXT,
+                    key            TEXT,
+                    label          TEXT,
+                    concept        TEXT,
+                    group_name     TEXT,
+                    predicate_type TEXT,
+                    PRIMARY KEY (endpoint, key)
+                )''')
+            self.connection.execute('''
+                CREATE INDEX IF NOT EXISTS variables_by_group
+                ON variables (endpoint, group_name)''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS groups (
+                    endpoint    TEXT,
+                    name        TEXT,
+                    description TEXT,
+                    PRIMARY KEY (endpoint, name)
+                )''')
+            self.connection.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS variables_fts USING fts5 (
+                    endpoint UNINDEXED, key, label, concept
+                )''')
+
+        return
+
+    def is_built(self, endpoint):
+
+        row = self.connection.execute('SELECT built FROM datasets WHERE endpoint = ?',
+                    (endpoint.rstrip('/'),)).fetchone()
+
+        return row is not None
+
+    def build(self, endpoint, overwrite = False, session = None):
+        '''
+        Download the variable and group lists for a dataset and store them.
+        Nothing is downloaded if the dataset is already in the catalog, unless
+        'overwrite' is set.
+        '''
+
+        endpoint = endpoint.rstrip('/')
+        if self.is_built(endpoint) and not overwrite:
+            return
+
+        if session is None:
+            session = requests.Session()
+
+        print('Downloading variable catalog for {:}'.format(endpoint))
+        response = session.get('{:}/variables.json'.format(endpoint))
+        response.raise_for_status()
+        variables = response.json()['variables']
+
+        response = session.get('{:}/groups.json'.format(endpoint))
+        response.raise_for_status()
+        groups = response.json()['groups']
+
+        self.store(endpoint, variables, groups)
+
+        return
+
+    def store(self, endpoint, variables, groups):
+        '''
+        Store the contents of variables.json ('variables', a dictionary keyed
+        by variable) and groups.json ('groups', a list) for a dataset,
+        replacing any previous version.
+        '''
+
+        endpoint = endpoint.rstrip('/')
+        variable_rows = [(endpoint, key, info.get('label', ''), info.get('concept', ''),
+                            info.get('group', ''), info.get('predicateType', ''))
+                            for key, info in variables.items()]
+        group_rows = [(endpoint, group['name'], group.get('description', ''))
+                        for group in groups]
+
+        with self.connection:
+
+            for table in ['variables', 'groups', 'variables_fts']:
+                self.connection.execute('DELETE FROM {:} WHERE endpoint = ?'.format(table),
+                        (endpoint,))
+
+            self.connection.executemany('INSERT INTO variables VALUES (?, ?, ?, ?, ?, ?)',
+                    variable_rows)
+            self.connection.executemany('INSERT INTO groups VALUES (?, ?, ?)',
+                    group_rows)
+            self.connection.executemany('INSERT INTO variables_fts VALUES (?, ?, ?, ?)',
+                    [row[:4] for row in variable_rows])
+            self.connection.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?)',
+                    (endpoint, time.time()))
+
+        return
+
+    def search(self, endpoint, text, limit = 20):
+        '''
+        Find variables whose key, label or concept match the search words,
+        best matches first. Returns a list of (key, label, concept) tuples.
+        '''
+
+        # Quote each word, so that characters such as '-' are not read as
+        # search operators.
+        words = ['"{:}"'.format(word.replace('"', '')) for word in text.split()]
+        rows = self.connection.execute('''
+            SELECT key, label, concept FROM variables_fts
+            WHERE endpoint = ? AND variables_fts MATCH ?
+            ORDER BY rank LIMIT ?''',
+            (endpoint.rstrip('/'), ' '.join(words), limit)).fetchall()
+
+        return rows
+
+    def get_variable(self, endpoint, key):
+        '''
+        Get the (label, concept, group) of a variable, or None if it is not in
+        the catalog.
+        '''
+
+        row = self.connection.execute('''
+            SELECT label, concept, group_name FROM variables
+            WHERE endpoint = ? AND key = ?''', (endpoint.rstrip('/'), key)).fetchone()
+
+        return row
+
+    def get_group_variables(self, endpoint, group, suffixes = ('E',)):
+        '''
+        Get the (key, label) pairs of the variables in a group, sorted by key.
+        By default only estimates (keys ending in 'E') are returned; use
+        suffixes = ('E', 'M') to include margins of error.
+        '''
+
+        rows = self.connection.execute('''
+            SELECT key, label FROM variables
+            WHERE endpoint = ? AND group_name = ? ORDER BY key''',
+            (endpoint.rstrip('/'), group)).fetchall()
+        rows = [row for row in rows if row[0].endswith(tuple(suffixes))]
+
+        return rows
+
+    def check_variables(self, endpoint, variable_keys):
+        '''
+        Return the variable keys which are not in the catalog for a dataset.
+        '''
+
+        endpoint = endpoint.rstrip('/')
+        known = set([key for (key,) in self.connection.execute(
+                        'SELECT key FROM variables WHERE endpoint = ?', (endpoint,))])
+        unknown_keys = [key for key in variable_keys if key not in known]
+
+        return unknown_keys
+
+    def close(self):
+
+        self.connection.close()
+
+        return
+
+def parse_age_bracket(label_part):
+    '''
+    Convert an age bracket from a variable label to (lo, hi), where hi is None
+    for open-ended brackets, e.g.
+        'Under 5 years'     -> (0, 4)
+        '5 to 9 years'      -> (5, 9)
+        '18 and 19 years'   -> (18, 19)
+        '20 years'          -> (20, 20)
+        '85 years and over' -> (85, None)
+    Returns None if the label is not an age bracket.
+    '''
+
+    match = re.fullmatch(r'Under (\d+) years?', label_part)
+    if match:
+        return 0, int(match.group(1)) - 1
+
+    match = re.fullmatch(r'(\d+) (?:to|and) (\d+) years?', label_part)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+
+    match = re.fullmatch(r'(\d+) years? and over', label_part)
+    if match:
+        return int(match.group(1)), None
+
+    match = re.fullmatch(r'(\d+) years?', label_part)
+    if match:
+        return int(match.group(1)), int(match.group(1))
+
+    return None
+
+def make_header(key, label):
+    '''
+    Make a short (10 characters or less) human-readable column header for a
+    variable.
+    Totals and sex-by-age variables follow the scheme in define_headers() in
+    download_US_census_data.py, e.g. 'Estimate!!Total:!!Male:!!Under 5 years'
+    gives 'pM_00_04' ('m' instead of 'p' for margins of error). Other
+    variables use their key without the underscore, e.g. 'B19013001E'.
+    '''
+
+    parts = [part.rstrip(':') for part in label.split('!!')]
+    if key.endswith('M'):
+        pop_str = 'm'
+    else:
+        pop_str = 'p'
+
+    sex_codes = {'Male' : 'M', 'Female' : 'F'}
+    if parts[1:2] == ['Total']:
+
+        if len(parts) == 2:
+            return pop_str
+
+        if parts[2] in sex_codes:
+
+            header = '{:}{:}'.format(pop_str, sex_codes[parts[2]])
+            if len(parts) == 3:
+                return header
+
+            age_bracket = parse_age_bracket(parts[3])
+            if (len(parts) == 4) and (age_bracket is not None):
+
+                lo, hi = age_bracket
+                if hi is None:
+                    return '{:}_{:02d}pls'.format(header, lo)
+
+                return '{:}_{:02d}_{:02d}'.format(header, lo, hi)
+
+    return key.replace('_', '')
+
+def define_headers_from_catalog(catalog, endpoint, group, suffixes = ('E',), include_name = True):
+    '''
+    Generate the variable keys and human-readable headers for all variables in
+    a group, in the same form as define_headers() in
+    download_US_census_data.py, using only the local catalog (see
+    make_header()).
+    '''
+
+    if not catalog.is_built(endpoint):
+        raise ValueError('No catalog for {:}, run VariableCatalog.build() first'.format(endpoint))
+
+    keys = []
+    headers = []
+    for key, label in catalog.get_group_variables(endpoint, group, suffixes = suffixes):
+
+        keys.append(key)
+        headers.append(make_header(key, label))
+
+    if not keys:
+        raise ValueError('Group "{:}" not found in catalog for {:}'.format(group, endpoint))
+
+    # The place name is a special key.
+    if include_name:
+        keys.append('NAME')
+        headers.append('name')
+
+    return keys, headers
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Build and search a local catalog of US Census API variables.")
+    parser.add_argument("command", choices = ['build', 'search', 'group', 'check'], help = "'build' the catalog, 'search' it, list the variables and headers of a 'group', or 'check' variable keys.")
+    parser.add_argument("terms", nargs = '*', help = "Search words, group name, or variable keys.")
+    parser.add_argument("--endpoint", default = endpoint_default, help = "API endpoint of the dataset.")
+    parser.add_argument("--path_catalog", default = path_catalog_default, help = "Path of the catalog database.")
+    parser.add_argument("--overwrite", action = 'store_true', help = "Download the catalog again even if it exists.")
+    args = parser.parse_args()
+
+    catalog = VariableCatalog(args.path_catalog)
+    if args.command == 'build':
+        catalog.build(args.endpoint, overwrite = args.overwrite)
+
+    elif args.command == 'search':
+        for key, label, concept in catalog.search(args.endpoint, ' '.join(args.terms)):
+            print('{:<14} {:} ({:})'.format(key, label, concept))
+
+    elif args.command == 'group':
+        keys, headers = define_headers_from_catalog(catalog, args.endpoint, args.terms[0])
+        for key, header in zip(keys, headers):
+            print(key, header)
+
+    elif args.command == 'check':
+        unknown_keys = catalog.check_variables(args.endpoint, args.terms)
+        if unknown_keys:
+            print('Unknown variables: {:}'.format(', '.join(unknown_keys)))
+        else:
+            print('All variables found.')
+
+    catalog.close()
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,191 @@
+'''
+A persistent local store of US Census API results, used by
+download_US_census_data.py.
+
+Values are stored in an SQLite database, one row per (endpoint, admin level,
+GEOID, variable), so results from different requests can be merged by
+upserting them. The store also records which partitions of a query (see
+define_query_partitions() in download_US_census_data.py) it holds, and for
+which variables, so that only the missing partitions need to be requested when
+a query grows, for example when another state is added.
+Output files are then exported from the store (see CensusStore.iter_rows()).
+'''
+# Imports: Standard library.
+from itertools import groupby
+import json
+import sqlite3
+import time
+
+def describe_partition(partition):
+    '''
+    Get the state and county codes of a partition, which is a list of
+    (name, value) tuples for the "FOR" and "IN" clauses of a query. The county
+    is '*' for partitions covering a whole state.
+    '''
+
+    state = None
+    county = '*'
+    for name, value in partition:
+
+        if name != 'in':
+            continue
+
+        level, code = value.split(':')
+        if level == 'state':
+            state = code
+        elif level == 'county':
+            county = code
+
+    return state, county
+
+class CensusStore:
+
+    def __init__(self, path_db):
+
+        self.path_db = path_db
+        self.connection = sqlite3.connect(path_db)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS partitions (
+                    endpoint  TEXT,
+                    adm_level TEXT,
+                    state     TEXT,
+                    county    TEXT,
+                    variables TEXT,
+                    header    TEXT,
+                    n_rows    INTEGER,
+                    fetched   REAL,
+                    PRIMARY KEY (endpoint, adm_level, state, county, variables)
+                )''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS records (
+                    endpoint  TEXT,
+                    adm_level TEXT,
+                    geoid     TEXT,
+                    variable  TEXT,
+                    value     TEXT,
+                    PRIMARY KEY (endpoint, adm_level, geoid, variable)
+                ) WITHOUT ROWID''')
+
+        return
+
+    def find_missing_partitions(self, endpoint, adm_level, variable_keys, partitions):
+        '''
+        Return the partitions which are not held in the store for all of the
+        requested variables.
+        '''
+
+        variable_keys = set(variable_keys)
+        held = {}
+        for state, county, variables in self.connection.execute('''
+                SELECT state, county, variables FROM partitions
+                WHERE endpoint = ? AND adm_level = ?''', (endpoint, adm_level)):
+
+            held.setdefault((state, county), set()).update(json.loads(variables))
+
+        missing_partitions = [partition for partition in partitions if not
+                    variable_keys.issubset(held.get(describe_partition(partition), set()))]
+
+        return missing_partitions
+
+    def upsert_partition(self, endpoint, adm_level, partition, variable_keys, rows, id_components):
+        '''
+        Insert or update the values in the response for one partition (a list
+        of rows, header first), and record that the partition is held.
+        'id_components' gives the columns used to build the GEOID (see
+        define_id_components() in download_US_census_data.py).
+        '''
+
+        state, county = describe_partition(partition)
+        header = rows[0] if rows else []
+
+        def iter_records():
+            id_indices = [header.index(column) for column, _ in id_components]
+            for row in rows[1:]:
+
+                geoid = ''.join([row[i].zfill(n_digits) for i, (_, n_digits) in
+                                    zip(id_indices, id_components)])
+                for variable, value in zip(header, row):
+
+                    yield (endpoint, adm_level, geoid, variable, value)
+
+        # Each partition is stored in a single transaction, so an interrupted
+        # run keeps the partitions which were already complete.
+        with self.connection:
+
+            if rows:
+                self.connection.executemany('''
+                    INSERT INTO records (endpoint, adm_level, geoid, variable, value)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (endpoint, adm_level, geoid, variable)
+                    DO UPDATE SET value = excluded.value''', iter_records())
+
+            self.connection.execute('''
+                INSERT OR REPLACE INTO partitions
+                (endpoint, adm_level, state, county, variables, header, n_rows, fetched)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (endpoint, adm_level, state, county,
+                    json.dumps(sorted(variable_keys)), json.dumps(header),
+                    max(len(rows) - 1, 0), time.time()))
+
+        return
+
+    def get_header(self, endpoint, adm_level, variable_keys):
+        '''
+        Get the header of the exported rows: the requested variables in the
+        requested order, followed by the geography columns in the order used
+        by the API.
+        '''
+
+        variable_keys = list(variable_keys)
+        for header, variables in self.connection.execute('''
+                SELECT header, variables FROM partitions
+                WHERE endpoint = ? AND adm_level = ? AND n_rows > 0''',
+                (endpoint, adm_level)):
+
+            # The API puts the geography columns after the requested variables.
+            variables = set(json.loads(variables))
+            geography_columns = [column for column in json.loads(header) if
+                                    column not in variables]
+            return variable_keys + geography_columns
+
+        return None
+
+    def iter_rows(self, endpoint, adm_level, variable_keys, state_codes = None):
+        '''
+        Yield the stored values for an admin level in the same layout as an API
+        response (header first, then one row per GEOID, sorted by GEOID),
+        optionally only for some states (zero-padded state FIPS codes).
+        Variables which are not held for a GEOID are given as None.
+        '''
+
+        header = self.get_header(endpoint, adm_level, variable_keys)
+        if header is None:
+            return
+
+        yield header
+
+        query = '''
+            SELECT geoid, variable, value FROM records
+            WHERE endpoint = ? AND adm_level = ? AND variable IN ({:})'''.format(
+                    ','.join(['?'] * len(header)))
+        params = [endpoint, adm_level] + header
+        if state_codes is not None:
+            query = query + ' AND substr(geoid, 1, 2) IN ({:})'.format(
+                                ','.join(['?'] * len(state_codes)))
+            params = params + list(state_codes)
+        query = query + ' ORDER BY geoid'
+
+        cursor = self.connection.execute(query, params)
+        for _, records in groupby(cursor, key = lambda record: record[0]):
+
+            values = {variable : value for _, variable, value in records}
+            yield [values.get(column) for column in header]
+
+        return
+
+    def close(self):
+
+        self.connection.close()
+
+        return
@@ -0,0 +1,59 @@
+'''
+Single command-line entry point for the download scripts:
+
+hrmd-ma-misc census [options]
+hrmd-ma-misc 3dep [options]
+hrmd-ma-misc mcdwd [date] [options]
+hrmd-ma-misc report output/telemetry.jsonl
+
+(or 'python -m hrmd_ma_misc ...'). Options can be given before the command
+with --config, e.g.
+
+hrmd-ma-misc --config /etc/hrmd_ma_misc.ini mcdwd --watch
+
+Each command imports only the module which runs it, so heavy dependencies
+(pandas, numpy, rasterio) are only loaded when a command needs them and the
+commands start quickly when launched from cron. See
+'hrmd-ma-misc <command> --help' for the options of each command, whose
+defaults can be set in a config file or in the environment (see config.py).
+'''
+# Imports: Standard library.
+import argparse
+import importlib
+
+# Imports: Local.
+from .config import load_settings
+
+# The module which runs each command, and a description of it.
+commands = {
+    'census' : ('download_US_census_data', 'Download US Census data via the API.'),
+    '3dep'   : ('download_3DEP_data', 'Download 3DEP 1 m DEM tiles.'),
+    'mcdwd'  : ('download_MCDWD_flood_data', 'Download MCDWD flood maps.'),
+    'report' : ('download_telemetry', 'Summarise the telemetry log of a download command.'),
+}
+
+def main(argv = None):
+
+    epilog = 'Commands:\n' + '\n'.join(['  {:<8} {:}'.format(command, description)
+                for command, (_, description) in commands.items()])
+    parser = argparse.ArgumentParser(prog = 'hrmd-ma-misc',
+                description = "Download and process data for MapAction responses.",
+                epilog = epilog, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default = None, help = "Config file (default: $HRMD_MA_MISC_CONFIG, or ~/.config/hrmd_ma_misc.ini if it exists).")
+    parser.add_argument("command", choices = list(commands), help = "Command to run.")
+    parser.add_argument("args", nargs = argparse.REMAINDER, help = "Options of the command (see 'hrmd-ma-misc <command> --help').")
+    args = parser.parse_args(argv)
+
+    module_name, _ = commands[args.command]
+    module = importlib.import_module('.' + module_name, __package__)
+    if args.command == 'report':
+        module.main(['report'] + args.args)
+    else:
+        module.main(args.args, settings = load_settings(args.command,
+                path_config = args.config))
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,372 @@
+'''
+Estimate the number of people in flooded areas, by age and sex, by combining
+MCDWD flood maps (from download_MCDWD_flood_data.py) with census populations
+(from download_US_census_data.py).
+
+For each census geography (e.g. each tract), the flooded fraction is the
+number of flooded pixels divided by the number of pixels with valid data, and
+the exposed population in each age/sex column (see define_headers() in
+download_US_census_data.py) is the flooded fraction times the population,
+i.e. people are assumed to be spread evenly over each geography.
+
+The geography boundaries (e.g. a TIGER/Line or cartographic boundary file
+with a GEOID property, as GeoJSON) are rasterized onto the grid of each
+MCDWD tile only once, and the resulting label raster (the index of the
+geography covering each pixel) is cached, so each new daily granule only
+needs a few NumPy bincounts. Granules are processed in parallel in worker
+processes.
+Note that geographies smaller than a pixel (250 m) may not cover any pixel
+centre, in which case they get no flooded fraction.
+
+MCDWD pixel values are 0 (no water), 1 (surface water), 2 (recurring flood),
+3 (flood) and 255 (insufficient data). By default only 3 counts as flooded.
+
+Usage:
+
+python -m hrmd_ma_misc.compute_flood_exposure MCDWD_downloads/MCDWD_L3_F2_NRT/2024/275/*.tif \
+    --path_geographies tracts_FL.geojson \
+    --path_census output/US_pop_by_age_sex__tract.json
+'''
+# Imports: Standard library.
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import hashlib
+import json
+import os
+import re
+
+# Imports: Third party.
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+from rasterio.warp import transform_bounds, transform_geom
+
+# Imports: Local.
+from .download_US_census_data import (define_empty_header, define_headers,
+        define_id_components, iter_json_rows)
+
+# Define global variables.
+dir_output = 'output'
+dir_label_cache_default = os.path.join(dir_output, 'flood_exposure_label_cache')
+flooded_values_default = (3,)
+insufficient_data_value = 255
+
+# Label rasters loaded by each worker process (see count_flooded_pixels()).
+worker_labels = {}
+
+def read_geographies(path_geographies, id_property = 'GEOID'):
+    '''
+    Read the GEOIDs and geometries of the features in a GeoJSON file (or, if
+    fiona is installed, any vector format it supports, such as a shapefile).
+    Returns (geoids, geometries, crs).
+    '''
+
+    if path_geographies.endswith(('.geojson', '.json')):
+
+        with open(path_geographies, 'r') as file:
+            geojson = json.load(file)
+
+        features = geojson['features']
+        # GeoJSON coordinates are longitude and latitude.
+        crs = 'EPSG:4326'
+
+    else:
+
+        # fiona is only needed for other vector formats.
+        import fiona
+        with fiona.open(path_geographies) as src:
+            features = [{'properties' : dict(feature['properties']),
+                         'geometry' : dict(feature['geometry'])} for feature in src]
+            crs = src.crs
+
+    features = [feature for feature in features if feature['geometry'] is not None]
+    geoids = [str(feature['properties'][id_property]) for feature in features]
+    geometries = [feature['geometry'] for feature in features]
+
+    return geoids, geometries, crs
+
+def get_geometry_bounds(geometry):
+    '''
+    Get the (x_min, y_min, x_max, y_max) bounds of a GeoJSON-like Polygon or
+    MultiPolygon.
+    '''
+
+    if geometry['type'] == 'Polygon':
+        rings = geometry['coordinates']
+    elif geometry['type'] == 'MultiPolygon':
+        rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+    else:
+        raise ValueError('Geometry type "{:}" not implemented or wrong'.format(geometry['type']))
+
+    points = np.concatenate([np.asarray(ring, dtype = float)[:, :2] for ring in rings])
+    x_min, y_min = points.min(axis = 0)
+    x_max, y_max = points.max(axis = 0)
+
+    return x_min, y_min, x_max, y_max
+
+def define_grid_key(src):
+    '''
+    Describe the grid (CRS, transform and shape) of a raster, so granules on
+    the same grid (the same MCDWD tile) can share a label raster.
+    '''
+
+    grid_key = json.dumps([src.crs.to_wkt(), list(src.transform)[:6], src.width, src.height])
+
+    return grid_key
+
+def define_label_cache_path(dir_cache, path_geographies, grid_key):
+    '''
+    Define the file name of a cached label raster. It changes if the
+    geographies file or the grid changes.
+    '''
+
+    stat = os.stat(path_geographies)
+    description = json.dumps([os.path.abspath(path_geographies), stat.st_size,
+                    stat.st_mtime, grid_key])
+    key = hashlib.sha256(description.encode('utf-8')).hexdigest()[:16]
+    path_cache = os.path.join(dir_cache, 'labels_{:}.npz'.format(key))
+
+    return path_cache
+
+def build_label_raster(geometries, geographies_crs, src):
+    '''
+    Rasterize geographies onto the grid of a raster. Each pixel is given the
+    index (starting at 1) of the geography which covers its centre, or 0.
+    Only geographies which overlap the raster are rasterized.
+    '''
+
+    # Find the geographies which overlap the raster.
+    x_min, y_min, x_max, y_max = transform_bounds(src.crs, geographies_crs,
+                                    *src.bounds, densify_pts = 21)
+    shapes = []
+    for i, geometry in enumerate(geometries):
+
+        g_x_min, g_y_min, g_x_max, g_y_max = get_geometry_bounds(geometry)
+        if (g_x_max < x_min) or (g_x_min > x_max) or (g_y_max < y_min) or (g_y_min > y_max):
+            continue
+
+        shapes.append((transform_geom(geographies_crs, src.crs, geometry), i + 1))
+
+    if not shapes:
+        return np.zeros((src.height, src.width), dtype = 'int32')
+
+    labels = rasterize(shapes, out_shape = (src.height, src.width),
+                transform = src.transform, fill = 0, dtype = 'int32')
+
+    return labels
+
+def prepare_label_rasters(paths_granules, path_geographies, geometries, geographies_crs, dir_cache = dir_label_cache_default):
+    '''
+    Make sure there is a cached label raster for the grid of each granule.
+    Returns a dictionary mapping each granule path to its label raster path.
+    '''
+
+    os.makedirs(dir_cache, exist_ok = True)
+    label_paths = {}
+    for path_granule in paths_granules:
+
+        with rasterio.open(path_granule) as src:
+
+            path_labels = define_label_cache_path(dir_cache, path_geographies,
+                                define_grid_key(src))
+            if not os.path.exists(path_labels):
+
+                print('Rasterizing geographies onto the grid of {:}'.format(
+                        os.path.basename(path_granule)))
+                labels = build_label_raster(geometries, geographies_crs, src)
+
+                # Write to a temporary file first so that a partial file is
+                # never mistaken for a complete one.
+                path_tmp = '{:}.tmp.npz'.format(path_labels[:-4])
+                np.savez_compressed(path_tmp, labels = labels)
+                os.replace(path_tmp, path_labels)
+
+        label_paths[path_granule] = path_labels
+
+    return label_paths
+
+def count_flooded_pixels(path_granule, path_labels, n_labels, flooded_values = flooded_values_default):
+    '''
+    Count the valid and flooded pixels in each geography for one granule.
+    Runs in a worker process; label rasters are loaded once per process.
+    Returns (n_valid, n_flooded), arrays of length n_labels + 1 indexed by
+    label (label 0 is outside all geographies).
+    '''
+
+    if path_labels not in worker_labels:
+        with np.load(path_labels) as npz:
+            worker_labels[path_labels] = npz['labels']
+    labels = worker_labels[path_labels]
+
+    with rasterio.open(path_granule) as src:
+        data = src.read(1)
+
+    valid = (data != insufficient_data_value)
+    flooded = np.isin(data, flooded_values)
+    n_valid = np.bincount(labels[valid], minlength = n_labels + 1)
+    n_flooded = np.bincount(labels[flooded], minlength = n_labels + 1)
+
+    return n_valid, n_flooded
+
+def parse_granule_name(path_granule):
+    '''
+    Get the (product, date) of a granule from its name, e.g.
+    ('MCDWD_L3_F2_NRT', '2024275') from
+    MCDWD_L3_F2_NRT.A2024275.h08v05.061.2024275052248.tif
+    Granules with the same product and date are different tiles of the same
+    flood map.
+    '''
+
+    match = re.match(r'(MCDWD_L3_\w+?)\.A(\d{7})\.', os.path.basename(path_granule))
+    if match is None:
+        raise ValueError('Granule name "{:}" not implemented or wrong'.format(
+                            os.path.basename(path_granule)))
+
+    return match.group(1), match.group(2)
+
+def read_population(path_census, geoids, variable_keys, variable_headers):
+    '''
+    Read the population columns of a census JSON file (from request_data() in
+    download_US_census_data.py) into an array with one row per label, in the
+    order of 'geoids' (row 0, for label 0, is zero), and one column per
+    numeric variable. Also returns the headers of the columns and the names
+    of the geographies.
+    '''
+
+    # The admin level is the last part of the file name.
+    file_name, _ = os.path.splitext(os.path.basename(path_census))
+    adm_level = file_name.split('__')[-1]
+    _, id_components = define_id_components(adm_level)
+
+    label_by_geoid = {geoid : i + 1 for i, geoid in enumerate(geoids)}
+    with open(path_census, 'r') as file:
+
+        # A census file with no geographies is just '[]'.
+        rows = iter_json_rows(file)
+        header = next(rows, None)
+        if header is None:
+            header = define_empty_header(adm_level, variable_keys)
+        id_indices = [header.index(column) for column, _ in id_components]
+        key_header_dict = dict(zip(variable_keys, variable_headers))
+        columns = [column for column in header if column in key_header_dict and column != 'NAME']
+        column_indices = [header.index(column) for column in columns]
+
+        population = np.zeros((len(geoids) + 1, len(columns)))
+        names = [''] * (len(geoids) + 1)
+        for row in rows:
+
+            geoid = ''.join([row[i].zfill(n_digits) for i, (_, n_digits) in
+                                zip(id_indices, id_components)])
+            label = label_by_geoid.get(geoid)
+            if label is None:
+                continue
+
+            # Negative values flag unavailable estimates.
+            population[label] = [max(float(row[i] or 0), 0.0) for i in column_indices]
+            if 'NAME' in header:
+                names[label] = row[header.index('NAME')]
+
+    population_headers = [key_header_dict[column] for column in columns]
+
+    return population, population_headers, names
+
+def write_exposure(path_out, geoids, names, n_valid, n_flooded, population, population_headers):
+    '''
+    Write the flooded fraction and the exposed population in each column for
+    each geography which has valid pixels.
+    '''
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        flooded_fraction = np.where(n_valid > 0, n_flooded / n_valid, 0.0)
+    exposed = flooded_fraction[:, np.newaxis] * population
+
+    with open(path_out, mode = 'w', newline = '') as file:
+
+        writer = csv.writer(file)
+        writer.writerow(['GEOID', 'name', 'n_valid', 'n_flooded', 'flood_frac'] +
+                            population_headers)
+        for label in np.flatnonzero(n_valid[1:]) + 1:
+
+            writer.writerow([geoids[label - 1], names[label], n_valid[label],
+                    n_flooded[label], '{:.4f}'.format(flooded_fraction[label])] +
+                    ['{:.1f}'.format(value) for value in exposed[label]])
+
+    return exposed[1:].sum(axis = 0)
+
+def compute_flood_exposure(paths_granules, path_geographies, path_census, dir_out = dir_output, id_property = 'GEOID', flooded_values = flooded_values_default, dir_cache = dir_label_cache_default, max_workers = 4):
+    '''
+    Compute the exposed population for each flood map (all tiles of one
+    product and date) in a list of granules, and write one CSV file per flood
+    map. Returns the list of output paths.
+    '''
+
+    geoids, geometries, geographies_crs = read_geographies(path_geographies,
+                                            id_property = id_property)
+    label_paths = prepare_label_rasters(paths_granules, path_geographies,
+                        geometries, geographies_crs, dir_cache = dir_cache)
+    n_labels = len(geoids)
+
+    variable_keys, variable_headers = define_headers()
+    population, population_headers, names = read_population(path_census, geoids,
+                                                variable_keys, variable_headers)
+
+    # Count the pixels in each granule in parallel, and add up the tiles of
+    # each flood map.
+    counts = {}
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+
+        futures = [(path_granule, executor.submit(count_flooded_pixels, path_granule,
+                        label_paths[path_granule], n_labels, flooded_values))
+                    for path_granule in paths_granules]
+        for path_granule, future in futures:
+
+            n_valid, n_flooded = future.result()
+            flood_map = parse_granule_name(path_granule)
+            if flood_map in counts:
+                counts[flood_map][0] += n_valid
+                counts[flood_map][1] += n_flooded
+            else:
+                counts[flood_map] = [n_valid, n_flooded]
+
+    census_name, _ = os.path.splitext(os.path.basename(path_census))
+    adm_level = census_name.split('__')[-1]
+    os.makedirs(dir_out, exist_ok = True)
+    paths_out = []
+    for (product, date), (n_valid, n_flooded) in sorted(counts.items()):
+
+        path_out = os.path.join(dir_out, 'flood_exposure__{:}_A{:}__{:}.csv'.format(
+                                product, date, adm_level))
+        totals = write_exposure(path_out, geoids, names, n_valid, n_flooded,
+                        population, population_headers)
+        print('{:} A{:}: {:.0f} people exposed, written to {:}'.format(product, date,
+                totals[population_headers.index('p')] if 'p' in population_headers else totals.sum(),
+                path_out))
+        paths_out.append(path_out)
+
+    return paths_out
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Estimate the population in flooded areas from MCDWD flood maps and census data.")
+    parser.add_argument("paths_granules", nargs = '+', help = "MCDWD granule GeoTIFFs (one or more tiles of one or more days).")
+    parser.add_argument("--path_geographies", required = True, help = "Boundaries of the census geographies (GeoJSON, or any format fiona reads).")
+    parser.add_argument("--path_census", required = True, help = "Census JSON file from download_US_census_data.py, e.g. output/US_pop_by_age_sex__tract.json.")
+    parser.add_argument("--id_property", default = 'GEOID', help = "Name of the property holding the GEOID in the geographies file.")
+    parser.add_argument("--include_recurring", action = 'store_true', help = "Also count recurring floods (value 2) as flooded.")
+    parser.add_argument("--dir_out", default = dir_output, help = "Folder for the output CSV files.")
+    parser.add_argument("--dir_cache", default = dir_label_cache_default, help = "Folder for the cached label rasters.")
+    parser.add_argument("--max_workers", type = int, default = 4, help = "Number of worker processes.")
+    args = parser.parse_args()
+
+    flooded_values = (2, 3) if args.include_recurring else flooded_values_default
+    compute_flood_exposure(args.paths_granules, args.path_geographies, args.path_census,
+            dir_out = args.dir_out, id_property = args.id_property,
+            flooded_values = flooded_values, dir_cache = args.dir_cache,
+            max_workers = args.max_workers)
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,102 @@
+'''
+Settings for the download commands (see cli.py), read from a config file and
+from environment variables, so scheduled runs need no edited scripts.
+
+The config file is an INI file with one section per command, e.g.
+
+[census]
+dir_output = /data/census
+path_api_key = /etc/hrmd_ma_misc/api_key_US_census.txt
+
+[3dep]
+download_dir = /data/3DEP_tiles
+area_bbox = -82.2,26.9,-82.0,27.1
+
+[mcdwd]
+dir_output = /data/MCDWD_downloads
+path_bearer_token = /etc/hrmd_ma_misc/earthdata_bearer_token.txt
+
+It is given with --config, or in the environment variable
+HRMD_MA_MISC_CONFIG, otherwise ~/.config/hrmd_ma_misc.ini is used if it
+exists. Any setting can also be given as an environment variable named
+HRMD_MA_MISC_<COMMAND>_<SETTING>, e.g. HRMD_MA_MISC_MCDWD_DIR_OUTPUT, which
+overrides the config file. Command-line options override both.
+The settings each command accepts are the long options of its command line
+(see e.g. 'hrmd-ma-misc mcdwd --help').
+'''
+# Imports: Standard library.
+import configparser
+import os
+
+# Define global variables.
+env_prefix = 'HRMD_MA_MISC_'
+path_config_default = os.path.join('~', '.config', 'hrmd_ma_misc.ini')
+
+def find_config_file(path_config = None):
+    '''
+    Get the path of the config file (see the module docstring), or None if
+    there is none.
+    '''
+
+    if path_config is None:
+        path_config = os.environ.get(env_prefix + 'CONFIG')
+
+    if path_config is None:
+        path_config = os.path.expanduser(path_config_default)
+        if not os.path.exists(path_config):
+            return None
+
+    return path_config
+
+def load_settings(command, path_config = None):
+    '''
+    Get the settings of one command (e.g. 'mcdwd') as a dictionary of
+    strings, from its section of the config file and from the environment.
+    '''
+
+    settings = {}
+    path_config = find_config_file(path_config)
+    if path_config is not None:
+
+        parser = configparser.ConfigParser(interpolation = None)
+        with open(path_config, 'r') as file:
+            parser.read_file(file)
+        if parser.has_section(command):
+            settings.update(parser[command])
+
+    prefix = '{:}{:}_'.format(env_prefix, command.upper())
+    for name, value in os.environ.items():
+
+        if name.startswith(prefix):
+            settings[name[len(prefix):].lower()] = value
+
+    return settings
+
+def parse_bool(value):
+    '''
+    Convert a setting such as 'true', 'no' or '1' to a boolean.
+    '''
+
+    if isinstance(value, bool):
+        return value
+
+    if value.strip().lower() in ['1', 'true', 'yes', 'on']:
+        return True
+    elif value.strip().lower() in ['0', 'false', 'no', 'off']:
+        return False
+    else:
+        raise ValueError('Boolean setting "{:}" not implemented or wrong'.format(value))
+
+def parse_list(value, type_ = str):
+    '''
+    Convert a comma-separated setting such as '-82.2,26.9,-82.0,27.1' to a
+    list, or None if it is empty or 'none'.
+    '''
+
+    if (value is None) or isinstance(value, (list, tuple)):
+        return value
+
+    if value.strip().lower() in ['', 'none']:
+        return None
+
+    return [type_(item.strip()) for item in value.split(',')]
@@ -0,0 +1,416 @@
+'''
+Download some specific high-resolution LIDAR-derived DEM data files for Florida from the 3-D Elevation Program (3DEP).
+Several tiles are downloaded at the same time over a shared pool of connections.
+Each tile is first written to a '.part' file, which is renamed once its size
+matches the size reported by the server, so an interrupted download never
+leaves a file which looks complete. Re-running the script resumes partial
+downloads with HTTP range requests. Downloaded tiles are recorded in a
+manifest (see download_manifest.py), so re-running the script only downloads
+tiles again if they have changed on the server.
+
+If only a small area is needed, set 'windowed' to read just the part of each
+tile inside the area (the tiles are Cloud-Optimized GeoTIFFs, so only the
+header and the internal blocks covering the area are requested) and write it
+to a clipped local GeoTIFF. This needs rasterio. Clips are also recorded in
+the manifest, so they are only read again if the tile or the area changes.
+
+With --build_mosaic, once all tiles are downloaded they are merged into a
+single raster with overviews (see mosaic_3DEP_tiles.py). This needs rasterio
+(pip install .[raster]); without it, the mosaic is skipped.
+
+Usage:
+hrmd-ma-misc 3dep
+hrmd-ma-misc 3dep --area_bbox=-82.2,26.9,-82.0,27.1 --windowed
+hrmd-ma-misc 3dep --build_mosaic
+
+The settings below are the defaults, which can be changed in the config file
+or the environment (see config.py) or on the command line.
+
+Warning:
+Each tile is large so the full output is very large.
+'''
+# Imports: Standard library.
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib.util
+import math
+import os
+import time
+
+# Imports: Third party.
+import requests
+from requests.adapters import HTTPAdapter
+
+# Imports: Local.
+from .config import load_settings, parse_bool, parse_list
+from .download_manifest import (DownloadManifest, compute_sha256, download_file,
+        get_remote_metadata)
+from .download_telemetry import record_event, start_telemetry, stop_telemetry
+from .fetch_scheduler import FailedJobQueue, FetchScheduler
+from .index_3DEP_tiles import (bbox_to_ring, find_intersecting_tiles,
+        get_tile_bounds, get_utm_bounds, list_project_tiles, read_geojson_rings)
+
+# Base URL format
+base_url = "https://prd-tnm.s3.amazonaws.com/StagedProducts/Elevation/1m/Projects/FL_Peninsular_FDEM_2018_D19_DRRA/TIFF/USGS_1M_17_x{xtile}y{ytile}_FL_Peninsular_FDEM_2018_D19_DRRA.tif"
+file_name_fmt = "USGS_1M_17_x{xtile}y{ytile}_FL_Peninsular_FDEM_2018_D19_DRRA.tif"
+
+# Local directory to store files
+download_dir = "./output_3DEP_tiles"
+
+# Number of tiles to download at the same time.
+max_workers = 4
+
+# Maximum number of downloads to start per second, and number of times a
+# download which fails because the server is busy or unreachable is retried
+# (see fetch_scheduler.py).
+requests_per_second = 10.0
+max_retries = 5
+
+# Area to download, as a (lon_min, lat_min, lon_max, lat_max) bounding box or
+# a GeoJSON file of polygons. Only tiles which intersect the area are
+# downloaded (see index_3DEP_tiles.py). If both are None, the tiles from
+# define_tiles() are used.
+area_bbox = None
+path_area_geojson = None
+
+# Set to True to read only the part of each tile inside the area, instead of
+# downloading whole tiles.
+windowed = False
+
+# Set to True to merge the tiles into one raster with overviews once they are
+# all downloaded (see mosaic_3DEP_tiles.py). This needs rasterio.
+build_mosaic_after_download = False
+
+def define_tiles():
+    '''
+    Define the (x, y) indices of the tiles to download.
+    '''
+
+    #
+    # Port Charlotte: (x, y) = (39, 299)
+    # Sarasota: (x, y) = (34, 303)
+    # Loop over x- and y-tiles
+    x_tile_range = (33, 40)
+    y_tile_range = (299, 304)
+    tiles = [(x_tile, y_tile) for x_tile in range(*x_tile_range) for
+                y_tile in range(*y_tile_range)]
+
+    return tiles
+
+def create_session(max_workers):
+    '''
+    Create a requests session whose connection pool is big enough to keep one
+    connection open per worker thread.
+    '''
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+def define_GDAL_HTTP_options():
+    '''
+    GDAL options for reading remote Cloud-Optimized GeoTIFFs efficiently:
+    read the header and tile index with one request, don't try to list the
+    remote directory, and merge the requests for the internal blocks of a
+    window (adjacent blocks into one range, others into parallel requests).
+    '''
+
+    GDAL_HTTP_options = {
+        'GDAL_DISABLE_READDIR_ON_OPEN'       : 'EMPTY_DIR',
+        'CPL_VSIL_CURL_ALLOWED_EXTENSIONS'   : '.tif',
+        'GDAL_INGESTED_BYTES_AT_OPEN'        : '65536',
+        'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES' : 'YES',
+        'GDAL_HTTP_MULTIRANGE'               : 'YES',
+        'GDAL_HTTP_MULTIPLEX'                : 'YES',
+        'VSI_CACHE'                          : 'TRUE',
+    }
+
+    return GDAL_HTTP_options
+
+def define_window_key(url, utm_bounds):
+    '''
+    Define the manifest key of a windowed read: the URL of the tile followed
+    by the bounds of the window, so a clip is read again if the area changes.
+    '''
+
+    key = '{:}#window={:}'.format(url, ','.join(['{:.2f}'.format(value) for
+                                                    value in utm_bounds]))
+
+    return key
+
+def read_tile_window(url, utm_bounds, file_path, session = None, manifest = None):
+    '''
+    Read the part of a remote Cloud-Optimized GeoTIFF inside 'utm_bounds'
+    (easting_min, northing_min, easting_max, northing_max) using HTTP range
+    requests, and write it to a tiled, compressed GeoTIFF.
+    If a DownloadManifest is given, the clip is recorded in it (see
+    define_window_key()), with the ETag and Last-Modified of the tile if a
+    'session' is given. On later runs an existing clip is then only read
+    again if the bounds changed or the server reports that the tile changed
+    (one HEAD request), and tiles which do not overlap the bounds are not
+    requested at all.
+    Returns 'skipped' if the file already exists and cannot be checked,
+    'unchanged' if the tile has not changed, 'empty' if the bounds do not
+    overlap the tile, 'updated' if an existing clip was read again, otherwise
+    'downloaded'.
+    '''
+
+    key = define_window_key(url, utm_bounds)
+    entry = manifest.get(key) if manifest is not None else None
+    if (entry is not None) and (entry['path'] is None):
+        return 'empty'
+
+    result = 'downloaded'
+    if os.path.exists(file_path):
+
+        if (manifest is None) or ((session is None) and (entry is not None)):
+            return 'skipped'
+        result = 'updated'
+
+    # Get the validators of the tile, to check it for changes on later runs.
+    etag = None
+    last_modified = None
+    if (manifest is not None) and (session is not None):
+        _, etag, last_modified = get_remote_metadata(session, url)
+        if (result == 'updated') and (entry is not None) and \
+                (entry['size'] == os.path.getsize(file_path)) and \
+                (etag or last_modified) and \
+                ((etag, last_modified) == (entry['etag'], entry['last_modified'])):
+            manifest.mark_checked(key)
+            return 'unchanged'
+
+    time_start = time.time()
+
+    # rasterio is only needed for windowed reads.
+    import rasterio
+    from rasterio.windows import Window, from_bounds
+
+    with rasterio.Env(**define_GDAL_HTTP_options()):
+        with rasterio.open('/vsicurl/{:}'.format(url)) as src:
+
+            # Find the pixels inside the bounds, rounded outwards.
+            window = from_bounds(*utm_bounds, transform = src.transform)
+            col_off = max(int(math.floor(window.col_off)), 0)
+            row_off = max(int(math.floor(window.row_off)), 0)
+            col_end = min(int(math.ceil(window.col_off + window.width)), src.width)
+            row_end = min(int(math.ceil(window.row_off + window.height)), src.height)
+            if (col_end <= col_off) or (row_end <= row_off):
+                if manifest is not None:
+                    manifest.record(key, None, 0, etag, last_modified, None)
+                return 'empty'
+            window = Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+            data = src.read(window = window)
+
+            profile = src.profile.copy()
+            profile.update(driver = 'GTiff', width = window.width,
+                height = window.height, transform = src.window_transform(window),
+                tiled = True, blockxsize = 256, blockysize = 256, compress = 'deflate',
+                predictor = 3 if data.dtype.kind == 'f' else 2)
+
+    # Write to a temporary file first so that a partial file is never
+    # mistaken for a complete one.
+    part_path = '{:}.part'.format(file_path)
+    with rasterio.open(part_path, 'w', **profile) as dst:
+        dst.write(data)
+    os.replace(part_path, file_path)
+    if manifest is not None:
+        manifest.record(key, file_path, os.path.getsize(file_path), etag,
+                last_modified, compute_sha256(file_path))
+
+    # GDAL does not report the bytes it received, so record the size of the
+    # clipped file instead.
+    record_event('file', url = url, item = os.path.basename(file_path),
+            result = result, output_bytes = os.path.getsize(file_path),
+            duration_s = time.time() - time_start)
+
+    return result
+
+def define_tile_job(x_tile, y_tile, utm_bounds = None, download_dir = download_dir):
+    '''
+    Define the download of one tile as a dictionary with the tile indices,
+    URL, output path and, for windowed reads, the bounds of the window.
+    '''
+
+    # Construct file name
+    file_name = file_name_fmt.format(xtile = x_tile, ytile = y_tile)
+
+    # Construct the full URL
+    file_url = base_url.format(xtile = x_tile, ytile = y_tile)
+
+    if utm_bounds is None:
+        window_bounds = None
+    else:
+        # Only read the part of the tile inside the bounds.
+        file_name = file_name.replace('.tif', '_clip.tif')
+        tile_bounds = get_tile_bounds(x_tile, y_tile)
+        window_bounds = [max(utm_bounds[0], tile_bounds[0]),
+                         max(utm_bounds[1], tile_bounds[1]),
+                         min(utm_bounds[2], tile_bounds[2]),
+                         min(utm_bounds[3], tile_bounds[3])]
+
+    job = {'tile' : [x_tile, y_tile], 'url' : file_url,
+           'file_path' : os.path.join(download_dir, file_name),
+           'window_bounds' : window_bounds}
+
+    return job
+
+def download_tiles(tiles, max_workers = 4, utm_bounds = None, download_dir = download_dir, requests_per_second = requests_per_second, max_retries = max_retries):
+    '''
+    Download the tiles at the same time, using up to 'max_workers' threads.
+    If 'utm_bounds' is given, only the part of each tile inside the bounds is
+    read (see read_tile_window()).
+    Whole tiles and clips are recorded in a manifest in the download
+    directory, so on later runs they are only transferred again if they have
+    changed.
+    Downloads are retried if the server is busy or unreachable (see
+    fetch_scheduler.py). Tiles which still fail are kept in a queue in the
+    download directory, and downloaded first on the next run, even if they
+    are not in 'tiles'.
+    Returns the list of tiles which failed.
+    '''
+
+    # Create download directory if it doesn't exist
+    if not os.path.exists(download_dir):
+        os.makedirs(download_dir)
+
+    session = create_session(max_workers)
+    manifest = DownloadManifest(os.path.join(download_dir, 'download_manifest.sqlite'))
+    failed_jobs = FailedJobQueue(os.path.join(download_dir, 'failed_jobs.sqlite'), '3dep')
+    scheduler = FetchScheduler(max_per_host = max_workers,
+                    requests_per_second = requests_per_second,
+                    max_retries = max_retries, failed_jobs = failed_jobs)
+
+    jobs = [define_tile_job(x_tile, y_tile, utm_bounds = utm_bounds,
+                download_dir = download_dir) for x_tile, y_tile in tiles]
+    file_paths = set([job['file_path'] for job in jobs])
+    queued_jobs = [job for file_path, job in failed_jobs.list() if file_path not in file_paths]
+    if queued_jobs:
+        print(f"Retrying {len(queued_jobs)} tiles which failed in an earlier run.")
+    jobs = queued_jobs + jobs
+
+    failed_tiles = []
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+
+        future_to_tile = {}
+        for job in jobs:
+
+            if job['window_bounds'] is None:
+                future = executor.submit(scheduler.call, job['url'], download_file,
+                                session, job['url'], job['file_path'], manifest = manifest,
+                                job_key = job['file_path'], job = job)
+            else:
+                future = executor.submit(scheduler.call, job['url'], read_tile_window,
+                                job['url'], job['window_bounds'], job['file_path'],
+                                session = session, manifest = manifest,
+                                job_key = job['file_path'], job = job)
+            future_to_tile[future] = (job['tile'][0], job['tile'][1],
+                                        os.path.basename(job['file_path']), job['url'])
+
+        for future in as_completed(future_to_tile):
+
+            x_tile, y_tile, file_name, file_url = future_to_tile[future]
+            try:
+                result = future.result()
+            except (requests.RequestException, IOError, RuntimeError) as error:
+                print(f"Failed to download {file_name} from {file_url}: {error}")
+                failed_tiles.append((x_tile, y_tile))
+                continue
+
+            if result == 'skipped':
+                print(f"File {file_name} already exists, skipping download.")
+            elif result == 'unchanged':
+                print(f"File {file_name} is unchanged on the server, skipping download.")
+            elif result == 'updated':
+                print(f"File {file_name} had changed on the server, downloaded it again.")
+            elif result == 'empty':
+                print(f"Tile {file_name} does not overlap the area, skipping.")
+            else:
+                print(f"Downloaded {file_name}.")
+
+    failed_jobs.close()
+    manifest.close()
+
+    return failed_tiles
+
+def main(argv = None, settings = None):
+    '''
+    Run the download from the command line ('argv', default sys.argv).
+    The defaults of the options are the module settings above, overridden
+    by 'settings' (default: the '3dep' settings from the config file and the
+    environment, see config.py).
+    '''
+
+    if settings is None:
+        settings = load_settings('3dep')
+
+    parser = argparse.ArgumentParser(prog = 'hrmd-ma-misc 3dep',
+                description = "Download 3DEP 1 m DEM tiles for an area of Florida.")
+    parser.add_argument("--download_dir", default = settings.get('download_dir', download_dir), help = "Folder to download the tiles to.")
+    parser.add_argument("--max_workers", type = int, default = settings.get('max_workers', max_workers), help = "Number of tiles to download at the same time.")
+    parser.add_argument("--requests_per_second", type = float, default = settings.get('requests_per_second', requests_per_second), help = "Maximum number of downloads to start per second.")
+    parser.add_argument("--max_retries", type = int, default = settings.get('max_retries', max_retries), help = "Number of times a failed download is retried.")
+    parser.add_argument("--area_bbox", type = lambda value : parse_list(value, float), default = settings.get('area_bbox', area_bbox), help = "Area to download, as 'lon_min,lat_min,lon_max,lat_max'.")
+    parser.add_argument("--path_area_geojson", default = settings.get('path_area_geojson', path_area_geojson), help = "Area to download, as a GeoJSON file of polygons.")
+    parser.add_argument("--windowed", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('windowed', windowed)), help = "Read only the part of each tile inside the area.")
+    parser.add_argument("--build_mosaic", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('build_mosaic', build_mosaic_after_download)), help = "Merge the tiles once they are all downloaded.")
+    args = parser.parse_args(argv)
+
+    # Find the tiles which cover the area.
+    rings = None
+    if args.area_bbox is not None:
+        rings = [bbox_to_ring(*args.area_bbox)]
+    elif args.path_area_geojson is not None:
+        rings = read_geojson_rings(args.path_area_geojson)
+
+    if rings is not None:
+        tiles = find_intersecting_tiles(rings)
+    else:
+        tiles = define_tiles()
+
+    # For windowed reads, only read the bounding box of the area.
+    if args.windowed:
+        if rings is None:
+            raise ValueError("Windowed reads need an area ('area_bbox' or 'path_area_geojson')")
+        utm_bounds = get_utm_bounds(rings)
+    else:
+        utm_bounds = None
+
+    # Skip tiles which are not in the project (e.g. offshore tiles).
+    project_tiles = list_project_tiles(os.path.join(args.download_dir, 'project_listing.json'))
+    missing_tiles = [tile for tile in tiles if tile not in project_tiles]
+    if missing_tiles:
+        print(f"{len(missing_tiles)} tiles are not in the project, skipping: {missing_tiles}")
+    tiles = [tile for tile in tiles if tile in project_tiles]
+    print(f"Downloading {len(tiles)} tiles ({sum([project_tiles[tile] for tile in tiles]) / 1.0E9:.1f} GB).")
+
+    # Record the time and size of each download (see download_telemetry.py).
+    start_telemetry(os.path.join(args.download_dir, 'telemetry.jsonl'), '3dep')
+    failed_tiles = download_tiles(tiles, max_workers = args.max_workers,
+                        utm_bounds = utm_bounds, download_dir = args.download_dir,
+                        requests_per_second = args.requests_per_second,
+                        max_retries = args.max_retries)
+    stop_telemetry()
+    if failed_tiles:
+        print(f"{len(failed_tiles)} tiles failed, re-run to resume them: {failed_tiles}")
+
+    # Merge the tiles, only once they are all downloaded, and only if the
+    # optional rasterio dependency is installed.
+    elif args.build_mosaic and (importlib.util.find_spec('rasterio') is None):
+        print("Skipping the mosaic, which needs rasterio (pip install .[raster]).")
+    elif args.build_mosaic:
+        from .mosaic_3DEP_tiles import build_mosaic
+        tile_pattern = file_name_fmt.format(xtile = '*', ytile = '*')
+        if args.windowed:
+            tile_pattern = tile_pattern.replace('.tif', '_clip.tif')
+        build_mosaic(dir_tiles = args.download_dir, pattern = tile_pattern,
+                max_workers = args.max_workers)
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,518 @@
+'''
+Downloads MCDWD flood data for a specified day, or a range of days.
+You will need an authentication key.
+For each dataset, the machine-readable (JSON) listing of the day's folder is
+requested, the granule files for the target tiles are picked from it, and
+they are all downloaded at the same time over one authenticated session.
+Downloaded files are recorded in a manifest (see download_manifest.py), so
+re-running the script only downloads files which are new or have changed.
+Requests which fail because the server is busy or unreachable are retried,
+and those which still fail are retried first by the next run (see
+fetch_scheduler.py).
+Usage:
+
+hrmd-ma-misc mcdwd today
+hrmd-ma-misc mcdwd --start 2024-09-25 --end 2024-10-08
+hrmd-ma-misc mcdwd --watch --on_complete "python3 make_maps.py {year} {day_of_year}"
+
+The output folder, token file, tiles and datasets can be set in the config
+file or the environment (see config.py), e.g. the token itself can be given
+in HRMD_MA_MISC_MCDWD_BEARER_TOKEN.
+
+In range mode, tiles which already have a granule locally are skipped, so an
+interrupted backfill can simply be run again.
+In watch mode, the folders for today and yesterday are polled for new
+granules, which are downloaded as soon as they are published (see
+watch_days()).
+'''
+# Imports: Standard library.
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+import os
+import re
+import subprocess
+import time
+
+# Imports: Third party.
+import requests
+from requests.adapters import HTTPAdapter
+
+# Imports: Local.
+from .config import load_settings, parse_bool, parse_list
+from .download_manifest import DownloadManifest, download_file
+from .download_telemetry import record_event, start_telemetry, stop_telemetry
+from .fetch_scheduler import FailedJobQueue, FetchScheduler
+
+# Define URL formats.
+# The 'details' listing gives the files in a folder as JSON; the 'archives'
+# URL downloads a file.
+#https://nrt4.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/61/MCDWD_L3_F1_NRT/2024/275/MCDWD_L3_F1_NRT.A2024275.h00v01.061.2024275052248.tif
+url_listing_fmt = 'https://nrt4.modaps.eosdis.nasa.gov/api/v2/content/details/allData/61/MCDWD_L3_F{:}_NRT/{:04d}/{:03d}'
+url_folder_fmt = 'https://nrt4.modaps.eosdis.nasa.gov/api/v2/content/archives/allData/61/MCDWD_L3_F{:}_NRT/{:04d}/{:03d}/'
+
+# Define default settings (see main()).
+dir_output_default = 'MCDWD_downloads'
+path_bearer_token_default = 'earthdata_bearer_token_hrmd.txt'
+
+# Target tiles ('granules'), as 'hHHvVV'.
+# See the 'tile map' image on this page:
+# https://www.earthdata.nasa.gov/learn/find-data/near-real-time/modis-nrt-global-flood-product
+tiles_default = 'h08v05,h08v06,h09v05,h09v06,h10v05,h10v06'
+
+# Target datasets.
+datasets_default = '1,1C,2,3'
+
+def get_day_of_year(date_input):
+    # If 'today' is provided, use today's date
+    if date_input == 'today':
+        date_obj = datetime.today()
+    elif date_input == 'yesterday':
+        date_obj = datetime.today()
+        date_obj = date_obj - timedelta(days=1)
+    else:
+        try:
+            # Try to parse the date string (YYYY-MM-DD)
+            date_obj = datetime.strptime(date_input, '%Y-%m-%d')
+        except ValueError:
+            raise argparse.ArgumentTypeError("Invalid date format '{:}'. Please use YYYY-MM-DD or 'today' or 'yesterday'.".format(date_input))
+
+    # Convert the date object to the day of the year
+    year = date_obj.year
+    day_of_year = date_obj.timetuple().tm_yday
+    return year, day_of_year
+
+def create_session(bearer_token_str, max_workers):
+    '''
+    Create a requests session which sends the authentication token with every
+    request, and whose connection pool keeps one connection open per worker
+    thread.
+    '''
+
+    session = requests.Session()
+    session.headers['Authorization'] = 'Bearer {:}'.format(bearer_token_str)
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+def request_listing(session, dataset, year, day_of_year, listing_cache = None):
+    '''
+    Get the list of files in the folder for one dataset and day, as
+    dictionaries with (at least) the file 'name'. Returns an empty list if the
+    folder does not exist yet.
+    If a 'listing_cache' dictionary is given, the ETag and Last-Modified of
+    each listing are kept in it and sent with the next request for the same
+    folder, so the server only sends the listing again if it has changed.
+    '''
+
+    url_listing = url_listing_fmt.format(dataset, year, day_of_year)
+    headers = {}
+    cached = listing_cache.get(url_listing) if listing_cache is not None else None
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    time_start = time.time()
+    response = session.get(url_listing, params = {'format' : 'json'}, headers = headers,
+                    timeout = 60)
+    record_event('request', url = url_listing, item = 'F{:} {:04d}/{:03d} listing'.format(
+            dataset, year, day_of_year), status = response.status_code,
+            bytes = len(response.content), ttfb_s = response.elapsed.total_seconds(),
+            duration_s = time.time() - time_start, cache_hit = (response.status_code == 304))
+    if response.status_code == 304:
+        return cached[2]
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+
+    listing = response.json()
+    # The listing is either a list of files, or a dictionary with the list
+    # under 'content'.
+    if isinstance(listing, dict):
+        listing = listing.get('content', [])
+
+    if listing_cache is not None:
+        listing_cache[url_listing] = (response.headers.get('ETag'),
+                response.headers.get('Last-Modified'), listing)
+
+    return listing
+
+def select_granules(listing, tiles):
+    '''
+    Pick the GeoTIFF files for the target tiles out of a folder listing, e.g.
+    MCDWD_L3_F1_NRT.A2024275.h08v05.061.2024275052248.tif for tile [8, 5].
+    '''
+
+    tile_regexes = [re.compile(r'\.h{:02d}v{:02d}\.'.format(h, v)) for h, v in tiles]
+    granules = [entry for entry in listing if entry['name'].endswith('.tif') and
+                    any([tile_regex.search(entry['name']) for tile_regex in tile_regexes])]
+
+    return granules
+
+def define_folder(dir_output, dataset, year, day_of_year):
+    '''
+    Define the local folder for one dataset and day, e.g.
+    MCDWD_L3_F1_NRT/2024/275/.
+    '''
+
+    dir_folder = os.path.join(dir_output, 'MCDWD_L3_F{:}_NRT'.format(dataset),
+                    '{:04d}'.format(year), '{:03d}'.format(day_of_year))
+
+    return dir_folder
+
+def find_missing_tiles(dir_folder, tiles):
+    '''
+    Get the tiles which have no downloaded granule in a local folder.
+    Downloads are only renamed to '.tif' once complete, so any granule file
+    counts.
+    '''
+
+    if not os.path.isdir(dir_folder):
+        return list(tiles)
+
+    local_files = [{'name' : file_name} for file_name in os.listdir(dir_folder)]
+    missing_tiles = [tile for tile in tiles if not select_granules(local_files, [tile])]
+
+    return missing_tiles
+
+def define_granule_jobs(listing, dataset, year, day_of_year, tiles, dir_output):
+    '''
+    Define the granule files in a folder listing to download for the target
+    tiles, as (url, file_path) tuples.
+    '''
+
+    url_folder = url_folder_fmt.format(dataset, year, day_of_year)
+    dir_folder = define_folder(dir_output, dataset, year, day_of_year)
+
+    jobs = []
+    for granule in select_granules(listing, tiles):
+
+        url = granule.get('downloadsLink') or (url_folder + granule['name'])
+        jobs.append((url, os.path.join(dir_folder, granule['name'])))
+
+    return jobs
+
+def download_days(session, manifest, days, datasets, tiles, dir_output, max_workers = 8, scheduler = None, skip_complete = False, listing_cache = None):
+    '''
+    Download the granules for the target tiles for each (year, day_of_year)
+    in 'days' and each dataset.
+    The folder listings and the granule downloads are scheduled on one pool
+    of 'max_workers' threads, and sent through a FetchScheduler (see
+    fetch_scheduler.py), which limits the requests to each host and retries
+    transient failures. Granules are downloaded as soon as their listing has
+    arrived, without waiting for the other listings.
+    If the scheduler has a FailedJobQueue, requests which failed in an
+    earlier run are sent again first.
+    If 'skip_complete' is set, tiles which already have a granule locally are
+    not requested again, and no listing is requested for a folder which is
+    already complete.
+    'listing_cache' is passed to request_listing().
+    Returns the list of jobs which failed.
+    '''
+
+    if scheduler is None:
+        scheduler = FetchScheduler()
+
+    # Listings to request, and granules which failed in an earlier run.
+    listing_jobs = []
+    for year, day_of_year in days:
+        for dataset in datasets:
+
+            if skip_complete:
+                target_tiles = find_missing_tiles(define_folder(dir_output,
+                                    dataset, year, day_of_year), tiles)
+                if not target_tiles:
+                    continue
+            else:
+                target_tiles = tiles
+            listing_jobs.append((dataset, year, day_of_year, target_tiles))
+
+    if skip_complete:
+        n_complete = len(days) * len(datasets) * len(tiles) - sum([len(job[3])
+                        for job in listing_jobs])
+        if n_complete > 0:
+            print('Skipping {:d} complete (day, dataset, tile) jobs.'.format(n_complete))
+
+    granule_jobs = []
+    if scheduler.failed_jobs is not None:
+
+        queued_jobs = scheduler.failed_jobs.list()
+        if queued_jobs:
+            print('Retrying {:d} requests which failed in an earlier run.'.format(len(queued_jobs)))
+        for _, job in queued_jobs:
+
+            if job['kind'] == 'listing':
+                if not any([listing_job[:3] == (job['dataset'], job['year'], job['day_of_year'])
+                                for listing_job in listing_jobs]):
+                    listing_jobs.insert(0, (job['dataset'], job['year'], job['day_of_year'], tiles))
+            else:
+                granule_jobs.append((job['url'], job['file_path']))
+
+    failed_jobs = []
+    file_paths = set()
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+
+        def submit_download(url, file_path):
+            # The same granule may be both queued and in a listing.
+            if file_path in file_paths:
+                return
+            file_paths.add(file_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok = True)
+            future = executor.submit(scheduler.call, url, download_file, session,
+                            url, file_path, manifest = manifest, job_key = file_path,
+                            job = {'kind' : 'download', 'url' : url, 'file_path' : file_path})
+            pending[future] = ('download', (url, file_path))
+
+        # Request the listings.
+        pending = {}
+        for dataset, year, day_of_year, target_tiles in listing_jobs:
+
+            url_listing = url_listing_fmt.format(dataset, year, day_of_year)
+            future = executor.submit(scheduler.call, url_listing, request_listing,
+                            session, dataset, year, day_of_year,
+                            listing_cache = listing_cache, job_key = url_listing,
+                            job = {'kind' : 'listing', 'dataset' : dataset,
+                                   'year' : year, 'day_of_year' : day_of_year})
+            pending[future] = ('listing', (dataset, year, day_of_year, target_tiles))
+
+        for url, file_path in granule_jobs:
+
+            submit_download(url, file_path)
+
+        # Download the granules as their listings arrive.
+        while pending:
+
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+
+                kind, job = pending.pop(future)
+                try:
+                    result = future.result()
+                except (requests.RequestException, IOError) as error:
+                    print('Failed {:} {:}: {:}'.format(kind, job, error))
+                    failed_jobs.append((kind, job))
+                    continue
+
+                if kind == 'listing':
+
+                    dataset, year, day_of_year, target_tiles = job
+                    granule_jobs = define_granule_jobs(result, dataset, year,
+                                        day_of_year, target_tiles, dir_output)
+                    print('Dataset {:>2}, {:04d}/{:03d}: {:d} of {:d} tiles available'.format(
+                            dataset, year, day_of_year, len(granule_jobs), len(target_tiles)))
+
+                    for url, file_path in granule_jobs:
+
+                        submit_download(url, file_path)
+
+                else:
+
+                    print('{:<10} {:}'.format(result.capitalize(), os.path.basename(job[1])))
+
+    return failed_jobs
+
+def define_days(start, end):
+    '''
+    Get the (year, day_of_year) of each day from 'start' to 'end' inclusive
+    (see get_day_of_year() for the formats).
+    '''
+
+    start_date = datetime.strptime('{:04d} {:03d}'.format(*get_day_of_year(start)), '%Y %j')
+    end_date = datetime.strptime('{:04d} {:03d}'.format(*get_day_of_year(end)), '%Y %j')
+    if end_date < start_date:
+        raise argparse.ArgumentTypeError("End date '{:}' is before start date '{:}'.".format(end, start))
+
+    days = []
+    date_obj = start_date
+    while date_obj <= end_date:
+
+        days.append((date_obj.year, date_obj.timetuple().tm_yday))
+        date_obj = date_obj + timedelta(days = 1)
+
+    return days
+
+def define_recent_days(n_days):
+    '''
+    Get the (year, day_of_year) of the last 'n_days' days (UTC, as used for
+    the folder names), oldest first.
+    '''
+
+    today = datetime.now(timezone.utc)
+    days = [((today - timedelta(days = i)).year, (today - timedelta(days = i)).timetuple().tm_yday)
+                for i in reversed(range(n_days))]
+
+    return days
+
+def count_missing_tiles(dir_output, datasets, tiles, year, day_of_year):
+
+    n_missing = sum([len(find_missing_tiles(define_folder(dir_output, dataset, year,
+                    day_of_year), tiles)) for dataset in datasets])
+
+    return n_missing
+
+def watch_days(session, manifest, datasets, tiles, dir_output, n_days = 2, on_complete = None, min_interval = 60, max_interval = 900, max_workers = 8, scheduler = None, max_polls = None):
+    '''
+    Poll the folders of the last 'n_days' days for new granules of the target
+    tiles, and download them as they appear.
+    Complete folders are not polled, and the listings of the others are
+    requested conditionally (see request_listing()). The polling interval
+    starts at 'min_interval' seconds, doubles after each poll which finds
+    nothing new (up to 'max_interval'), and drops back once something arrives.
+    When all tiles of all datasets for a day are downloaded, the shell command
+    'on_complete' is run, after replacing {year}, {day_of_year} and
+    {dir_output}. Days which were already complete when watching started do
+    not run the command.
+    Runs until interrupted, or for 'max_polls' polls.
+    '''
+
+    listing_cache = {}
+    completed_days = set([day for day in define_recent_days(n_days) if
+                            count_missing_tiles(dir_output, datasets, tiles, *day) == 0])
+    interval = min_interval
+    n_polls = 0
+    while (max_polls is None) or (n_polls < max_polls):
+
+        days = [day for day in define_recent_days(n_days) if day not in completed_days]
+        n_missing_before = sum([count_missing_tiles(dir_output, datasets, tiles, *day)
+                                for day in days])
+
+        download_days(session, manifest, days, datasets, tiles, dir_output,
+                max_workers = max_workers, scheduler = scheduler,
+                skip_complete = True, listing_cache = listing_cache)
+
+        n_missing_after = 0
+        for year, day_of_year in days:
+
+            n_missing = count_missing_tiles(dir_output, datasets, tiles, year, day_of_year)
+            n_missing_after = n_missing_after + n_missing
+            if n_missing > 0:
+                continue
+
+            completed_days.add((year, day_of_year))
+            print('All tiles for {:04d}/{:03d} downloaded.'.format(year, day_of_year))
+            if on_complete is not None:
+                cmd = on_complete.format(year = year, day_of_year = day_of_year,
+                            dir_output = dir_output)
+                print('Running: {:}'.format(cmd))
+                subprocess.run(cmd, shell = True)
+
+        # Poll again soon while granules are arriving, otherwise back off.
+        if n_missing_after < n_missing_before:
+            interval = min_interval
+        else:
+            interval = min(2 * interval, max_interval)
+
+        n_polls = n_polls + 1
+        if (max_polls is None) or (n_polls < max_polls):
+            print('{:d} granules still missing, polling again in {:.0f} s.'.format(
+                    n_missing_after, interval))
+            time.sleep(interval)
+
+    return
+
+def parse_tile(tile_str):
+    '''
+    Convert a tile name such as 'h08v05' to [8, 5].
+    '''
+
+    match = re.fullmatch(r'h(\d+)v(\d+)', tile_str.strip().lower())
+    if match is None:
+        raise argparse.ArgumentTypeError("Invalid tile '{:}'. Please use the format h08v05.".format(tile_str))
+
+    return [int(match.group(1)), int(match.group(2))]
+
+def main(argv = None, settings = None):
+    '''
+    Bulk download instructions here:
+    https://nrt3.modaps.eosdis.nasa.gov/help/downloads
+    The defaults of the options are taken from 'settings' (default: the
+    'mcdwd' settings from the config file and the environment, see
+    config.py).
+    '''
+
+    if settings is None:
+        settings = load_settings('mcdwd')
+
+    # Set up argument parser
+    parser = argparse.ArgumentParser(prog="hrmd-ma-misc mcdwd", description="Parse arguments for downloading MCDWD flood data.")
+    parser.add_argument("date", type=str, nargs="?", help="Date string in format YYYY-MM-DD or 'today' for the current date or 'yesterday' for the yesterday's date.")
+    parser.add_argument("--start", type=str, help="First date of a range of dates (same formats as 'date').")
+    parser.add_argument("--end", type=str, default="today", help="Last date of a range of dates (default: today).")
+    parser.add_argument("--dir_output", type=str, default=settings.get('dir_output', dir_output_default), help="Folder to download the granules to.")
+    parser.add_argument("--path_bearer_token", type=str, default=settings.get('path_bearer_token', path_bearer_token_default), help="File containing the Earthdata bearer token (unless the 'bearer_token' setting is given).")
+    parser.add_argument("--tiles", type=lambda value: [parse_tile(tile) for tile in parse_list(value)], default=settings.get('tiles', tiles_default), help="Comma-separated list of tiles, e.g. h08v05,h08v06.")
+    parser.add_argument("--datasets", type=parse_list, default=settings.get('datasets', datasets_default), help="Comma-separated list of datasets, e.g. 1,1C,2,3.")
+    parser.add_argument("--max_workers", type=int, default=settings.get('max_workers', 8), help="Number of requests to send at the same time.")
+    parser.add_argument("--max_per_host", type=int, default=settings.get('max_per_host', 4), help="Maximum number of requests to send to one host at the same time.")
+    parser.add_argument("--requests_per_second", type=float, default=settings.get('requests_per_second', 10.0), help="Maximum average number of requests per second to one host.")
+    parser.add_argument("--max_retries", type=int, default=settings.get('max_retries', 5), help="Number of times a request which fails because the server is busy or unreachable is retried.")
+    parser.add_argument("--watch", action=argparse.BooleanOptionalAction, default=parse_bool(settings.get('watch', False)), help="Keep polling for new granules of the last few days.")
+    parser.add_argument("--watch_days", type=int, default=settings.get('watch_days', 2), help="Number of days to poll in watch mode (default: today and yesterday).")
+    parser.add_argument("--min_interval", type=float, default=settings.get('min_interval', 60.0), help="Shortest time (seconds) between polls in watch mode.")
+    parser.add_argument("--max_interval", type=float, default=settings.get('max_interval', 900.0), help="Longest time (seconds) between polls in watch mode.")
+    parser.add_argument("--on_complete", type=str, default=settings.get('on_complete'), help="Shell command to run in watch mode when all tiles for a day are downloaded; {year}, {day_of_year} and {dir_output} are replaced.")
+
+    # Parse the command-line arguments
+    args = parser.parse_args(argv)
+    if args.watch:
+        days = None
+    elif args.start is not None:
+        days = define_days(args.start, args.end)
+        skip_complete = True
+    elif args.date is not None:
+        days = [get_day_of_year(args.date)]
+        skip_complete = False
+    else:
+        parser.error("Give a date, or a range of dates with --start and --end.")
+
+    # Read bearer token.
+    bearer_token_str = settings.get('bearer_token')
+    if bearer_token_str is None:
+        with open(args.path_bearer_token, 'r') as in_id:
+
+            bearer_token_str = in_id.readline().strip()
+
+    dir_output = args.dir_output
+    tiles = args.tiles
+    datasets = args.datasets
+
+    session = create_session(bearer_token_str, args.max_workers)
+    manifest = DownloadManifest(os.path.join(dir_output, 'download_manifest.sqlite'))
+
+    # Retry requests which fail because the server is busy or unreachable,
+    # and keep a list of those which still fail, which the next run retries
+    # first (see fetch_scheduler.py).
+    failed_jobs = FailedJobQueue(os.path.join(dir_output, 'failed_jobs.sqlite'), 'mcdwd')
+    scheduler = FetchScheduler(max_per_host = args.max_per_host,
+                    requests_per_second = args.requests_per_second,
+                    max_retries = args.max_retries, failed_jobs = failed_jobs)
+
+    # Record the time and size of each request (see download_telemetry.py).
+    start_telemetry(os.path.join(dir_output, 'telemetry.jsonl'), 'mcdwd')
+
+    if args.watch:
+        watch_days(session, manifest, datasets, tiles, dir_output,
+                n_days = args.watch_days, on_complete = args.on_complete,
+                min_interval = args.min_interval, max_interval = args.max_interval,
+                max_workers = args.max_workers, scheduler = scheduler)
+    else:
+        failed_requests = download_days(session, manifest, days, datasets, tiles, dir_output,
+                                max_workers = args.max_workers, scheduler = scheduler,
+                                skip_complete = skip_complete)
+        if failed_requests:
+            print('{:d} requests failed, re-run to retry them.'.format(len(failed_requests)))
+
+    stop_telemetry()
+    failed_jobs.close()
+    manifest.close()
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,1806 @@
+'''
+Downloads US Census data via the API, allowing control over fields and geographic areas.
+
+hrmd-ma-misc census
+hrmd-ma-misc census --output_format csv
+hrmd-ma-misc census --cache --store
+
+You need to get an API key and put it in a file called 'api_key_US_census.txt'
+(or set 'path_api_key' or 'api_key' in the config file or the environment,
+see config.py).
+'''
+# Imports: Standard library.
+import argparse
+import asyncio
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import csv
+import filecmp
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+# Imports: Third party.
+import requests
+from requests.adapters import HTTPAdapter
+# numpy and pandas are only imported by the functions which convert tables,
+# so that importing this module (and fetching data) stays fast.
+
+# Imports: Local.
+from .census_catalog import VariableCatalog, define_headers_from_catalog
+from .census_store import CensusStore
+from .config import load_settings, parse_bool, parse_list
+from .download_telemetry import (record_event, redact_secrets, start_telemetry,
+        stop_telemetry)
+from .fetch_scheduler import FailedJobQueue, FetchScheduler
+from .response_cache import ResponseCache
+
+# Define global variables.
+dir_output = 'output'
+
+def load_api_key_from_txt_file(filename='api_key_US_census.txt'):
+    with open(filename, 'r') as file:
+        api_key = file.read().strip()
+    return api_key
+
+def define_headers(verbose = False):
+    '''
+    'headers' are human-readable column headers (10 chars or shorter) for output CSV files.
+    'keys' are string codes used in the US Census Data to indicate specific variables.
+    Each 'header' has an associated 'key', e.g.
+        male population age 0-4 has key 'B01001_003E' and header 'pM_000_004'.
+
+    Definitions are for 2021 ACS data (https://api.census.gov/data/2021/acs/acs5)
+    I haven’t found a good source of documentation yet, but I believe the following codes apply:
+
+    B01001_001E: Total Population
+
+    B01001_002E: Total Male Population
+    B01001_003E: Male under 5 years
+    B01001_004E: Male 5 to 9 years
+    ...
+    B01001_025E: Male 85 years and over.
+
+    B01001_026E: Total Female Population
+    B01001_027E: Female under 5 years
+    B01001_028E: Female 5 to 9 years
+    ...
+    B01001_049E: Female 85 years and over.
+
+    Set 'verbose' to print the keys and headers.
+    Keys and headers for any group can also be generated from the variable
+    catalog (see define_headers_from_catalog() in census_catalog.py).
+    '''
+    
+    # Based on https://api.census.gov/data/2019/acs/acs1/groups/B01001.html
+    age_brackets = [
+        0, 5, 10, 15, 18, 20, 21, 22, 25, 30, 35, 40, 45, 50, 55, 60, 62, 65, 67, 70,
+        75, 80, 85, 99,
+            ]
+
+    # Generate a list human-readable column headers.
+    # (Try to keep 10 chars or less because I think shapefiles need that.)
+    pop_str = 'p'
+    headers = ['{:}'.format(pop_str)]
+    #n_age_brackets = 23
+    n_age_brackets = len(age_brackets) - 1
+    for gender in ['M', 'F']:
+
+        header = '{:}{:}'.format(pop_str, gender)
+        headers.append(header)
+
+        for i in range(n_age_brackets):
+            # lo = i * 5
+            # hi = lo + 4
+            lo = age_brackets[i]
+            hi = age_brackets[i + 1] - 1
+            header = '{:}{:}_{:02d}_{:02d}'.format(pop_str, gender, lo, hi)
+            if i == (n_age_brackets - 1):
+                header = header[:-3]
+                header = header + 'pls'
+
+            headers.append(header)
+    
+    # Get census API query values corresponding to the headers.
+    fmt = 'B01001_{:03d}E'
+    keys = []
+    for i, header in enumerate(headers):
+
+        key = fmt.format(i + 1)
+        keys.append(key)
+    
+    # The place name is a special key.
+    headers.append('name')
+    keys.append('NAME')
+
+    if verbose:
+
+        for key, header in zip(keys, headers):
+
+            print(key, header)
+
+    return keys, headers
+
+def define_US_state_name_to_FIPS_code_dict():
+
+    US_state_name_to_FIPS_code_dict = {
+        'Alabama': 1,
+        'Alaska': 2,
+        'Arizona': 4,
+        'Arkansas': 5,
+        'California': 6,
+        'Colorado': 8,
+        'Connecticut': 9,
+        'Delaware': 10,
+        'Florida': 12,
+        'Georgia': 13,
+        'Hawaii': 15,
+        'Idaho': 16,
+        'Illinois': 17,
+        'Indiana': 18,
+        'Iowa': 19,
+        'Kansas': 20,
+        'Kentucky': 21,
+        'Louisiana': 22,
+        'Maine': 23,
+        'Maryland': 24,
+        'Massachusetts': 25,
+        'Michigan': 26,
+        'Minnesota': 27,
+        'Mississippi': 28,
+        'Missouri': 29,
+        'Montana': 30,
+        'Nebraska': 31,
+        'Nevada': 32,
+        'New Hampshire': 33,
+        'New Jersey': 34,
+        'New Mexico': 35,
+        'New York': 36,
+        'North Carolina': 37,
+        'North Dakota': 38,
+        'Ohio': 39,
+        'Oklahoma': 40,
+        'Oregon': 41,
+        'Pennsylvania': 42,
+        'Rhode Island': 44,
+        'South Carolina': 45,
+        'South Dakota': 46,
+        'Tennessee': 47,
+        'Texas': 48,
+        'Utah': 49,
+        'Vermont': 50,
+        'Virginia': 51,
+        'Washington': 53,
+        'West Virginia': 54,
+        'Wisconsin': 55,
+        'Wyoming': 56,
+        'District of Columbia': 11,
+    }
+
+    return US_state_name_to_FIPS_code_dict
+
+def define_target_states_by_FIPS_code(target_states):
+    '''
+    Define which US states we are interested in.
+    '''
+    
+    US_state_name_to_FIPS_code_dict = define_US_state_name_to_FIPS_code_dict()
+
+    target_states_FIPS_codes = []
+    for target_state in target_states:
+        
+        FIPS_code = US_state_name_to_FIPS_code_dict[target_state]
+        target_states_FIPS_codes.append(FIPS_code)
+
+    return target_states_FIPS_codes
+
+def define_admin_level_codes_from_name():
+    '''
+    Assign an integer admin level to a named admin level.
+    '''
+
+    #adm_codes = [ 
+    #        'nation',
+    #        'region',
+    #        'division',
+    #        'state',
+    #        'county',
+    #        'county_subdivision',
+    #        'place',
+    #        'tract',
+    #        'block_group',
+    #        'block ',
+    #] 
+
+    adm_level_codes_from_name = {
+            'county' : 6,
+            'place'  : 8,
+            }
+
+    return adm_level_codes_from_name
+
+def define_geography_hierarchy():
+    '''
+    For each admin level, list the admin levels which must be specified in the
+    "IN" clause of a query, from largest to smallest.
+    For example, a block group query needs something like
+        in=state:12&in=county:*&in=tract:*
+    '''
+
+    geography_hierarchy = {
+            'county'      : ['state'],
+            'place'       : ['state'],
+            'tract'       : ['state', 'county'],
+            'block group' : ['state', 'county', 'tract'],
+            'block'       : ['state', 'county', 'tract', 'block group'],
+            }
+
+    return geography_hierarchy
+
+def define_query_partitions(adm_level, target_states_FIPS_codes, county_codes_by_state = None):
+    '''
+    Split a query for one admin level into smaller queries ('partitions') which
+    can be sent at the same time.
+    County and place queries are split by state. Smaller admin levels are split
+    by county, so 'county_codes_by_state' must be provided (see
+    request_county_codes()).
+    Each partition is a list of (name, value) tuples for the "FOR" and "IN"
+    clauses of the query, e.g. for a block group partition
+        [('for', 'block group:*'), ('in', 'state:12'), ('in', 'county:015'),
+         ('in', 'tract:*')]
+    '''
+
+    geography_hierarchy = define_geography_hierarchy()
+    if adm_level not in geography_hierarchy:
+        raise ValueError('Admin level "{:}" not implemented or wrong'.format(adm_level))
+    parent_levels = geography_hierarchy[adm_level]
+
+    partitions = []
+    for state_FIPS_code in target_states_FIPS_codes:
+
+        state_str = '{:02d}'.format(state_FIPS_code)
+        if 'county' in parent_levels:
+            county_codes = county_codes_by_state[state_str]
+        else:
+            # A single partition covering the whole state.
+            county_codes = [None]
+
+        for county_code in county_codes:
+
+            partition = [('for', '{:}:*'.format(adm_level)),
+                         ('in', 'state:{:}'.format(state_str))]
+            for parent_level in parent_levels[1:]:
+
+                if parent_level == 'county':
+                    partition.append(('in', 'county:{:}'.format(county_code)))
+                else:
+                    partition.append(('in', '{:}:*'.format(parent_level)))
+
+            partitions.append(partition)
+
+    return partitions
+
+def create_session(max_workers):
+    '''
+    Create a requests session whose connection pool is big enough to keep one
+    connection open per worker thread.
+    '''
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+def iter_json_rows(file, chunk_size = 65536):
+    '''
+    Yield the rows of a JSON array of arrays (the format returned by the API)
+    one at a time, without loading the whole array into memory.
+    'file' can be any text or binary file-like object with a read() method,
+    such as an open file or the raw stream of an HTTP response.
+    '''
+
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read_chunk():
+        chunk = file.read(chunk_size)
+        if isinstance(chunk, bytes):
+            # A chunk which ends inside a multi-byte character decodes to
+            # fewer characters, possibly none, so read on until there is at
+            # least one (an empty chunk means the end of the file).
+            text = utf8_decoder.decode(chunk, final = (len(chunk) == 0))
+            while (not text) and chunk:
+                chunk = file.read(chunk_size)
+                text = utf8_decoder.decode(chunk, final = (len(chunk) == 0))
+            chunk = text
+        return chunk
+
+    buffer = ''
+    pos = 0
+    end_of_file = False
+    in_array = False
+    while True:
+
+        # Skip whitespace and separators between rows.
+        while pos < len(buffer) and (buffer[pos].isspace() or
+                (in_array and buffer[pos] == ',')):
+            pos = pos + 1
+
+        if pos < len(buffer):
+
+            if not in_array:
+                if buffer[pos] != '[':
+                    raise ValueError('Expected a JSON array, found "{:}"'.format(buffer[pos]))
+                in_array = True
+                pos = pos + 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            # Try to decode the next row. If it is incomplete, read more data.
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+            else:
+                yield row
+                continue
+
+        if end_of_file:
+            if in_array:
+                raise ValueError('Unexpected end of JSON array')
+            # An empty file (e.g. a 'No Content' response) has no rows.
+            return
+
+        # Discard rows which have already been decoded and read more data.
+        chunk = read_chunk()
+        end_of_file = (len(chunk) == 0)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def iter_response_rows(response):
+    '''
+    Yield the rows of an API response (requested with stream = True) one at a
+    time, reading directly from the HTTP stream.
+    '''
+
+    # The API returns 'No Content' if there are no geographies in the query
+    # region (e.g. a county with no block groups).
+    if response.status_code == 204:
+        return
+
+    response.raw.decode_content = True
+    yield from iter_json_rows(response.raw)
+
+def define_partition_job(endpoint, query_str_GET, partition):
+    '''
+    Describe the request for a single partition as a job for the
+    FailedJobQueue (see fetch_scheduler.py), and get its key.
+    '''
+
+    job = {'endpoint' : endpoint, 'get' : query_str_GET,
+           'partition' : [list(clause) for clause in partition]}
+    job_key = hashlib.sha1(json.dumps(job).encode('utf-8')).hexdigest()
+
+    return job_key, job
+
+def fetch_partition(session, endpoint, query_str_GET, partition, api_key, cache = None, scheduler = None):
+    '''
+    Send the GET request for a single partition and return the rows of the
+    response (a list of lists, where the first row is the header).
+    If a ResponseCache is given, a stored response for the same query is used
+    instead, and new responses are stored.
+    If a FetchScheduler is given, the request is sent through it, so
+    transient failures are retried, and requests which still fail are
+    recorded in its FailedJobQueue (if any).
+    Each call is recorded as a telemetry event (see download_telemetry.py).
+    '''
+
+    params = [('get', query_str_GET)] + partition + [('key', api_key)]
+    item = '&'.join(['{:}={:}'.format(name, value) for name, value in partition])
+    if cache is not None:
+
+        time_start = time.time()
+        cache_key = cache.make_key(endpoint, params)
+        rows = cache.get(cache_key)
+        if rows is not None:
+            record_event('request', url = endpoint, item = item, cache_hit = True,
+                    n_rows = len(rows), duration_s = time.time() - time_start)
+            return rows
+
+    if scheduler is None:
+        rows = request_partition(session, endpoint, params, item)
+    else:
+        job_key, job = define_partition_job(endpoint, query_str_GET, partition)
+        rows = scheduler.call(endpoint, request_partition, session, endpoint,
+                    params, item, job_key = job_key, job = job)
+
+    if cache is not None:
+        cache.put(cache_key, endpoint, rows)
+
+    return rows
+
+def request_partition(session, endpoint, params, item):
+    '''
+    Send one GET request for fetch_partition(), raising an HTTPError if the
+    API reports an error, and record it as a telemetry event.
+    '''
+
+    time_start = time.time()
+    status = None
+    n_bytes = 0
+    ttfb = None
+    error = None
+    try:
+        with session.get(endpoint, params = params, stream = True, timeout = (10, 300)) as response:
+
+            status = response.status_code
+            ttfb = response.elapsed.total_seconds()
+            response.raise_for_status()
+            rows = list(iter_response_rows(response))
+            n_bytes = response.raw.tell()
+
+    except requests.RequestException as exception:
+        error = redact_secrets(repr(exception))
+        raise
+    finally:
+        record_event('request', url = endpoint, item = item, cache_hit = False,
+                status = status, bytes = n_bytes, ttfb_s = ttfb, error = error,
+                duration_s = time.time() - time_start)
+
+    return rows
+
+def retry_failed_partitions(session, scheduler, api_key, cache = None):
+    '''
+    Send again the requests which still failed at the end of an earlier run
+    (see fetch_scheduler.py), so that their responses are in the cache before
+    the queries are run. Requests which fail again stay in the queue.
+    '''
+
+    failed_jobs = scheduler.failed_jobs.list()
+    if not failed_jobs:
+        return
+
+    print('Retrying {:d} requests which failed in an earlier run.'.format(len(failed_jobs)))
+    for _, job in failed_jobs:
+
+        partition = [tuple(clause) for clause in job['partition']]
+        try:
+            fetch_partition(session, job['endpoint'], job['get'], partition,
+                    api_key, cache = cache, scheduler = scheduler)
+        except requests.RequestException as error:
+            print('Request {:} failed again: {:}'.format(partition, error))
+
+    return
+
+def request_county_codes(session, endpoint, target_states_FIPS_codes, api_key, cache = None, scheduler = None):
+    '''
+    Get the county FIPS codes (as zero-padded strings) in each target state,
+    keyed by the zero-padded state FIPS code.
+    '''
+
+    partition = [('for', 'county:*'),
+                 ('in', 'state:' + ",".join(['{:02d}'.format(state_FIPS_code) for
+                                    state_FIPS_code in target_states_FIPS_codes]))]
+    data = fetch_partition(session, endpoint, 'NAME', partition, api_key,
+                cache = cache, scheduler = scheduler)
+
+    county_codes_by_state = {'{:02d}'.format(state_FIPS_code) : [] for
+                                state_FIPS_code in target_states_FIPS_codes}
+    i_state = data[0].index('state')
+    i_county = data[0].index('county')
+    for row in data[1:]:
+
+        county_codes_by_state[row[i_state]].append(row[i_county])
+
+    for county_codes in county_codes_by_state.values():
+
+        county_codes.sort()
+
+    return county_codes_by_state
+
+def iter_merged_rows(results):
+    '''
+    Merge the responses from several partitions into a single table with
+    one header row, yielding one row at a time. Empty responses are ignored.
+    '''
+
+    header = None
+    for result in results:
+
+        if not result:
+            continue
+
+        if header is None:
+            header = result[0]
+            yield header
+        elif result[0] != header:
+            raise ValueError('Partition headers do not match:\n{:}\n{:}'.format(
+                                header, result[0]))
+
+        yield from result[1:]
+
+def merge_partition_results(results):
+    '''
+    Merge the responses from several partitions into a single table with
+    one header row. Empty responses are ignored.
+    '''
+
+    return list(iter_merged_rows(results))
+
+def define_variable_batches(variable_keys, max_variables = 50):
+    '''
+    Split a list of variables into batches which are small enough for a single
+    request. The API accepts at most 50 variables per request (the geography
+    columns in the response do not count).
+    '''
+
+    variable_batches = [variable_keys[i : i + max_variables] for i in
+                            range(0, len(variable_keys), max_variables)]
+
+    return variable_batches
+
+def join_batch_results(variable_batches, batch_results):
+    '''
+    Join the responses for several batches of variables for the same partition
+    column-wise, matching rows on the geography columns (the columns in each
+    response which are not in its batch of variables).
+    The output has all the variables in batch order, followed by the geography
+    columns, with rows in the order of the first batch. Values which are
+    missing from a batch are given as None.
+    '''
+
+    if len(batch_results) == 1:
+        return batch_results[0]
+
+    if not any(batch_results):
+        return []
+
+    header = None
+    geography_columns = None
+    joined_values = {}
+    for variable_batch, result in zip(variable_batches, batch_results):
+
+        if not result:
+            continue
+
+        batch_header = result[0]
+        batch_geography_columns = [column for column in batch_header if
+                                    column not in variable_batch]
+        if geography_columns is None:
+            geography_columns = batch_geography_columns
+        elif batch_geography_columns != geography_columns:
+            raise ValueError('Batch geography columns do not match:\n{:}\n{:}'.format(
+                                geography_columns, batch_geography_columns))
+
+        i_geography = [batch_header.index(column) for column in geography_columns]
+        for row in result[1:]:
+
+            geography_key = tuple([row[i] for i in i_geography])
+            joined_values.setdefault(geography_key, {}).update(zip(batch_header, row))
+
+    variable_keys = [variable for variable_batch in variable_batches for
+                        variable in variable_batch]
+    header = variable_keys + geography_columns
+    joined = [header]
+    for values in joined_values.values():
+
+        joined.append([values.get(column) for column in header])
+
+    return joined
+
+def iter_partition_results(session, endpoint, variable_keys, partitions, api_key, max_workers = 8, cache = None, max_variables = 50, scheduler = None):
+    '''
+    Send the requests for all partitions at the same time, using up to
+    'max_workers' threads, and yield the results in the same order as the
+    partitions.
+    If there are too many variables for one request, each partition is
+    requested in several batches of variables (see define_variable_batches())
+    which are also sent at the same time, and the results are joined
+    column-wise (see join_batch_results()).
+    Only a few partitions are requested ahead of the one being yielded, so
+    memory use does not grow with the number of partitions.
+    '''
+
+    variable_batches = define_variable_batches(list(variable_keys),
+                            max_variables = max_variables)
+    n_ahead = max(2 * max_workers // len(variable_batches), 1)
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+
+        def get_result(batch_futures):
+            return join_batch_results(variable_batches,
+                        [future.result() for future in batch_futures])
+
+        futures = deque()
+        for i, partition in enumerate(partitions):
+
+            futures.append([executor.submit(fetch_partition, session, endpoint,
+                                ",".join(variable_batch), partition, api_key,
+                                cache = cache, scheduler = scheduler)
+                            for variable_batch in variable_batches])
+            if len(futures) >= n_ahead:
+                yield get_result(futures.popleft())
+
+            print('Requested partition {:>4d} of {:>4d} in {:d} batches: {:}'.format(
+                    i + 1, len(partitions), len(variable_batches), partition))
+
+        while futures:
+            yield get_result(futures.popleft())
+
+def fetch_partitions(session, endpoint, variable_keys, partitions, api_key, max_workers = 8, cache = None, scheduler = None):
+    '''
+    Send the requests for all partitions at the same time, using up to
+    'max_workers' threads, and merge the results. The merged rows are in the
+    same order as the partitions.
+    '''
+
+    results = iter_partition_results(session, endpoint, variable_keys,
+                    partitions, api_key, max_workers = max_workers, cache = cache,
+                    scheduler = scheduler)
+
+    return merge_partition_results(results)
+
+def update_store(store, session, endpoint, adm_level, variable_keys, partitions, api_key, max_workers = 8, cache = None, scheduler = None):
+    '''
+    Request only the partitions which are missing from a CensusStore, and
+    upsert each one as it arrives.
+    '''
+
+    missing_partitions = store.find_missing_partitions(endpoint, adm_level,
+                            variable_keys, partitions)
+    print('{:d} of {:d} {:} partitions already in store {:}, requesting {:d}.'.format(
+            len(partitions) - len(missing_partitions), len(partitions),
+            adm_level, store.path_db, len(missing_partitions)))
+
+    _, id_components = define_id_components(adm_level)
+    results = iter_partition_results(session, endpoint, variable_keys,
+                missing_partitions, api_key, max_workers = max_workers,
+                cache = cache, scheduler = scheduler)
+    for partition, result in zip(missing_partitions, results):
+
+        store.upsert_partition(endpoint, adm_level, partition, variable_keys,
+                result, id_components)
+
+    return
+
+@contextlib.contextmanager
+def open_part_file(path_out, mode = 'w', keep_unchanged = False, **kwargs):
+    '''
+    Open a temporary '.part' file for writing, which replaces 'path_out' once
+    it is complete, or is deleted if writing fails. This way an interrupted
+    run never leaves a truncated output file, which the next run would skip
+    because it exists.
+    With 'keep_unchanged', an existing file with the same content is kept
+    as it is, so its modification time shows when the data last changed
+    (see is_up_to_date()).
+    '''
+
+    part_path = '{:}.part'.format(path_out)
+    try:
+        with open(part_path, mode, **kwargs) as file:
+            yield file
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    if keep_unchanged and os.path.exists(path_out) and \
+            filecmp.cmp(part_path, path_out, shallow = False):
+        os.remove(part_path)
+    else:
+        os.replace(part_path, path_out)
+
+    return
+
+def is_up_to_date(path_out, path_in):
+    '''
+    Check whether a file built from another one (e.g. a CSV file converted
+    from a JSON file) exists and is newer than it.
+    '''
+
+    return os.path.exists(path_out) and \
+            (os.path.getmtime(path_out) >= os.path.getmtime(path_in))
+
+def write_rows_to_json(rows, path_out):
+    '''
+    Write rows to a JSON array of arrays with one row per line (the same
+    layout as the API responses), one row at a time (see open_part_file()).
+    An existing file with the same rows is left untouched.
+    '''
+
+    with open_part_file(path_out, 'w', keep_unchanged = True) as file:
+
+        file.write('[')
+        for i, row in enumerate(rows):
+
+            if i > 0:
+                file.write(',\n')
+            file.write(json.dumps(row))
+
+        file.write(']')
+
+    return
+
+def request_data(api_key, overwrite = False, max_workers = 8, output_format = 'json', cache = None, store = None, endpoint = None, target_states = None, target_adm_levels = None, variable_keys = None, variable_headers = None, catalog = None, scheduler = None):
+    '''
+    Formulate and send GET requests to the US census API.
+    Each query is split into per-state or per-county partitions which are
+    requested at the same time (see define_query_partitions()), using up to
+    'max_workers' concurrent connections.
+    If 'output_format' is 'csv', the responses are converted to CSV as they
+    arrive (see convert_rows_to_csv()) and no JSON file is written. Similarly,
+    'parquet' or 'feather' give a typed columnar file (see
+    convert_rows_to_dataframe()).
+    If a ResponseCache is given, only partitions whose query is not in the
+    cache are sent to the API. Because the cache is keyed on the full query,
+    output files are then always rebuilt (from the cache where possible)
+    rather than skipped because they exist.
+    If a CensusStore is given, only partitions which are not already in the
+    store are requested, and the output files are exported from the store.
+    'endpoint', 'target_states', 'target_adm_levels', 'variable_keys' and
+    'variable_headers' override the defaults defined below, e.g. to use a
+    local stand-in for the API (see benchmark_US_census_data.py).
+    If a VariableCatalog is given (see census_catalog.py), the variables are
+    checked against it before any request is sent.
+    Requests are sent through a FetchScheduler (see fetch_scheduler.py),
+    which retries transient failures. A default one, which does not limit the
+    rate of requests, is used if none is given.
+    '''
+
+    # Define US Census API key and endpoint.
+    # Endpoint is 2022 ACS5 data, described in first row of this table:
+    # https://api.census.gov/data/2022/acs/acs5.html
+    # It has disaggregated population data including very small admin levels. 
+    # Request an API key here: https://api.census.gov/data/key_signup.html 
+    if endpoint is None:
+        endpoint = "https://api.census.gov/data/2022/acs/acs5"
+    
+    # Define the "GET" clause of the query, which specifies which variables to
+    # download, as a comma-separated list of codes. If there are more than
+    # the API allows in one request, they are split into batches (see
+    # define_variable_batches()).
+    if variable_keys is None:
+        variable_keys, variable_headers = define_headers()
+
+    if catalog is not None:
+
+        unknown_keys = catalog.check_variables(endpoint, variable_keys)
+        if unknown_keys:
+            raise ValueError('Variables not found in {:}: {:}'.format(endpoint,
+                                ', '.join(unknown_keys)))
+    
+    # Define which states to download, and get their FIPS code.
+    if target_states is None:
+        target_states = ['Florida', 'Georgia', 'North Carolina', 'Tennessee']
+    target_states_FIPS_codes = define_target_states_by_FIPS_code(target_states)
+    
+    # Define which admin levels we are interested in. 
+    if target_adm_levels is None:
+        #target_adm_levels = ['county', 'tract']#, 'block group']
+        #target_adm_levels = ['county']
+        target_adm_levels = ['block group']
+        # Blocks are only published by the decennial census (e.g. the
+        # 'dec/pl' dataset, see define_endpoint()), not by the ACS.
+        #target_adm_levels = ['block']
+
+    # Also provide a dictionary to map these admin levels to numbers,
+    # e.g. county <-> 4.  
+    #adm_level_codes_from_name = define_admin_level_codes_from_name()
+
+    # All requests share one pool of connections, and one scheduler.
+    session = create_session(max_workers)
+    if scheduler is None:
+        scheduler = FetchScheduler(max_per_host = max_workers,
+                        requests_per_second = None)
+    county_codes_by_state = None
+    
+    # Loop over the target admin levels and save the output as separate JSON
+    # files. 
+    # Store the output paths in a list.
+    paths_out = []
+    for adm_level in target_adm_levels:
+
+        # Define the output path.
+        #adm_code = adm_level_codes_from_name[adm_level]
+        #request_name = 'US_pop_by_age_sex__adm{:1d}_{:}'.format(
+        #                    adm_code, adm_level)
+        request_name = 'US_pop_by_age_sex__{:}'.format(adm_level)
+        path_out = os.path.join(dir_output, '{:}.{:}'.format(request_name,
+                                                    output_format))
+        path_out = path_out.replace(' ', '_')
+        paths_out.append(path_out)
+
+        # Don't overwrite existing files unless requested.
+        if os.path.exists(path_out) and not overwrite and (cache is None) and \
+                (store is None):
+
+            print("Output file {:} already exists, skipping request.".format(path_out))
+            continue
+
+        # Smaller admin levels are split into one partition per county, so
+        # first find out which counties are in the target states.
+        if ('county' in define_geography_hierarchy()[adm_level]) and \
+                (county_codes_by_state is None):
+
+            county_codes_by_state = request_county_codes(session, endpoint,
+                                        target_states_FIPS_codes, api_key,
+                                        cache = cache, scheduler = scheduler)
+
+        # Define the "FOR" and "IN" clauses of each partition of the query.
+        # The "FOR" clause specifies the geographic level to look at, e.g.
+        #   county:*
+        # which translates as "get data for all counties in the query region".
+        # The "IN" clause specifies the geographic region of the query, e.g.
+        #   state:12
+        # where the integer is the FIPS code of the state.
+        partitions = define_query_partitions(adm_level, target_states_FIPS_codes,
+                            county_codes_by_state = county_codes_by_state)
+
+        # Make the requests.
+        if store is None:
+
+            print('Requesting {:} data in {:d} partitions.'.format(adm_level,
+                        len(partitions)))
+            results = iter_partition_results(session, endpoint, variable_keys,
+                        partitions, api_key, max_workers = max_workers, cache = cache,
+                        scheduler = scheduler)
+            rows = iter_merged_rows(results)
+
+        else:
+
+            update_store(store, session, endpoint, adm_level, variable_keys,
+                    partitions, api_key, max_workers = max_workers, cache = cache,
+                    scheduler = scheduler)
+            state_codes = ['{:02d}'.format(state_FIPS_code) for state_FIPS_code
+                            in target_states_FIPS_codes]
+            rows = store.iter_rows(endpoint, adm_level, variable_keys,
+                        state_codes = state_codes)
+
+        # Save as a text file, writing each partition as it arrives.
+        print("Writing to {:}".format(path_out))
+        if output_format == 'json':
+            write_rows_to_json(rows, path_out)
+        elif output_format == 'csv':
+            convert_rows_to_csv(rows, path_out, adm_level, variable_keys,
+                    variable_headers)
+        elif output_format in ['parquet', 'feather']:
+            df = convert_rows_to_dataframe(rows, adm_level, variable_keys,
+                    variable_headers)
+            write_dataframe(df, path_out, output_format)
+        else:
+            raise ValueError('Output format "{:}" not implemented or wrong'.format(output_format))
+
+    if cache is not None:
+        print(cache.get_summary())
+
+    return paths_out
+    
+def define_endpoint(year, dataset):
+    '''
+    Get the API endpoint for a dataset and year (vintage), e.g.
+        year = 2022, dataset = 'acs/acs5'
+    gives https://api.census.gov/data/2022/acs/acs5
+    Other datasets include 'acs/acs1' and 'dec/pl' (decennial census).
+    '''
+
+    endpoint = 'https://api.census.gov/data/{:d}/{:}'.format(year, dataset)
+
+    return endpoint
+
+def define_download_jobs():
+    '''
+    Define a list of download jobs for download_jobs(). Each job is a
+    dictionary with the keys
+        'year', 'dataset'   See define_endpoint().
+        'adm_level'         The admin level, e.g. 'county' or 'block group'.
+        'states'            A list of state names.
+        'variables'         (Optional) a list of variable keys. The default is
+                            the keys from define_headers().
+        'name'              (Optional) the start of the output file name.
+    This example gets a baseline and the latest ACS5 vintage for the same
+    region. Jobs can also be loaded from a JSON file with
+    load_jobs_from_json_file().
+    '''
+
+    target_states = ['Florida', 'Georgia', 'North Carolina', 'Tennessee']
+    jobs = [{'year' : year, 'dataset' : 'acs/acs5', 'adm_level' : 'county',
+                'states' : target_states, 'name' : 'US_pop_by_age_sex'}
+            for year in [2019, 2022]]
+
+    return jobs
+
+def load_jobs_from_json_file(path_jobs):
+
+    with open(path_jobs, 'r') as file:
+        jobs = json.load(file)
+
+    return jobs
+
+def define_job_path(job):
+    '''
+    Define the output path of a download job, which depends only on the job,
+    e.g.
+        output/acs_acs5_2022/US_pop_by_age_sex__block_group.json
+    Jobs without a name are named by a hash of their variables and states.
+    '''
+
+    if 'name' in job:
+        request_name = job['name']
+    else:
+        job_str = json.dumps([job.get('variables'), sorted(job['states'])])
+        request_name = 'US_census_{:}'.format(
+                hashlib.sha1(job_str.encode('utf-8')).hexdigest()[:8])
+
+    dir_job = '{:}_{:d}'.format(job['dataset'].replace('/', '_'), job['year'])
+    file_name = '{:}__{:}.json'.format(request_name, job['adm_level'])
+    path_out = os.path.join(dir_output, dir_job, file_name.replace(' ', '_'))
+
+    return path_out
+
+async def run_in_worker(executor, semaphore, function, *args, **kwargs):
+    '''
+    Run a blocking request function (e.g. fetch_partition()) in a worker
+    thread, once fewer than 'max_concurrency' requests are in flight.
+    The rate limit and the retries (see fetch_scheduler.py) are applied in the
+    worker thread, by the FetchScheduler.
+    '''
+
+    async with semaphore:
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(executor, functools.partial(
+                    function, *args, **kwargs))
+
+    return result
+
+async def iter_partition_results_async(executor, semaphore, session, endpoint, variable_keys, partitions, api_key, n_ahead = 16, cache = None, scheduler = None):
+    '''
+    The asyncio version of iter_partition_results(): yield the results for
+    all partitions (with their variable batches joined) in the same order as
+    the partitions. Only the requests for a few partitions ahead of the one
+    being yielded (up to 'n_ahead' requests) are started, so memory use does
+    not grow with the number of partitions.
+    '''
+
+    variable_batches = define_variable_batches(list(variable_keys))
+    n_ahead = max(n_ahead // len(variable_batches), 1)
+
+    def start_partition(partition):
+        return asyncio.ensure_future(asyncio.gather(*[run_in_worker(executor,
+                    semaphore, fetch_partition, session, endpoint,
+                    ",".join(variable_batch), partition, api_key, cache = cache,
+                    scheduler = scheduler) for variable_batch in variable_batches]))
+
+    tasks = deque()
+    try:
+        for partition in partitions:
+
+            tasks.append(start_partition(partition))
+            if len(tasks) >= n_ahead:
+                yield join_batch_results(variable_batches, await tasks.popleft())
+
+        while tasks:
+            yield join_batch_results(variable_batches, await tasks.popleft())
+
+    finally:
+        # Don't leave requests running if the job fails.
+        for task in tasks:
+            task.cancel()
+
+async def write_results_to_json_async(results, path_out):
+    '''
+    Write the results from iter_partition_results_async() to a JSON file as
+    they arrive, in the same layout as write_rows_to_json() (and merged as in
+    iter_merged_rows()), via a '.part' file (see open_part_file()).
+    '''
+
+    with open_part_file(path_out, 'w', keep_unchanged = True) as file:
+
+        file.write('[')
+        header = None
+        async for result in results:
+
+            if not result:
+                continue
+
+            if header is None:
+                header = result[0]
+                file.write(json.dumps(header))
+            elif result[0] != header:
+                raise ValueError('Partition headers do not match:\n{:}\n{:}'.format(
+                                    header, result[0]))
+
+            for row in result[1:]:
+                file.write(',\n')
+                file.write(json.dumps(row))
+
+        file.write(']')
+
+    return
+
+async def run_download_job(job, executor, semaphore, session, api_key, overwrite = False, cache = None, scheduler = None, n_ahead = 16):
+    '''
+    Request all partitions and variable batches of one download job, and write
+    the result to the path from define_job_path(), one partition at a time
+    (see iter_partition_results_async()).
+    '''
+
+    path_out = define_job_path(job)
+    if os.path.exists(path_out) and not overwrite and (cache is None):
+
+        print("Output file {:} already exists, skipping job.".format(path_out))
+        return path_out
+
+    endpoint = define_endpoint(job['year'], job['dataset'])
+    adm_level = job['adm_level']
+    if 'variables' in job:
+        variable_keys = job['variables']
+    else:
+        variable_keys, _ = define_headers()
+    target_states_FIPS_codes = define_target_states_by_FIPS_code(job['states'])
+
+    # Smaller admin levels are split into one partition per county, so
+    # first find out which counties are in the target states.
+    county_codes_by_state = None
+    if 'county' in define_geography_hierarchy()[adm_level]:
+
+        county_codes_by_state = await run_in_worker(executor, semaphore,
+                                    request_county_codes, session, endpoint,
+                                    target_states_FIPS_codes, api_key,
+                                    cache = cache, scheduler = scheduler)
+
+    partitions = define_query_partitions(adm_level, target_states_FIPS_codes,
+                        county_codes_by_state = county_codes_by_state)
+    variable_batches = define_variable_batches(list(variable_keys))
+
+    print('Job {:} {:} {:}: requesting {:d} partitions in {:d} batches, writing to {:}'.format(
+            job['year'], job['dataset'], adm_level, len(partitions),
+            len(variable_batches), path_out))
+    os.makedirs(os.path.dirname(path_out), exist_ok = True)
+    results = iter_partition_results_async(executor, semaphore, session,
+                    endpoint, variable_keys, partitions, api_key,
+                    n_ahead = n_ahead, cache = cache, scheduler = scheduler)
+    await write_results_to_json_async(results, path_out)
+
+    return path_out
+
+async def download_jobs_async(jobs, api_key, max_concurrency = 8, requests_per_second = None, overwrite = False, cache = None, scheduler = None):
+    '''
+    Run several download jobs (see define_download_jobs()) at the same time.
+    Requests from all jobs share one limit on the number of requests in flight
+    ('max_concurrency') and one FetchScheduler, which retries transient
+    failures and, if 'requests_per_second' is given, limits the rate of
+    requests. If a scheduler is given, its own rate limit is used instead.
+    Each job writes its rows as they arrive, and only requests a few
+    partitions ahead, so memory use does not grow with the size of the jobs.
+    '''
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    session = create_session(max_concurrency)
+    if scheduler is None:
+        scheduler = FetchScheduler(max_per_host = max_concurrency,
+                        requests_per_second = requests_per_second)
+    with ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+
+        paths_out = await asyncio.gather(*[run_download_job(job, executor,
+                        semaphore, session, api_key, overwrite = overwrite,
+                        cache = cache, scheduler = scheduler,
+                        n_ahead = 2 * max_concurrency) for job in jobs])
+
+    return paths_out
+
+def download_jobs(jobs, api_key, max_concurrency = 8, requests_per_second = None, overwrite = False, cache = None, scheduler = None):
+    '''
+    Run download_jobs_async() and return the list of output paths, in the
+    same order as the jobs.
+    '''
+
+    paths_out = asyncio.run(download_jobs_async(jobs, api_key,
+                    max_concurrency = max_concurrency,
+                    requests_per_second = requests_per_second,
+                    overwrite = overwrite, cache = cache, scheduler = scheduler))
+
+    if cache is not None:
+        print(cache.get_summary())
+
+    return paths_out
+
+def define_id_components(adm_level):
+    '''
+    Define the name of the ID column ('FIPS' or 'GEOID') for an admin level,
+    and the geography columns it is built from, with the number of digits of
+    each one. For example, a block group GEOID is
+        state (2) + county (3) + tract (6) + block group (1)
+    e.g. 120150101001.
+    '''
+
+    adm_level = adm_level.replace(' ', '_')
+    if adm_level == 'state':
+        id_components = [('state', 2)]
+        id_name = 'FIPS'
+    elif adm_level in ['county', 'place']:
+        FIPS_code_sublen_dict = {'county' : 3, 'place' : 5}
+        FIPS_code_sublen = FIPS_code_sublen_dict[adm_level]
+        id_components = [('state', 2), (adm_level, FIPS_code_sublen)]
+        id_name = 'FIPS'
+    elif adm_level == 'tract':
+        id_components = [('state', 2), ('county', 3), ('tract', 6)]
+        id_name = 'GEOID'
+    elif adm_level == 'block_group':
+        id_components = [('state', 2), ('county', 3), ('tract', 6), ('block group', 1)]
+        id_name = 'GEOID'
+    elif adm_level == 'block':
+        # Blocks are only in the decennial census datasets (e.g. 'dec/pl'),
+        # not in the ACS.
+        # The first digit of the block code is the block group, so the block
+        # group is not part of the GEOID.
+        id_components = [('state', 2), ('county', 3), ('tract', 6), ('block', 4)]
+        id_name = 'GEOID'
+    else:
+        raise ValueError('Admin level "{:}" not implemented or wrong'.format(adm_level))
+
+    return id_name, id_components
+
+def define_empty_header(adm_level, variable_keys):
+    '''
+    Define the header of a table with no rows, in the layout of the API
+    responses (the variables, then the geography columns). The API does not
+    return a header when there are no geographies, so the files from
+    request_data() are then just '[]'.
+    '''
+
+    _, id_components = define_id_components(adm_level)
+    header = list(variable_keys) + [column for column, _ in id_components]
+
+    return header
+
+def define_geography_columns():
+    '''
+    Names of the columns in API responses which hold geography codes.
+    '''
+
+    geography_columns = ['state', 'county', 'place', 'tract', 'block group', 'block']
+
+    return geography_columns
+
+def define_column_order(header, adm_level):
+    '''
+    Define the order of the columns of a table with an ID column (see
+    add_id_column()), for the CSV files: the geography columns from largest
+    to smallest, then the ID column, then the other columns in their original
+    order. Returned as a list of indices into 'header'.
+    '''
+
+    id_name, _ = define_id_components(adm_level)
+    first_columns = [column for column in define_geography_columns() if column
+                        in header] + [id_name]
+    order = [header.index(column) for column in first_columns] + \
+            [i for i, column in enumerate(header) if column not in first_columns]
+
+    return order
+
+def add_id_column(df, adm_level):
+    '''
+    Add the ID column (FIPS or GEOID) to a table of API results, building it for
+    all rows at once by zero-padding and joining the geography columns.
+    '''
+
+    id_name, id_components = define_id_components(adm_level)
+
+    id_ = None
+    for column, n_digits in id_components:
+
+        part = df[column].astype('string').str.zfill(n_digits)
+        if id_ is None:
+            id_ = part
+        else:
+            id_ = id_ + part
+
+    df[id_name] = id_
+
+    return df
+
+def convert_rows_to_csv(rows, path_csv, adm_level, variable_keys, variable_headers):
+    '''
+    Write rows from the API (header first) to a CSV file one row at a time, so
+    memory use does not depend on the number of rows.
+    Each row gets an ID column (FIPS or GEOID), and the geography and ID
+    columns are moved to the front (see define_column_order()). A second
+    header line with human-readable names is
+    added after the first (see define_headers()).
+    The file is only moved into place once complete (see open_part_file()).
+    '''
+
+    id_name, id_components = define_id_components(adm_level)
+
+    # Replace census keys with human readable ones.
+    key_header_dict = {}
+    for key, header in zip(variable_keys, variable_headers):
+        key_header_dict[key] = header
+
+    with open_part_file(path_csv, mode='w', newline='') as file:
+
+        writer = csv.writer(file)
+        first_row = True
+        human_readable_header_line = None
+        for row in rows:
+
+            # Add FIPS code.
+            if first_row:
+
+                id_indices = [row.index(column) for column, _ in id_components]
+                id_n_digits = [n_digits for _, n_digits in id_components]
+
+                row = row + [id_name]
+                order = define_column_order(row, adm_level)
+                human_readable_header_line = [key_header_dict.get(data_key, data_key)
+                                                for data_key in row]
+                first_row = False
+
+            else:
+
+                id_ = ''.join([row[i].zfill(n_digits) for i, n_digits in
+                                zip(id_indices, id_n_digits)])
+                row = row + [id_]
+
+            # Re-order the columns.
+            writer.writerow([row[i] for i in order])
+
+            # Insert just after first line.
+            if human_readable_header_line is not None:
+
+                writer.writerow([human_readable_header_line[i] for i in order])
+                human_readable_header_line = None
+
+    return
+
+def downcast_integer_column(column):
+    '''
+    Convert a column of integer strings to the smallest integer dtype which can
+    hold its values. Missing values (null in the JSON) give a nullable integer
+    dtype. Note that the API uses large negative numbers (e.g. -666666666) to
+    flag unavailable estimates, so these columns may need a signed dtype.
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    column = pd.to_numeric(column)
+    if column.isna().any():
+
+        # Pick the smallest type using the non-missing values, then use the
+        # nullable version of it.
+        non_missing = column.dropna().astype('int64')
+        if non_missing.size > 0:
+            dtype = pd.to_numeric(non_missing, downcast = 'integer').dtype
+        else:
+            dtype = np.dtype('int8')
+        column = column.astype('Int{:d}'.format(8 * dtype.itemsize))
+
+    elif column.size > 0 and column.min() >= 0:
+
+        column = pd.to_numeric(column, downcast = 'unsigned')
+
+    else:
+
+        column = pd.to_numeric(column, downcast = 'integer')
+
+    return column
+
+def convert_rows_to_dataframe(rows, adm_level, variable_keys, variable_headers):
+    '''
+    Convert rows from the API (header first) to a table with typed columns:
+        * the census variables (except NAME) become compact integer columns;
+        * the ID column (FIPS or GEOID) is a string, and the geography columns
+          (state, county, etc.) are categoricals;
+        * the ID and geography columns come first, and the census keys are
+          replaced with human-readable headers (see define_headers()).
+    '''
+
+    import pandas as pd
+
+    id_name, _ = define_id_components(adm_level)
+
+    # An empty table gives an empty file with the usual typed columns.
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        header = define_empty_header(adm_level, variable_keys)
+    df = pd.DataFrame.from_records(list(rows), columns = header)
+
+    # Add FIPS code.
+    df = add_id_column(df, adm_level)
+    geography_columns = [column for column in header if column in
+                            define_geography_columns()]
+
+    # Set the type of each column.
+    for column in header:
+
+        if column in geography_columns:
+            df[column] = df[column].astype('category')
+        elif column in variable_keys and column != 'NAME':
+            df[column] = downcast_integer_column(df[column])
+        else:
+            df[column] = df[column].astype('string')
+
+    # Re-order the columns.
+    other_columns = [column for column in header if column not in geography_columns]
+    df = df[[id_name] + geography_columns + other_columns]
+
+    # Replace census keys with human readable ones.
+    key_header_dict = {}
+    for key, header in zip(variable_keys, variable_headers):
+        key_header_dict[key] = header
+    df = df.rename(columns = key_header_dict)
+
+    return df
+
+def write_dataframe(df, path_out, file_format):
+    '''
+    Write a table from convert_rows_to_dataframe() to a Parquet or Feather
+    (Arrow IPC) file. Both require pyarrow.
+    '''
+
+    if file_format not in ['parquet', 'feather']:
+        raise ValueError('File format "{:}" not implemented or wrong'.format(file_format))
+
+    with open_part_file(path_out, 'wb') as file:
+        if file_format == 'parquet':
+            df.to_parquet(file, index = False, compression = 'zstd')
+        else:
+            df.to_feather(file, compression = 'zstd')
+
+    return
+
+def convert_json_to_columnar(path_json, variable_keys, variable_headers, file_format = 'parquet', overwrite = False):
+    '''
+    Convert a JSON file from request_data() to a typed columnar file (Parquet
+    or Feather) with the same name. See convert_rows_to_dataframe().
+    '''
+
+    # Process file path.
+    dir_out = os.path.dirname(path_json)
+    json_file_name_with_extension = os.path.basename(path_json)
+    file_name, _ = os.path.splitext(json_file_name_with_extension)
+
+    # Check if the file already exists, and is newer than the JSON file.
+    path_out = os.path.join(dir_out, '{:}.{:}'.format(file_name, file_format))
+    if is_up_to_date(path_out, path_json) and not overwrite:
+
+        print("Output file {:} is up to date, skipping conversion.".format(path_out))
+        return
+
+    adm_level = file_name.split('__')[-1]
+    with open(path_json, 'r') as file:
+
+        df = convert_rows_to_dataframe(iter_json_rows(file), adm_level,
+                variable_keys, variable_headers)
+
+    print("Writing to {:}".format(path_out))
+    write_dataframe(df, path_out, file_format)
+
+    return
+
+def convert_rows_to_csv_vectorized(rows, path_csv, adm_level, variable_keys, variable_headers):
+    '''
+    Same output as convert_rows_to_csv() (byte for byte), but the ID column
+    and the column re-ordering are done for all rows at once (see
+    add_id_column()). This holds the table in memory, and in
+    benchmark_US_census_data.py it is slower than the row-by-row version
+    (e.g. 4.5 s instead of 1.2 s for 60,000 blocks), so it is not the default.
+    '''
+
+    import pandas as pd
+
+    # An empty table gives an empty file, as in convert_rows_to_csv().
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        with open_part_file(path_csv, mode='w', newline=''):
+            pass
+        return
+
+    df = pd.DataFrame.from_records(list(rows), columns = header)
+
+    # Add FIPS code.
+    df = add_id_column(df, adm_level)
+
+    # Re-order the columns.
+    columns = list(df.columns)
+    columns = [columns[i] for i in define_column_order(columns, adm_level)]
+    df = df[columns]
+
+    # Replace census keys with human readable ones.
+    key_header_dict = {}
+    for key, header in zip(variable_keys, variable_headers):
+        key_header_dict[key] = header
+    human_readable_header_line = [key_header_dict.get(data_key, data_key)
+                                    for data_key in columns]
+
+    with open_part_file(path_csv, mode='w', newline='') as file:
+
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerow(human_readable_header_line)
+        # Use the same line ending as csv.writer, so the output is identical
+        # to that of convert_rows_to_csv().
+        df.to_csv(file, header = False, index = False, lineterminator = '\r\n')
+
+    return
+
+def convert_json_to_csv(path_json, variable_keys, variable_headers, overwrite = False, vectorized = False):
+    '''
+    Convert a JSON file from request_data() to a CSV file with the same name.
+    By default the JSON file is read one row at a time (see iter_json_rows()),
+    so peak memory does not depend on the size of the file. With
+    'vectorized', the whole table is processed at once instead (see
+    convert_rows_to_csv_vectorized()).
+    '''
+
+    # Process file path.
+    dir_out = os.path.dirname(path_json)
+    json_file_name_with_extension = os.path.basename(path_json)
+    file_name, _ = os.path.splitext(json_file_name_with_extension)
+    
+    # Check if the file already exists, and is newer than the JSON file.
+    path_csv = os.path.join(dir_out, '{:}.csv'.format(file_name))
+    if is_up_to_date(path_csv, path_json) and not overwrite:
+
+        print("Output file {:} is up to date, skipping conversion.".format(path_csv))
+        return
+
+    # Stream the JSON file into the CSV file.
+    adm_level = file_name.split('__')[-1]
+    print("Writing to {:}".format(path_csv))
+    with open(path_json, 'r') as file:
+
+        if vectorized:
+            convert_rows_to_csv_vectorized(iter_json_rows(file), path_csv,
+                    adm_level, variable_keys, variable_headers)
+        else:
+            convert_rows_to_csv(iter_json_rows(file), path_csv, adm_level,
+                    variable_keys, variable_headers)
+    
+    return
+
+def define_rollup_levels():
+    '''
+    Admin levels which nest inside each other, from largest to smallest, with
+    the length of their GEOIDs. The GEOID of a geography starts with the GEOID
+    of the geography containing it, e.g. block group 120150101001 is in tract
+    12015010100, which is in county 12015, which is in state 12.
+    (Places are not included because they can cross county boundaries.)
+    '''
+
+    rollup_levels = [('state', 2), ('county', 5), ('tract', 11),
+                     ('block_group', 12), ('block', 15)]
+
+    return rollup_levels
+
+def rollup_rows(rows, from_adm_level, to_adm_level, variable_keys):
+    '''
+    Build the rows for a larger admin level by summing the counts of a smaller
+    one (both in the API layout, header first), e.g. from block group to
+    county. All geographies are grouped at once by the start of their GEOID.
+    The variables must be counts (estimates, not margins of error). If any
+    value in a group is missing or is one of the API's negative flags for an
+    unavailable estimate, the total is given as None. NAME cannot be derived,
+    so it is also None.
+    '''
+
+    import pandas as pd
+
+    rollup_levels = define_rollup_levels()
+    level_names = [level for level, _ in rollup_levels]
+    from_adm_level = from_adm_level.replace(' ', '_')
+    to_adm_level = to_adm_level.replace(' ', '_')
+    if level_names.index(to_adm_level) >= level_names.index(from_adm_level):
+        raise ValueError('Cannot roll up from "{:}" to "{:}"'.format(
+                            from_adm_level, to_adm_level))
+    prefix_length = dict(rollup_levels)[to_adm_level]
+
+    # An empty table (no header) rolls up to an empty table.
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return []
+
+    df = pd.DataFrame.from_records(list(rows), columns = header)
+    df = add_id_column(df, from_adm_level)
+    id_name, _ = define_id_components(from_adm_level)
+
+    # Sum the counts, grouped by GEOID prefix.
+    count_keys = [key for key in variable_keys if key in header and key != 'NAME']
+    counts = df[count_keys].apply(pd.to_numeric)
+    counts = counts.mask(counts < 0)
+    groups = df[id_name].str.slice(0, prefix_length)
+    totals = counts.groupby(groups.values).sum()
+    has_missing = counts.isna().groupby(groups.values).any()
+    totals = totals.astype('int64').astype('string').mask(has_missing)
+
+    # Split the new GEOIDs back into the geography columns.
+    _, id_components = define_id_components(to_adm_level)
+    geography_columns = []
+    i = 0
+    for column, n_digits in id_components:
+
+        totals[column] = totals.index.str.slice(i, i + n_digits)
+        geography_columns.append(column)
+        i = i + n_digits
+
+    rollup_header = [key for key in variable_keys if key in header] + geography_columns
+    if 'NAME' in rollup_header:
+        totals['NAME'] = None
+    totals = totals[rollup_header].astype(object)
+    totals = totals.where(totals.notna(), None)
+
+    rollup = [rollup_header] + totals.values.tolist()
+
+    return rollup
+
+def define_rollup_targets(paths_json, rollup_adm_levels):
+    '''
+    Choose which of the JSON files from request_data() to roll up, and to
+    which of 'rollup_adm_levels' (see rollup_json()). The smallest admin level
+    which nests inside the others (see define_rollup_levels()) is used, so
+    e.g. places are ignored. Levels which already have a file (because they
+    were requested from the API) are not rolled up, so the API data (which
+    includes NAME) is kept. Return (None, []) if there is nothing to roll up.
+    '''
+
+    level_names = [level for level, _ in define_rollup_levels()]
+    rollup_adm_levels = [adm_level.replace(' ', '_') for adm_level in rollup_adm_levels]
+    for adm_level in rollup_adm_levels:
+        if adm_level not in level_names:
+            raise ValueError('Roll-up admin level "{:}" not implemented or wrong'.format(adm_level))
+
+    adm_levels = [os.path.splitext(os.path.basename(path))[0].split('__')[-1]
+                    for path in paths_json]
+    nested_adm_levels = [adm_level for adm_level in adm_levels if adm_level in
+                            level_names]
+    if not nested_adm_levels:
+        return None, []
+
+    from_adm_level = max(nested_adm_levels, key = level_names.index)
+    path_finest = paths_json[adm_levels.index(from_adm_level)]
+    to_adm_levels = [adm_level for adm_level in rollup_adm_levels if
+                        (level_names.index(adm_level) < level_names.index(from_adm_level))
+                        and (adm_level not in adm_levels)]
+
+    return path_finest, to_adm_levels
+
+def rollup_json(path_json, to_adm_levels, variable_keys, overwrite = False):
+    '''
+    Build JSON files for larger admin levels from a JSON file from
+    request_data(), without any further requests to the API (see
+    rollup_rows()). The new files are named in the same way as the input,
+    e.g. US_pop_by_age_sex__county.json from
+    US_pop_by_age_sex__block_group.json, so they can be converted in the same
+    way.
+    '''
+
+    dir_out = os.path.dirname(path_json)
+    file_name, _ = os.path.splitext(os.path.basename(path_json))
+    request_name, from_adm_level = file_name.split('__')
+
+    with open(path_json, 'r') as file:
+        rows = list(iter_json_rows(file))
+
+    paths_out = []
+    for to_adm_level in to_adm_levels:
+
+        path_out = os.path.join(dir_out, '{:}__{:}.json'.format(request_name,
+                        to_adm_level.replace(' ', '_')))
+        paths_out.append(path_out)
+        if is_up_to_date(path_out, path_json) and not overwrite:
+
+            print("Output file {:} is up to date, skipping roll-up.".format(path_out))
+            continue
+
+        rollup = rollup_rows(rows, from_adm_level, to_adm_level, variable_keys)
+        print("Writing to {:}".format(path_out))
+        write_rows_to_json(rollup, path_out)
+
+    return paths_out
+
+def main(argv = None, settings = None):
+    '''
+    Run the download from the command line ('argv', default sys.argv). The
+    defaults of the options can be changed in the 'census' section of the
+    config file or in the environment (see config.py), or given as
+    'settings'.
+    '''
+
+    global dir_output
+
+    if settings is None:
+        settings = load_settings('census')
+
+    parser = argparse.ArgumentParser(prog = 'hrmd-ma-misc census',
+                description = "Download US Census data via the API.")
+    parser.add_argument("--dir_output", default = settings.get('dir_output', dir_output), help = "Output folder, which must exist.")
+    parser.add_argument("--path_api_key", default = settings.get('path_api_key', 'api_key_US_census.txt'), help = "File containing the API key (unless the 'api_key' setting is given).")
+    parser.add_argument("--endpoint", default = settings.get('endpoint', "https://api.census.gov/data/2022/acs/acs5"), help = "Dataset endpoint.")
+    parser.add_argument("--adm_levels", default = settings.get('adm_levels'), help = "Comma-separated list of admin levels to request, e.g. 'county,block group' (default: block group).")
+    parser.add_argument("--variable_group", default = settings.get('variable_group'), help = "Download a whole variable group (e.g. B01001) from the catalog, instead of define_headers().")
+    parser.add_argument("--overwrite", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('overwrite', False)), help = "Overwrite output files.")
+    parser.add_argument("--max_workers", type = int, default = settings.get('max_workers', 8), help = "Maximum number of requests to send at the same time.")
+    parser.add_argument("--requests_per_second", type = float, default = settings.get('requests_per_second'), help = "Maximum average number of requests per second (default: no limit).")
+    parser.add_argument("--output_format", choices = ['json', 'csv', 'parquet', 'feather'], default = settings.get('output_format', 'json'), help = "Format of the files written from the API responses.")
+    parser.add_argument("--vectorized", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('vectorized', False)), help = "Convert whole tables at once with pandas.")
+    parser.add_argument("--rollup", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('rollup', False)), help = "Build the --rollup_adm_levels which were not requested by adding up the counts of the smallest level requested (NAME is left empty).")
+    parser.add_argument("--rollup_adm_levels", default = settings.get('rollup_adm_levels', 'state,county,tract'), help = "Comma-separated list of admin levels to build with --rollup.")
+    parser.add_argument("--columnar_format", choices = ['parquet', 'feather', 'none'], default = settings.get('columnar_format', 'parquet'), help = "Also write typed columnar files.")
+    parser.add_argument("--cache", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('cache', False)), help = "Cache the API responses in the output folder, and re-use them for 30 days.")
+    parser.add_argument("--store", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('store', False)), help = "Keep all downloaded values in a local store in the output folder, and only request new partitions.")
+    parser.add_argument("--jobs", action = argparse.BooleanOptionalAction, default = parse_bool(settings.get('jobs', False)), help = "Run the jobs from define_download_jobs() (or --path_jobs) instead.")
+    parser.add_argument("--path_jobs", default = settings.get('path_jobs'), help = "JSON file of download jobs (see load_jobs_from_json_file()).")
+    args = parser.parse_args(argv)
+
+    # request_data() and define_job_path() write to the module's output
+    # directory.
+    dir_output = args.dir_output
+
+    # Check that the output directory exists.
+    if not os.path.isdir(dir_output):
+        raise FileNotFoundError("You must create a directory called '{:}'".format(dir_output))
+
+    # Set to 'True' to overwrite output files.
+    overwrite = args.overwrite
+
+    # Define the dataset and the variables to download.
+    # Set 'variable_group' (e.g. 'B01001') to generate the keys and headers
+    # for a whole group from the local variable catalog, instead of using
+    # define_headers(). The catalog is only downloaded the first time.
+    endpoint = args.endpoint
+    variable_group = args.variable_group
+    if variable_group is None:
+        catalog = None
+        variable_keys, variable_headers = define_headers()
+    else:
+        catalog = VariableCatalog(os.path.join(dir_output, 'census_catalog.sqlite'))
+        catalog.build(endpoint)
+        variable_keys, variable_headers = define_headers_from_catalog(catalog,
+                                            endpoint, variable_group)
+
+    # Admin levels to request, e.g. ['county', 'block group']. Set to None for
+    # the default (see request_data()).
+    target_adm_levels = parse_list(args.adm_levels)
+
+    # Set to a list of admin levels, e.g. ['state', 'county', 'tract'], to
+    # build those levels from the smallest one requested, by adding up the
+    # counts (see rollup_json()), instead of requesting them from the API.
+    # Set to None to disable.
+    rollup_adm_levels = None
+    if args.rollup:
+        rollup_adm_levels = parse_list(args.rollup_adm_levels)
+
+    # Maximum number of requests to send at the same time.
+    max_workers = args.max_workers
+
+    # Set to 'csv' to write CSV files directly from the API responses,
+    # without an intermediate JSON file.
+    output_format = args.output_format
+
+    # Set to 'True' to convert whole tables at once with pandas, which holds
+    # the table in memory and is usually slower (see
+    # convert_rows_to_csv_vectorized()).
+    vectorized = args.vectorized
+
+    # Also write typed columnar files ('parquet' or 'feather'), which are much
+    # faster to load than CSV. Set to None to skip.
+    columnar_format = args.columnar_format if args.columnar_format != 'none' else None
+
+    # Set to 'True' to cache the API responses, so re-running the same query
+    # only sends requests for partitions which are not cached.
+    cache = None
+    if args.cache:
+        cache = ResponseCache(os.path.join(dir_output, 'cache_census_API'),
+                    ttl = 30 * 24 * 3600, max_bytes = 2 * 1024 ** 3)
+
+    # Set to 'True' to keep all downloaded values in a local store, so adding
+    # more states only requests the new ones.
+    store = None
+    if args.store:
+        store = CensusStore(os.path.join(dir_output, 'US_census_store.sqlite'))
+
+    # Set to 'True' to run the jobs from define_download_jobs() (or from a
+    # JSON file, see load_jobs_from_json_file()) instead, which can mix
+    # several years and datasets.
+    use_jobs = args.jobs or (args.path_jobs is not None)
+
+    # Limit the rate of requests, e.g. to 10 per second. Set to None to send
+    # requests as fast as 'max_workers' allows.
+    requests_per_second = args.requests_per_second
+
+    # Retry requests which fail because the API is busy or unreachable, and
+    # keep a list of those which still fail, which the next run retries
+    # first (see fetch_scheduler.py).
+    scheduler = FetchScheduler(max_per_host = max_workers,
+                    requests_per_second = requests_per_second,
+                    failed_jobs = FailedJobQueue(os.path.join(dir_output,
+                                    'failed_jobs.sqlite'), 'census'))
+
+    # Record the time and size of each request (see download_telemetry.py).
+    path_telemetry = os.path.join(dir_output, 'telemetry.jsonl')
+    start_telemetry(path_telemetry, 'census')
+
+    # Get data from US census API.
+    api_key = settings.get('api_key')
+    if api_key is None:
+        api_key = load_api_key_from_txt_file(args.path_api_key)
+    if cache is not None:
+        retry_failed_partitions(create_session(max_workers), scheduler, api_key,
+                cache = cache)
+    if use_jobs:
+        if args.path_jobs is not None:
+            jobs = load_jobs_from_json_file(args.path_jobs)
+        else:
+            jobs = define_download_jobs()
+        paths_out = download_jobs(jobs, api_key, max_concurrency = max_workers,
+                        requests_per_second = requests_per_second,
+                        overwrite = overwrite, cache = cache, scheduler = scheduler)
+        output_format = 'json'
+    else:
+        paths_out = request_data(api_key, overwrite = overwrite,
+                        max_workers = max_workers, output_format = output_format,
+                        cache = cache, store = store, endpoint = endpoint,
+                        target_adm_levels = target_adm_levels,
+                        variable_keys = variable_keys,
+                        variable_headers = variable_headers, catalog = catalog,
+                        scheduler = scheduler)
+
+    stop_telemetry()
+    print('Request telemetry written to {:} (summarise it with: hrmd-ma-misc report).'.format(
+            path_telemetry))
+
+    # The roll-up and the columnar files need the optional dependencies
+    # (pip install .[census]), so they are skipped without them.
+    has_pandas = importlib.util.find_spec('pandas') is not None
+    has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+    if (columnar_format is not None) and not (has_pandas and has_pyarrow):
+        print("Skipping the {:} files, which need pandas and pyarrow (pip install .[census]).".format(
+                columnar_format))
+        columnar_format = None
+
+    # Build larger admin levels from the smallest one requested. Levels which
+    # were requested are left as they are (see define_rollup_targets()).
+    if (output_format == 'json') and (not use_jobs) and rollup_adm_levels and \
+            (not has_pandas):
+
+        print("Skipping the roll-up, which needs pandas (pip install .[census]).")
+
+    elif (output_format == 'json') and (not use_jobs) and rollup_adm_levels:
+
+        path_finest, to_adm_levels = define_rollup_targets(paths_out,
+                                        rollup_adm_levels)
+        if to_adm_levels:
+            paths_out = paths_out + rollup_json(path_finest, to_adm_levels,
+                            variable_keys, overwrite = overwrite)
+
+    # Convert JSON output into CSV files.
+    if output_format == 'json':
+
+        for path_json in paths_out:
+
+            convert_json_to_csv(path_json, variable_keys, variable_headers,
+                    overwrite = overwrite, vectorized = vectorized)
+
+            if columnar_format is not None:
+                convert_json_to_columnar(path_json, variable_keys, variable_headers,
+                        file_format = columnar_format, overwrite = overwrite)
+
+    return
+
+if __name__ == '__main__':
+
+    main()
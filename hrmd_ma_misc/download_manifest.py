@@ -0,0 +1,283 @@
+'''
+A persistent record of downloaded files, and a resumable file download which
+uses it, shared by download_3DEP_data.py and download_MCDWD_flood_data.py.
+
+The manifest is an SQLite database with one row per URL, recording where the
+file was saved, its size, the ETag and Last-Modified headers sent by the
+server, its SHA-256 checksum, and when it was downloaded and last checked.
+When a file is requested again, the stored ETag and Last-Modified are sent as
+If-None-Match and If-Modified-Since headers, so the server answers
+'304 Not Modified' with no body if the file has not changed, and only changed
+files are transferred again.
+Each download is also recorded as a telemetry event (see
+download_telemetry.py).
+'''
+# Imports: Standard library.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Imports: Local.
+from .download_telemetry import record_event
+
+class DownloadManifest:
+
+    def __init__(self, path_db):
+
+        self.path_db = path_db
+        dir_db = os.path.dirname(path_db)
+        if dir_db:
+            os.makedirs(dir_db, exist_ok = True)
+
+        # The manifest is shared between worker threads, so access is
+        # serialised.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path_db, check_same_thread = False)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    url           TEXT PRIMARY KEY,
+                    path          TEXT,
+                    size          INTEGER,
+                    etag          TEXT,
+                    last_modified TEXT,
+                    sha256        TEXT,
+                    downloaded    REAL,
+                    checked       REAL
+                )''')
+
+        return
+
+    def get(self, url):
+        '''
+        Return the record for a URL as a dictionary, or None if the URL has
+        not been downloaded.
+        '''
+
+        with self.lock:
+            cursor = self.connection.execute('SELECT * FROM files WHERE url = ?', (url,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [description[0] for description in cursor.description]
+
+        return dict(zip(columns, row))
+
+    def record(self, url, path, size, etag, last_modified, sha256):
+        '''
+        Record a file which has just been downloaded (or found to be complete).
+        '''
+
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('''
+                INSERT OR REPLACE INTO files
+                (url, path, size, etag, last_modified, sha256, downloaded, checked)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                (url, path, size, etag, last_modified, sha256, now, now))
+
+        return
+
+    def mark_checked(self, url):
+        '''
+        Record that the server reported a file as unchanged.
+        '''
+
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE files SET checked = ? WHERE url = ?',
+                    (time.time(), url))
+
+        return
+
+    def close(self):
+
+        self.connection.close()
+
+        return
+
+def compute_sha256(path, chunk_size = 1024 * 1024):
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+def define_conditional_headers(entry):
+    '''
+    Get the headers which ask the server to send a file only if it differs
+    from a manifest entry. Empty if the entry has no ETag or Last-Modified.
+    '''
+
+    headers = {}
+    if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    return headers
+
+def get_remote_metadata(session, url):
+    '''
+    Get (size, ETag, Last-Modified) of a remote file from a HEAD request. Each
+    is None if the server does not report it.
+    '''
+
+    response = session.head(url, allow_redirects = True, timeout = 60)
+    response.raise_for_status()
+    content_length = response.headers.get('Content-Length')
+    size = int(content_length) if content_length is not None else None
+
+    return size, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+def parse_content_range(content_range):
+    '''
+    Get (start, total size) from a Content-Range header such as
+        'bytes 1000-1999/5000' or 'bytes */5000'
+    The start is None for the second form, and the total is None if it is
+    unknown ('*').
+    '''
+
+    match = re.fullmatch(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)', content_range.strip())
+    if match is None:
+        raise ValueError('Cannot parse Content-Range "{:}"'.format(content_range))
+
+    start, total = match.groups()
+    start = int(start) if start is not None else None
+    total = int(total) if total != '*' else None
+
+    return start, total
+
+def download_file(session, url, file_path, manifest = None, chunk_size = 1024 * 1024):
+    '''
+    Download a file to 'file_path' via a temporary '.part' file, resuming a
+    previous partial download if there is one. The '.part' file is only
+    renamed to 'file_path' once its size matches the size given by the server.
+    If a DownloadManifest is given, existing files are only transferred again
+    if the server reports that they have changed, and each download is
+    recorded.
+    Each call is recorded as a telemetry event (see download_telemetry.py).
+    Returns 'skipped' if the file already exists and cannot be checked,
+    'unchanged' if the server reports that it has not changed, 'updated' if a
+    changed file was downloaded again, otherwise 'downloaded'.
+    '''
+
+    stats = {'status' : None, 'bytes' : 0, 'ttfb_s' : None, 'write_s' : 0.0}
+    time_start = time.time()
+    result = None
+    error = None
+    try:
+        result = transfer_file(session, url, file_path, manifest, chunk_size, stats)
+    except Exception as exception:
+        error = repr(exception)
+        raise
+    finally:
+        record_event('file', url = url, item = os.path.basename(file_path),
+                result = result, error = error, duration_s = time.time() - time_start,
+                **stats)
+
+    return result
+
+def transfer_file(session, url, file_path, manifest, chunk_size, stats):
+    '''
+    Do the work of download_file(), adding the HTTP status, the number of
+    bytes received, the time until the response headers arrived and the time
+    spent writing to disk to 'stats'.
+    '''
+
+    part_path = '{:}.part'.format(file_path)
+    result = 'downloaded'
+    headers = {}
+
+    if os.path.exists(file_path):
+
+        entry = manifest.get(url) if manifest is not None else None
+        if (entry is not None) and (entry['size'] == os.path.getsize(file_path)):
+
+            # Ask the server to send the file only if it has changed.
+            headers = define_conditional_headers(entry)
+            if not headers:
+                return 'skipped'
+            result = 'updated'
+
+        else:
+
+            # Files which are not in the manifest (e.g. downloaded by older
+            # versions of the scripts with wget) may be incomplete, so check
+            # their size. If it is wrong, resume the download.
+            remote_size, etag, last_modified = get_remote_metadata(session, url)
+            if (remote_size is None) or (os.path.getsize(file_path) == remote_size):
+                if manifest is not None:
+                    manifest.record(url, file_path, os.path.getsize(file_path), etag,
+                            last_modified, compute_sha256(file_path))
+                return 'skipped'
+
+            print(f"File {file_path} is incomplete, resuming download.")
+            os.replace(file_path, part_path)
+
+    # A changed file is downloaded again from the start.
+    if headers and os.path.exists(part_path):
+        os.remove(part_path)
+
+    part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if part_size > 0:
+        headers['Range'] = 'bytes={:d}-'.format(part_size)
+
+    with session.get(url, headers = headers, stream = True, timeout = (10, 60)) as response:
+
+        stats['status'] = response.status_code
+        stats['ttfb_s'] = response.elapsed.total_seconds()
+        if response.status_code == 304:
+            manifest.mark_checked(url)
+            return 'unchanged'
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        # The range starts at the end of the file, so the '.part' file may
+        # already be complete.
+        if response.status_code == 416:
+            _, total_size = parse_content_range(response.headers.get('Content-Range', 'bytes */*'))
+            if total_size != part_size:
+                # The remote file has changed, so start again.
+                os.remove(part_path)
+                return transfer_file(session, url, file_path, manifest, chunk_size, stats)
+
+        else:
+
+            response.raise_for_status()
+            if response.status_code == 206:
+                start, total_size = parse_content_range(response.headers['Content-Range'])
+                if start != part_size:
+                    raise IOError('Server resumed {:} at byte {:}, expected {:d}'.format(
+                                    url, start, part_size))
+                mode = 'ab'
+            else:
+                # The server ignored the range request and sent the whole file.
+                content_length = response.headers.get('Content-Length')
+                total_size = int(content_length) if content_length is not None else None
+                mode = 'wb'
+
+            # Write the raw bytes, so the size can be compared with the size
+            # given by the server.
+            with open(part_path, mode) as file:
+                for chunk in response.raw.stream(chunk_size, decode_content = False):
+                    time_write = time.time()
+                    file.write(chunk)
+                    stats['write_s'] = stats['write_s'] + time.time() - time_write
+                    stats['bytes'] = stats['bytes'] + len(chunk)
+
+    size = os.path.getsize(part_path)
+    if (total_size is not None) and (size != total_size):
+        raise IOError('Incomplete download of {:}: {:d} of {:d} bytes'.format(
+                        url, size, total_size))
+
+    os.replace(part_path, file_path)
+    if manifest is not None:
+        manifest.record(url, file_path, size, etag, last_modified, compute_sha256(file_path))
+
+    return result
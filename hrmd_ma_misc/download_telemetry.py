@@ -0,0 +1,252 @@
+'''
+Structured telemetry for the download scripts (download_US_census_data.py,
+download_3DEP_data.py and download_MCDWD_flood_data.py).
+
+While telemetry is started (see start_telemetry()), each HTTP request and
+each file transfer is written as one JSON object per line to a log file, e.g.
+
+{"time": 1728000000.0, "run": "3f2a9c1b7d4e", "source": "3dep", "event": "file",
+ "url": "https://...", "host": "prd-tnm.s3.amazonaws.com", "item": "USGS_1M_17_x39y299_....tif",
+ "result": "downloaded", "status": 200, "bytes": 412345678, "ttfb_s": 0.21,
+ "duration_s": 38.2, "write_s": 1.9}
+
+where 'ttfb_s' is the time until the response headers arrived, 'duration_s'
+the total time and 'write_s' the time spent writing to disk. Census requests
+also record whether the response came from the cache ('cache_hit'). Requests
+which are sent again after a transient failure are recorded as 'retry' events
+(see fetch_scheduler.py).
+Recording an event when telemetry is not started does nothing.
+API keys in URLs and error messages (the 'key' query parameter, as used by the
+census API) are replaced with 'REDACTED' before events are written, so logs
+can be shared (see redact_secrets()).
+
+The report command summarises a log: overall throughput, average number of
+transfers in progress, time waiting for the server and writing to disk, the
+slowest hosts and the slowest requests or files. This helps tell whether a
+slow download is limited by the server, the concurrency settings or the disk.
+
+Usage:
+
+hrmd-ma-misc report output/telemetry.jsonl
+hrmd-ma-misc report output_3DEP_tiles/telemetry.jsonl --run all
+'''
+# Imports: Standard library.
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import uuid
+
+# The telemetry log of the running script (see start_telemetry()).
+active_telemetry = None
+
+# The 'key' query parameter of a URL, e.g. '?get=NAME&key=abc123'.
+secret_param_pattern = re.compile(r'([?&]key=)[^&#\s\'"]+', re.IGNORECASE)
+
+def redact_secrets(text):
+    '''
+    Replace the value of the 'key' query parameter in a URL, or in any text
+    containing URLs (such as the message of a requests.HTTPError), with
+    'REDACTED'.
+    '''
+
+    return secret_param_pattern.sub(r'\1REDACTED', text)
+
+class Telemetry:
+
+    def __init__(self, path_log, source):
+        '''
+        'path_log'  JSON-lines file to append events to.
+        'source'    Name of the script writing the events, e.g. 'census'.
+        '''
+
+        self.path_log = path_log
+        self.source = source
+        self.run_id = uuid.uuid4().hex[:12]
+
+        dir_log = os.path.dirname(path_log)
+        if dir_log:
+            os.makedirs(dir_log, exist_ok = True)
+
+        # Events are written from worker threads.
+        self.lock = threading.Lock()
+        self.file = open(path_log, 'a', buffering = 1)
+
+        return
+
+    def emit(self, event, **fields):
+
+        record = {'time' : time.time(), 'run' : self.run_id, 'source' : self.source,
+                  'event' : event}
+        if 'url' in fields:
+            record['host'] = urlsplit(fields['url']).netloc
+        record.update(fields)
+        for name, value in record.items():
+            if isinstance(value, str):
+                record[name] = redact_secrets(value)
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + '\n')
+
+        return
+
+    def close(self):
+
+        self.file.close()
+
+        return
+
+def start_telemetry(path_log, source):
+    '''
+    Start writing events to a log file, until stop_telemetry() is called.
+    '''
+
+    global active_telemetry
+    active_telemetry = Telemetry(path_log, source)
+    active_telemetry.emit('run_start')
+
+    return active_telemetry
+
+def record_event(event, **fields):
+    '''
+    Write an event to the active log, if telemetry is started.
+    '''
+
+    if active_telemetry is not None:
+        active_telemetry.emit(event, **fields)
+
+    return
+
+def stop_telemetry():
+
+    global active_telemetry
+    if active_telemetry is not None:
+        active_telemetry.emit('run_end')
+        active_telemetry.close()
+        active_telemetry = None
+
+    return
+
+def read_events(path_log, run = 'last'):
+    '''
+    Read the events of one run ('last', or a run ID) or of all runs ('all')
+    from a log file.
+    '''
+
+    with open(path_log, 'r') as file:
+        events = [json.loads(line) for line in file if line.strip()]
+
+    if run == 'last':
+        run_starts = [event['run'] for event in events if event['event'] == 'run_start']
+        run = run_starts[-1] if run_starts else 'all'
+
+    if run != 'all':
+        events = [event for event in events if event['run'] == run]
+
+    return events
+
+def percentile(values, q):
+
+    values = sorted(values)
+    if not values:
+        return float('nan')
+
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def summarize_events(events, n_slowest = 10):
+    '''
+    Describe the transfers in a list of events (see the module docstring).
+    '''
+
+    transfers = [event for event in events if event['event'] in ['request', 'file']]
+    if not transfers:
+        return 'No requests or files recorded.'
+
+    # Wall-clock time from the first transfer starting to the last finishing.
+    time_start = min([event['time'] - event.get('duration_s', 0.0) for event in transfers])
+    time_end = max([event['time'] for event in transfers])
+    wall_time = max(time_end - time_start, 1.0E-9)
+
+    n_bytes = sum([event.get('bytes') or 0 for event in transfers])
+    busy_time = sum([event.get('duration_s') or 0.0 for event in transfers])
+    wait_time = sum([event.get('ttfb_s') or 0.0 for event in transfers])
+    write_time = sum([event.get('write_s') or 0.0 for event in transfers])
+    n_cache_hits = len([event for event in transfers if event.get('cache_hit')])
+    n_retries = len([event for event in events if event['event'] == 'retry'])
+    n_errors = len([event for event in transfers if event.get('error')])
+    status_counts = {}
+    for event in transfers:
+        status = str(event.get('status'))
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    lines = ['{:d} requests/files from {:} in {:.1f} s: {:.1f} MB, {:.2f} MB/s overall'.format(
+                len(transfers), ', '.join(sorted(set([event['source'] for event in transfers]))),
+                wall_time, n_bytes / 1.0E6, n_bytes / 1.0E6 / wall_time),
+             '    Average transfers in progress: {:.1f}'.format(busy_time / wall_time),
+             '    Share of transfer time waiting for the server: {:.0%}, writing to disk: {:.0%}'.format(
+                wait_time / max(busy_time, 1.0E-9), write_time / max(busy_time, 1.0E-9)),
+             '    Cache hits: {:d}, retries: {:d}, errors: {:d}'.format(n_cache_hits, n_retries, n_errors),
+             '    HTTP status: ' + ', '.join(['{:} x {:d}'.format(status, count) for
+                                        status, count in sorted(status_counts.items())])]
+
+    # Hosts, slowest first.
+    hosts = {}
+    for event in transfers:
+        if event.get('cache_hit'):
+            continue
+        hosts.setdefault(event.get('host', ''), []).append(event)
+
+    lines.append('')
+    lines.append('{:<40} {:>6} {:>10} {:>10} {:>10} {:>8}'.format('Host', 'N', 'MB',
+                    'med TTFB s', 'p95 dur s', 'MB/s'))
+    host_rows = []
+    for host, host_events in hosts.items():
+
+        host_bytes = sum([event.get('bytes') or 0 for event in host_events])
+        host_time = sum([event.get('duration_s') or 0.0 for event in host_events])
+        host_rows.append((percentile([event.get('duration_s') or 0.0 for event in host_events], 0.95),
+                          host, len(host_events), host_bytes,
+                          percentile([event.get('ttfb_s') or 0.0 for event in host_events], 0.5),
+                          host_bytes / 1.0E6 / max(host_time, 1.0E-9)))
+
+    for p95_duration, host, n, host_bytes, median_ttfb, rate in sorted(host_rows, reverse = True):
+        lines.append('{:<40} {:>6d} {:>10.1f} {:>10.3f} {:>10.3f} {:>8.2f}'.format(
+                        host[:40], n, host_bytes / 1.0E6, median_ttfb, p95_duration, rate))
+
+    # Slowest requests and files.
+    lines.append('')
+    lines.append('Slowest {:d}:'.format(n_slowest))
+    slowest = sorted(transfers, key = lambda event: event.get('duration_s') or 0.0,
+                        reverse = True)[:n_slowest]
+    for event in slowest:
+
+        duration = event.get('duration_s') or 0.0
+        lines.append('    {:8.2f} s {:>10.1f} MB {:>8.2f} MB/s  {:} {:}'.format(duration,
+                        (event.get('bytes') or 0) / 1.0E6,
+                        (event.get('bytes') or 0) / 1.0E6 / max(duration, 1.0E-9),
+                        event.get('item') or event.get('url'),
+                        '({:})'.format(event['error']) if event.get('error') else ''))
+
+    return '\n'.join(lines)
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Summarise the telemetry logs of the download scripts.")
+    parser.add_argument("command", choices = ['report'], help = "'report' summarises a log.")
+    parser.add_argument("path_log", help = "Telemetry log (JSON lines).")
+    parser.add_argument("--run", default = 'last', help = "Run ID to report, 'last' (default) or 'all'.")
+    parser.add_argument("--n_slowest", type = int, default = 10, help = "Number of slowest requests or files to list.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'report':
+        print(summarize_events(read_events(args.path_log, run = args.run),
+                n_slowest = args.n_slowest))
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,303 @@
+'''
+Estimate a high-resolution inundation mask from the USGS 3DEP DEM tiles
+downloaded by download_3DEP_data.py, to sharpen the 250 m MCDWD flood maps.
+
+Two methods are available:
+    * 'water_level': pixels at or below a water level (m, in the vertical
+      datum of the DEM) are inundated.
+    * 'hand': pixels less than a threshold (m) above the lowest point within
+      'drainage_radius' (m) are inundated. This is a local approximation of
+      the height above nearest drainage (HAND), which treats the lowest point
+      nearby as the drainage, and needs no flow routing, so each block can be
+      processed on its own.
+
+The tiles are combined into a virtual mosaic (see mosaic_3DEP_tiles.py), which
+is processed in square blocks by worker processes. Each block is read with a
+margin ('halo') as wide as the drainage radius, so results do not depend on
+where the block edges are, and the main process writes the blocks to a tiled,
+compressed GeoTIFF (1 = inundated, 0 = dry, 255 = no data). Memory use depends
+on the block size and number of workers, not on the size of the area.
+
+Usage:
+
+python -m hrmd_ma_misc.estimate_inundation_from_DEM --method water_level --threshold 2.5
+python -m hrmd_ma_misc.estimate_inundation_from_DEM --method hand --threshold 1.0 --drainage_radius 500
+python -m hrmd_ma_misc.estimate_inundation_from_DEM --benchmark
+'''
+# Imports: Standard library.
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import time
+
+# Imports: Third party.
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# Imports: Local.
+from .mosaic_3DEP_tiles import define_blocks, find_tile_files, write_vrt
+
+# Define global variables.
+dir_tiles_default = 'output_3DEP_tiles'
+mask_nodata = 255
+
+# The DEM opened by each worker process (see init_worker()).
+worker_dataset = None
+
+def sliding_min_1d(array, size, axis):
+    '''
+    Get the minimum over a centred window of 'size' (odd) pixels along one
+    axis. Values beyond the edges of the array are ignored.
+    Minima over windows of 1, 2, 4, ... pixels are built by doubling, and
+    combined to cover the window, so only about 2 log2(size) vectorized passes
+    are needed whatever the window size.
+    '''
+
+    half_size = size // 2
+    n = array.shape[axis]
+    array = np.moveaxis(array, axis, 0)
+    pad_width = [(half_size, half_size)] + [(0, 0)] * (array.ndim - 1)
+    window_min = np.pad(array, pad_width, constant_values = np.inf)
+
+    result = None
+    offset = 0
+    width = 1
+    remaining = size
+    while remaining:
+
+        # Add a window of 'width' pixels starting at 'offset'.
+        if remaining & 1:
+            piece = window_min[offset : offset + n]
+            result = piece.copy() if result is None else np.minimum(result, piece, out = result)
+            offset = offset + width
+
+        remaining = remaining >> 1
+        if remaining:
+            window_min = np.minimum(window_min[:-width], window_min[width:])
+            width = width * 2
+
+    return np.moveaxis(result, 0, axis)
+
+def sliding_min_2d(array, size):
+    '''
+    Get the minimum over a centred square window of 'size' (odd) pixels.
+    '''
+
+    return sliding_min_1d(sliding_min_1d(array, size, 0), size, 1)
+
+def compute_inundation(dem, method, threshold, window_size = None):
+    '''
+    Compute the inundation mask (1 = inundated, 0 = dry, 255 = no data) of a
+    DEM array in which missing values are NaN.
+    'window_size' (odd, in pixels) is the side of the window searched for the
+    drainage with the 'hand' method.
+    '''
+
+    valid = np.isfinite(dem)
+    if method == 'water_level':
+        inundated = (dem <= threshold)
+    elif method == 'hand':
+        drainage = sliding_min_2d(np.where(valid, dem, np.inf), window_size)
+        inundated = ((dem - drainage) <= threshold)
+    else:
+        raise ValueError('Method "{:}" not implemented or wrong'.format(method))
+
+    mask = np.where(valid, inundated, mask_nodata).astype('uint8')
+
+    return mask
+
+def init_worker(path_dem):
+    '''
+    Open the DEM once in each worker process.
+    '''
+
+    global worker_dataset
+    worker_dataset = rasterio.open(path_dem)
+
+    return
+
+def process_block(window, halo, method, threshold, window_size):
+    '''
+    Compute the inundation mask for one window of the DEM in a worker process.
+    The window is read with a margin of 'halo' pixels on each side (padded
+    with no data beyond the edges of the DEM), which is cropped from the
+    result.
+    '''
+
+    src = worker_dataset
+    col_start = window.col_off - halo
+    row_start = window.row_off - halo
+    col_end = window.col_off + window.width + halo
+    row_end = window.row_off + window.height + halo
+
+    # Read the part of the window with halo which is inside the DEM.
+    read_col_start, read_row_start = max(col_start, 0), max(row_start, 0)
+    read_col_end, read_row_end = min(col_end, src.width), min(row_end, src.height)
+    dem = src.read(1, window = Window(read_col_start, read_row_start,
+                read_col_end - read_col_start, read_row_end - read_row_start),
+                masked = True).astype('float32').filled(np.nan)
+    dem = np.pad(dem, [(read_row_start - row_start, row_end - read_row_end),
+                       (read_col_start - col_start, col_end - read_col_end)],
+                 constant_values = np.nan)
+
+    mask = compute_inundation(dem, method, threshold, window_size = window_size)
+
+    return mask[halo : halo + window.height, halo : halo + window.width]
+
+def estimate_inundation(path_dem, path_out, method = 'hand', threshold = 1.0, drainage_radius = 500.0, block_size = 2048, max_workers = 4):
+    '''
+    Write the inundation mask of a DEM (any raster rasterio can read, such as
+    the virtual mosaic of the 3DEP tiles) to a tiled, compressed GeoTIFF,
+    processing blocks of 'block_size' pixels in up to 'max_workers'
+    processes.
+    '''
+
+    with rasterio.open(path_dem) as src:
+        profile = src.profile.copy()
+        res = src.res[0]
+
+    if method == 'hand':
+        halo = int(np.ceil(drainage_radius / res))
+        window_size = 2 * halo + 1
+    else:
+        halo = 0
+        window_size = None
+
+    profile.update(driver = 'GTiff', dtype = 'uint8', count = 1, nodata = mask_nodata,
+            tiled = True, blockxsize = 512, blockysize = 512, compress = 'deflate',
+            bigtiff = 'IF_SAFER')
+    block_size = max(512, block_size - block_size % 512)
+    blocks = define_blocks(profile['width'], profile['height'], block_size)
+    print('Estimating inundation ({:}, threshold {:} m) for {:d} x {:d} pixels in {:d} blocks with a halo of {:d} pixels.'.format(
+            method, threshold, profile['width'], profile['height'], len(blocks), halo))
+
+    # Write to a temporary file first so that a partial mask is never
+    # mistaken for a complete one.
+    part_path = '{:}.part'.format(path_out)
+    with rasterio.open(part_path, 'w', **profile) as dst:
+
+        # Only a few blocks are processed ahead of the one being written, so
+        # memory use does not grow with the size of the DEM.
+        n_ahead = 2 * max_workers
+        with ProcessPoolExecutor(max_workers = max_workers, initializer = init_worker,
+                initargs = (path_dem,)) as executor:
+
+            futures = deque()
+            for i, window in enumerate(blocks):
+
+                futures.append((window, executor.submit(process_block, window, halo,
+                                    method, threshold, window_size)))
+                if len(futures) >= n_ahead:
+                    window, future = futures.popleft()
+                    dst.write(future.result(), 1, window = window)
+
+                if (i + 1) % 100 == 0:
+                    print('Processed block {:>6d} of {:>6d}'.format(i + 1, len(blocks)))
+
+            while futures:
+                window, future = futures.popleft()
+                dst.write(future.result(), 1, window = window)
+
+    os.replace(part_path, path_out)
+    print('Wrote inundation mask to {:}'.format(path_out))
+
+    return path_out
+
+def make_synthetic_dem(path_dem, size = 4096, res = 1.0, seed = 0):
+    '''
+    Write a synthetic DEM (gentle hills crossed by a meandering valley, with
+    some no-data pixels) for testing and benchmarking.
+    '''
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype('float32') * res
+    length = size * res
+    dem = (5.0 * np.sin(2.0 * np.pi * x / (0.7 * length)) * np.cos(2.0 * np.pi * y / (0.5 * length))
+            + 0.002 * x + 10.0)
+    valley_x = 0.5 * length + 0.1 * length * np.sin(2.0 * np.pi * y / (0.4 * length))
+    dem = dem - 6.0 * np.exp(-((x - valley_x) / (0.02 * length)) ** 2)
+    dem = (dem + rng.normal(0.0, 0.05, dem.shape)).astype('float32')
+    nodata = -999999.0
+    dem[: size // 50, : size // 50] = nodata
+
+    profile = {'driver' : 'GTiff', 'width' : size, 'height' : size, 'count' : 1,
+               'dtype' : 'float32', 'crs' : 'EPSG:26917', 'nodata' : nodata,
+               'transform' : rasterio.transform.from_origin(390000.0, 2990000.0, res, res),
+               'tiled' : True, 'blockxsize' : 256, 'blockysize' : 256}
+    with rasterio.open(path_dem, 'w', **profile) as dst:
+        dst.write(dem, 1)
+
+    return path_dem
+
+def run_benchmark(size = 4096, block_size = 1024, max_workers = 4, drainage_radius = 100.0):
+    '''
+    Time both methods on a synthetic DEM, and check that the block-wise
+    result is the same as processing the whole DEM at once.
+    '''
+
+    with tempfile.TemporaryDirectory() as dir_tmp:
+
+        path_dem = make_synthetic_dem(os.path.join(dir_tmp, 'dem.tif'), size = size)
+        with rasterio.open(path_dem) as src:
+            dem = src.read(1, masked = True).astype('float32').filled(np.nan)
+
+        for method, threshold in [('water_level', 8.0), ('hand', 1.0)]:
+
+            path_out = os.path.join(dir_tmp, 'mask_{:}.tif'.format(method))
+            time_start = time.time()
+            estimate_inundation(path_dem, path_out, method = method, threshold = threshold,
+                    drainage_radius = drainage_radius, block_size = block_size,
+                    max_workers = max_workers)
+            duration = time.time() - time_start
+
+            with rasterio.open(path_out) as src:
+                mask = src.read(1)
+            window_size = 2 * int(np.ceil(drainage_radius)) + 1
+            mask_whole = compute_inundation(dem, method, threshold, window_size = window_size)
+
+            print('{:<12} {:7.2f} s, {:6.1f} Mpixel/s, {:5.1f}% inundated, matches whole-array result: {:}'.format(
+                    method, duration, size * size / duration / 1.0E6,
+                    100.0 * np.mean(mask == 1), bool(np.array_equal(mask, mask_whole))))
+
+    return
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Estimate a high-resolution inundation mask from 3DEP DEM tiles.")
+    parser.add_argument("--path_dem", default = None, help = "DEM to process (default: a virtual mosaic of the tiles in --dir_tiles).")
+    parser.add_argument("--dir_tiles", default = dir_tiles_default, help = "Folder containing the downloaded tiles.")
+    parser.add_argument("--path_out", default = None, help = "Path of the inundation mask (default: inundation_<method>.tif in the tile folder).")
+    parser.add_argument("--method", choices = ['water_level', 'hand'], default = 'hand', help = "Inundation method.")
+    parser.add_argument("--threshold", type = float, default = 1.0, help = "Water level, or height above drainage (m).")
+    parser.add_argument("--drainage_radius", type = float, default = 500.0, help = "Distance (m) searched for the drainage with the 'hand' method.")
+    parser.add_argument("--block_size", type = int, default = 2048, help = "Size (pixels) of the blocks processed by each worker.")
+    parser.add_argument("--max_workers", type = int, default = 4, help = "Number of worker processes.")
+    parser.add_argument("--benchmark", action = 'store_true', help = "Time the methods on a synthetic DEM instead.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(block_size = min(args.block_size, 1024), max_workers = args.max_workers)
+        return
+
+    path_dem = args.path_dem
+    if path_dem is None:
+        path_dem = os.path.join(args.dir_tiles, '3DEP_tiles.vrt')
+        write_vrt(find_tile_files(args.dir_tiles), path_dem)
+
+    path_out = args.path_out
+    if path_out is None:
+        path_out = os.path.join(os.path.dirname(path_dem),
+                        'inundation_{:}.tif'.format(args.method))
+
+    estimate_inundation(path_dem, path_out, method = args.method, threshold = args.threshold,
+            drainage_radius = args.drainage_radius, block_size = args.block_size,
+            max_workers = args.max_workers)
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,374 @@
+'''
+A scheduler for the requests of the download scripts
+(download_US_census_data.py, download_3DEP_data.py and
+download_MCDWD_flood_data.py), which retries transient failures without
+making a busy server busier.
+
+Each request is run through FetchScheduler.call(), which
+    * limits the number of requests to each host at the same time
+      ('max_per_host'), and, if 'requests_per_second' is given, their rate,
+      with a token bucket per host which allows that many on average,
+    * retries transient failures (HTTP 429 and 5xx, timeouts and dropped
+      connections) up to 'max_retries' times, waiting with exponential
+      back-off and random jitter so that retries from many threads do not
+      all arrive at the same time,
+    * honours the Retry-After header: a 429 or 503 response pauses all
+      requests to that host for the time given, and halves the rate for
+      that host, which then recovers gradually as requests succeed,
+    * records jobs which still fail in a FailedJobQueue (an SQLite
+      database), so the next run can retry them first, and removes them once
+      they succeed.
+Each retry is recorded as a telemetry event (see download_telemetry.py).
+API keys are removed from the errors which are printed, recorded or stored
+(see redact_secrets() in download_telemetry.py).
+
+The retries can be tried out with the flaky census API stand-in, e.g.
+
+python -m hrmd_ma_misc.benchmark_US_census_data --error_rate 0.1
+'''
+# Imports: Standard library.
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Imports: Third party.
+import requests
+import urllib3
+
+# Imports: Local.
+from .download_telemetry import record_event, redact_secrets
+
+# HTTP status codes which are worth retrying.
+retry_statuses = [429, 500, 502, 503, 504]
+
+# Status codes which mean that the server is overloaded, so requests to the
+# host are slowed down.
+overload_statuses = [429, 503]
+
+class TokenBucket:
+    '''
+    A token bucket shared by several threads, which allows 'requests_per_second'
+    on average, with bursts of up to 'burst' requests. The rate can be lowered
+    (slow_down()) when the server is overloaded, and recovers gradually
+    (speed_up()) up to the original rate.
+    If 'requests_per_second' is None, the rate is not limited, and requests
+    only wait while the bucket is paused (see pause()).
+    '''
+
+    def __init__(self, requests_per_second, burst = 1, min_rate = 0.1):
+
+        self.max_rate = requests_per_second
+        if requests_per_second is not None:
+            min_rate = min(min_rate, requests_per_second)
+        self.min_rate = min_rate
+        self.rate = requests_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.time_last = time.monotonic()
+        self.time_resume = 0.0
+        self.lock = threading.Lock()
+
+        return
+
+    def acquire(self):
+        '''
+        Wait until a request may be sent.
+        '''
+
+        while True:
+
+            with self.lock:
+
+                now = time.monotonic()
+                if self.rate is None:
+                    if now >= self.time_resume:
+                        return
+                    delay = self.time_resume - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.time_last) * self.rate)
+                    self.time_last = now
+                    if (now >= self.time_resume) and (self.tokens >= 1.0):
+                        self.tokens = self.tokens - 1.0
+                        return
+                    delay = max(self.time_resume - now, (1.0 - self.tokens) / self.rate)
+
+            time.sleep(delay)
+
+    def pause(self, delay):
+        '''
+        Send no requests for 'delay' seconds.
+        '''
+
+        with self.lock:
+            self.time_resume = max(self.time_resume, time.monotonic() + delay)
+
+        return
+
+    def slow_down(self):
+
+        with self.lock:
+            if self.rate is not None:
+                self.rate = max(self.rate / 2.0, self.min_rate)
+
+        return
+
+    def speed_up(self):
+
+        with self.lock:
+            if self.rate is not None:
+                self.rate = min(self.rate + self.max_rate / 10.0, self.max_rate)
+
+        return
+
+class FailedJobQueue:
+    '''
+    A durable list of jobs which failed after all retries, kept in an SQLite
+    database. Each job has a unique key (e.g. its output path) and is stored
+    as a JSON object, so a later run can send it again. Several scripts can
+    share one database, as each job is labelled with its 'source'.
+    '''
+
+    def __init__(self, path_db, source):
+
+        self.path_db = path_db
+        self.source = source
+        dir_db = os.path.dirname(path_db)
+        if dir_db:
+            os.makedirs(dir_db, exist_ok = True)
+
+        # The queue is shared between worker threads, so access is
+        # serialised.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path_db, check_same_thread = False)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS failed_jobs (
+                    source     TEXT,
+                    key        TEXT,
+                    job        TEXT,
+                    error      TEXT,
+                    n_failures INTEGER,
+                    failed     REAL,
+                    PRIMARY KEY (source, key)
+                )''')
+
+        return
+
+    def add(self, key, job, error):
+        '''
+        Record a job which failed, counting how many runs it has failed in.
+        '''
+
+        with self.lock, self.connection:
+            self.connection.execute('''
+                INSERT INTO failed_jobs (source, key, job, error, n_failures, failed)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (source, key) DO UPDATE SET
+                    job = excluded.job, error = excluded.error,
+                    n_failures = n_failures + 1, failed = excluded.failed''',
+                (self.source, key, json.dumps(job), error, time.time()))
+
+        return
+
+    def remove(self, key):
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM failed_jobs WHERE source = ? AND key = ?',
+                    (self.source, key))
+
+        return
+
+    def list(self):
+        '''
+        Get the failed jobs, oldest first, as (key, job) tuples.
+        '''
+
+        with self.lock:
+            rows = self.connection.execute('''
+                SELECT key, job FROM failed_jobs WHERE source = ?
+                ORDER BY failed''', (self.source,)).fetchall()
+
+        return [(key, json.loads(job)) for key, job in rows]
+
+    def close(self):
+
+        self.connection.close()
+
+        return
+
+def get_status_code(exception):
+    '''
+    Get the HTTP status code of a failed request, or None if there was no
+    response. GDAL (used by rasterio for /vsicurl/ reads) only reports it in
+    the error message.
+    '''
+
+    if isinstance(exception, requests.HTTPError) and (exception.response is not None):
+        return exception.response.status_code
+
+    match = re.search(r'HTTP response code: (\d+)', str(exception))
+    if match is not None:
+        return int(match.group(1))
+
+    return None
+
+def is_transient_error(exception):
+    '''
+    Check whether a request which raised 'exception' may succeed if it is sent
+    again.
+    '''
+
+    status_code = get_status_code(exception)
+    if status_code is not None:
+        return status_code in retry_statuses
+
+    # Connection errors, timeouts, and connections dropped while streaming
+    # (which urllib3 raises directly when reading from response.raw).
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError,
+                        urllib3.exceptions.HTTPError))
+
+def get_retry_after(exception):
+    '''
+    Get the number of seconds to wait given by the Retry-After header of a
+    failed request (either a number of seconds or an HTTP date), or None.
+    '''
+
+    response = getattr(exception, 'response', None)
+    if response is None:
+        return None
+
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+
+    try:
+        date_retry = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max((date_retry - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+class FetchScheduler:
+    '''
+    Send requests with per-host limits and retries (see the module
+    docstring). One scheduler is shared by all worker threads of a script.
+    '''
+
+    def __init__(self, max_per_host = 4, requests_per_second = None, max_retries = 5, backoff_base = 1.0, backoff_max = 60.0, max_retry_after = 300.0, failed_jobs = None):
+        '''
+        'max_per_host'          Maximum number of requests to one host at the
+                                same time.
+        'requests_per_second'   Maximum average rate of requests to one host,
+                                or None (the default) for no limit.
+        'max_retries'           Number of times a transient failure is retried.
+        'backoff_base'          Wait (s) before the first retry, which doubles
+                                for each following retry...
+        'backoff_max'           ...up to this value.
+        'max_retry_after'       Longest wait (s) accepted from Retry-After.
+        'failed_jobs'           (Optional) a FailedJobQueue.
+        '''
+
+        self.max_per_host = max_per_host
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.failed_jobs = failed_jobs
+
+        self.semaphores = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.n_retries = 0
+
+        return
+
+    def get_host_limits(self, url):
+        '''
+        Get the semaphore and the token bucket for the host of a URL.
+        '''
+
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                self.buckets[host] = TokenBucket(self.requests_per_second,
+                                        burst = self.max_per_host)
+
+        return self.semaphores[host], self.buckets[host]
+
+    def define_backoff(self, n_retries):
+        '''
+        Get the wait (s) before retry number 'n_retries' + 1: between half and
+        all of an exponentially increasing delay.
+        '''
+
+        delay = min(self.backoff_base * 2 ** n_retries, self.backoff_max)
+
+        return delay / 2.0 + random.uniform(0.0, delay / 2.0)
+
+    def call(self, url, function, *args, job_key = None, job = None, **kwargs):
+        '''
+        Run function(*args, **kwargs), which sends a request to 'url', and
+        return its result, retrying transient failures.
+        If 'job_key' is given, a job which still fails is recorded in the
+        FailedJobQueue as 'job' (a JSON-serialisable description of it) before
+        the exception is raised, and a job which succeeds is removed from it.
+        '''
+
+        semaphore, bucket = self.get_host_limits(url)
+        n_retries = 0
+        while True:
+
+            error = None
+            with semaphore:
+                bucket.acquire()
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as exception:
+                    error = exception
+
+            if error is None:
+                bucket.speed_up()
+                if (self.failed_jobs is not None) and (job_key is not None):
+                    self.failed_jobs.remove(job_key)
+                return result
+
+            # The error message can contain the request URL with its API key.
+            error_message = redact_secrets(repr(error))
+            if (not is_transient_error(error)) or (n_retries >= self.max_retries):
+                if (self.failed_jobs is not None) and (job_key is not None):
+                    self.failed_jobs.add(job_key, job, error_message)
+                raise error
+
+            # Wait before retrying. If the server says it is overloaded, slow
+            # down all requests to it, not just this one.
+            delay = self.define_backoff(n_retries)
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_retry_after))
+            if get_status_code(error) in overload_statuses:
+                bucket.slow_down()
+                if retry_after is not None:
+                    bucket.pause(delay)
+
+            n_retries = n_retries + 1
+            with self.lock:
+                self.n_retries = self.n_retries + 1
+            record_event('retry', url = url, item = job_key, retries = n_retries,
+                    delay_s = delay, status = get_status_code(error), error = error_message)
+            print('Retrying in {:.1f} s ({:d} of {:d}): {:}'.format(delay, n_retries,
+                    self.max_retries, redact_secrets(str(error))))
+            time.sleep(delay)
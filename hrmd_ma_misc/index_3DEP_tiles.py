@@ -0,0 +1,336 @@
+'''
+Find the USGS 3DEP 1 m DEM tiles which cover an area, used by
+download_3DEP_data.py.
+
+The 1 m DEM is split into 10 km x 10 km tiles on the UTM grid, named by the
+upper-left corner of the tile in units of 10 km, e.g. tile x39y299 in UTM zone
+17 covers eastings 390000 to 400000 m and northings 2980000 to 2990000 m.
+An area (a lon/lat bounding box or a GeoJSON polygon) is projected to UTM and
+tested against each tile in its bounding box, so only tiles which actually
+intersect it are selected. Tiles are then checked against a cached listing of
+the files in the project, so tiles with no data are not requested.
+
+Usage:
+
+python -m hrmd_ma_misc.index_3DEP_tiles -82.2 26.9 -82.0 27.1
+python -m hrmd_ma_misc.index_3DEP_tiles area.geojson
+'''
+# Imports: Standard library.
+import argparse
+import json
+import math
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+# Imports: Third party.
+import requests
+
+# Define global variables.
+tile_size = 10000.0
+bucket_url = "https://prd-tnm.s3.amazonaws.com/"
+project_prefix = "StagedProducts/Elevation/1m/Projects/FL_Peninsular_FDEM_2018_D19_DRRA/TIFF/"
+utm_zone = 17
+
+def lonlat_to_utm(lon, lat, zone):
+    '''
+    Convert longitude and latitude (degrees, on the GRS80/WGS84 ellipsoid, as
+    used by NAD83) to UTM easting and northing (m) in the given zone, using
+    the series expansion of the transverse Mercator projection in Snyder
+    (1987), "Map Projections: A Working Manual", p. 61. The error is well
+    under 1 m within a UTM zone.
+    '''
+
+    a = 6378137.0
+    f = 1.0 / 298.257222101
+    k0 = 0.9996
+    e2 = f * (2.0 - f)
+    ep2 = e2 / (1.0 - e2)
+
+    lon0 = math.radians(-183.0 + 6.0 * zone)
+    phi = math.radians(lat)
+    lam = math.radians(lon) - lon0
+
+    sin_phi = math.sin(phi)
+    cos_phi = math.cos(phi)
+    tan_phi = math.tan(phi)
+
+    N = a / math.sqrt(1.0 - e2 * sin_phi ** 2)
+    T = tan_phi ** 2
+    C = ep2 * cos_phi ** 2
+    A = lam * cos_phi
+
+    e4 = e2 * e2
+    e6 = e4 * e2
+    M = a * ((1.0 - e2 / 4.0 - 3.0 * e4 / 64.0 - 5.0 * e6 / 256.0) * phi
+            - (3.0 * e2 / 8.0 + 3.0 * e4 / 32.0 + 45.0 * e6 / 1024.0) * math.sin(2.0 * phi)
+            + (15.0 * e4 / 256.0 + 45.0 * e6 / 1024.0) * math.sin(4.0 * phi)
+            - (35.0 * e6 / 3072.0) * math.sin(6.0 * phi))
+
+    easting = 500000.0 + k0 * N * (A + (1.0 - T + C) * A ** 3 / 6.0
+                + (5.0 - 18.0 * T + T ** 2 + 72.0 * C - 58.0 * ep2) * A ** 5 / 120.0)
+    northing = k0 * (M + N * tan_phi * (A ** 2 / 2.0
+                + (5.0 - T + 9.0 * C + 4.0 * C ** 2) * A ** 4 / 24.0
+                + (61.0 - 58.0 * T + T ** 2 + 600.0 * C - 330.0 * ep2) * A ** 6 / 720.0))
+
+    # Southern hemisphere.
+    if lat < 0.0:
+        northing = northing + 10000000.0
+
+    return easting, northing
+
+def get_tile_bounds(x_tile, y_tile):
+    '''
+    Get the UTM bounds (easting_min, northing_min, easting_max, northing_max)
+    of a tile.
+    '''
+
+    bounds = (x_tile * tile_size, (y_tile - 1) * tile_size,
+              (x_tile + 1) * tile_size, y_tile * tile_size)
+
+    return bounds
+
+def densify_ring(ring, max_step_deg = 0.01):
+    '''
+    Add points along the edges of a lon/lat ring, so that its shape is kept
+    when it is projected (straight lines in lon/lat are curved in UTM).
+    '''
+
+    dense_ring = []
+    for (lon0, lat0), (lon1, lat1) in zip(ring[:-1], ring[1:]):
+
+        n_steps = max(1, int(math.ceil(max(abs(lon1 - lon0), abs(lat1 - lat0)) / max_step_deg)))
+        for i in range(n_steps):
+
+            t = i / n_steps
+            dense_ring.append((lon0 + t * (lon1 - lon0), lat0 + t * (lat1 - lat0)))
+
+    dense_ring.append(tuple(ring[-1]))
+
+    return dense_ring
+
+def point_in_ring(x, y, ring):
+    '''
+    Test whether a point is inside a ring (a closed list of (x, y) points),
+    by counting crossings of a ray from the point.
+    '''
+
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+
+        if (y0 > y) != (y1 > y):
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            if x < x_cross:
+                inside = not inside
+
+    return inside
+
+def segments_intersect(p0, p1, q0, q1):
+    '''
+    Test whether the line segments p0-p1 and q0-q1 intersect.
+    '''
+
+    def orientation(a, b, c):
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (value > 0.0) - (value < 0.0)
+
+    def on_segment(a, b, c):
+        return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and
+                min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+    o1 = orientation(p0, p1, q0)
+    o2 = orientation(p0, p1, q1)
+    o3 = orientation(q0, q1, p0)
+    o4 = orientation(q0, q1, p1)
+
+    if (o1 != o2) and (o3 != o4):
+        return True
+
+    return ((o1 == 0 and on_segment(p0, p1, q0)) or (o2 == 0 and on_segment(p0, p1, q1)) or
+            (o3 == 0 and on_segment(q0, q1, p0)) or (o4 == 0 and on_segment(q0, q1, p1)))
+
+def ring_intersects_box(ring, bounds):
+    '''
+    Test whether the area inside a ring intersects a rectangle.
+    '''
+
+    x_min, y_min, x_max, y_max = bounds
+
+    # A vertex of the ring is inside the rectangle.
+    for x, y in ring:
+        if (x_min <= x <= x_max) and (y_min <= y <= y_max):
+            return True
+
+    # The rectangle is inside the ring.
+    if point_in_ring(x_min, y_min, ring):
+        return True
+
+    # An edge of the ring crosses an edge of the rectangle.
+    corners = [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max), (x_min, y_min)]
+    for p0, p1 in zip(ring[:-1], ring[1:]):
+        for q0, q1 in zip(corners[:-1], corners[1:]):
+            if segments_intersect(p0, p1, q0, q1):
+                return True
+
+    return False
+
+def read_geojson_rings(path_geojson):
+    '''
+    Get the outer rings of all polygons in a GeoJSON file (a FeatureCollection,
+    Feature, Polygon or MultiPolygon), as lists of (lon, lat) points.
+    Holes are ignored, so a tile which is entirely inside a hole is still
+    selected.
+    '''
+
+    with open(path_geojson, 'r') as file:
+        geojson = json.load(file)
+
+    if geojson['type'] == 'FeatureCollection':
+        geometries = [feature['geometry'] for feature in geojson['features']]
+    elif geojson['type'] == 'Feature':
+        geometries = [geojson['geometry']]
+    else:
+        geometries = [geojson]
+
+    rings = []
+    for geometry in geometries:
+
+        if geometry['type'] == 'Polygon':
+            rings.append(geometry['coordinates'][0])
+        elif geometry['type'] == 'MultiPolygon':
+            rings.extend([polygon[0] for polygon in geometry['coordinates']])
+        else:
+            raise ValueError('Geometry type "{:}" not implemented or wrong'.format(geometry['type']))
+
+    rings = [[tuple(point[:2]) for point in ring] for ring in rings]
+
+    return rings
+
+def bbox_to_ring(lon_min, lat_min, lon_max, lat_max):
+
+    ring = [(lon_min, lat_min), (lon_max, lat_min), (lon_max, lat_max),
+            (lon_min, lat_max), (lon_min, lat_min)]
+
+    return ring
+
+def get_utm_bounds(rings, zone = utm_zone):
+    '''
+    Get the UTM bounds (easting_min, northing_min, easting_max, northing_max)
+    of a list of lon/lat rings.
+    '''
+
+    utm_points = [lonlat_to_utm(lon, lat, zone) for ring in rings for
+                    lon, lat in densify_ring(ring)]
+    eastings = [easting for easting, _ in utm_points]
+    northings = [northing for _, northing in utm_points]
+    bounds = (min(eastings), min(northings), max(eastings), max(northings))
+
+    return bounds
+
+def find_intersecting_tiles(rings, zone = utm_zone):
+    '''
+    Find the (x, y) indices of all tiles which intersect any of the lon/lat
+    rings, sorted by x then y.
+    '''
+
+    tiles = set()
+    for ring in rings:
+
+        utm_ring = [lonlat_to_utm(lon, lat, zone) for lon, lat in densify_ring(ring)]
+        eastings = [easting for easting, _ in utm_ring]
+        northings = [northing for _, northing in utm_ring]
+
+        # Candidate tiles are those in the bounding box of the ring.
+        x_tile_min = int(math.floor(min(eastings) / tile_size))
+        x_tile_max = int(math.floor(max(eastings) / tile_size))
+        y_tile_min = int(math.ceil(min(northings) / tile_size))
+        y_tile_max = int(math.ceil(max(northings) / tile_size))
+        for x_tile in range(x_tile_min, x_tile_max + 1):
+            for y_tile in range(y_tile_min, y_tile_max + 1):
+
+                if (x_tile, y_tile) in tiles:
+                    continue
+
+                if ring_intersects_box(utm_ring, get_tile_bounds(x_tile, y_tile)):
+                    tiles.add((x_tile, y_tile))
+
+    return sorted(tiles)
+
+def list_project_tiles(path_cache, max_age = 7 * 24 * 3600, session = None):
+    '''
+    Get the tiles which exist in the project, as a dictionary mapping (x, y)
+    to the file size in bytes. The listing comes from the S3 bucket
+    (paginated, 1000 files per request) and is cached in a JSON file for
+    'max_age' seconds.
+    '''
+
+    if os.path.exists(path_cache) and (time.time() - os.path.getmtime(path_cache) < max_age):
+
+        with open(path_cache, 'r') as file:
+            listing = json.load(file)
+
+    else:
+
+        if session is None:
+            session = requests.Session()
+
+        print('Listing files in {:}{:}'.format(bucket_url, project_prefix))
+        namespace = {'s3' : 'http://s3.amazonaws.com/doc/2006-03-01/'}
+        listing = {}
+        params = {'list-type' : '2', 'prefix' : project_prefix}
+        while True:
+
+            response = session.get(bucket_url, params = params, timeout = 60)
+            response.raise_for_status()
+            root = ET.fromstring(response.content)
+            for item in root.findall('s3:Contents', namespace):
+
+                listing[item.find('s3:Key', namespace).text] = int(
+                        item.find('s3:Size', namespace).text)
+
+            token = root.find('s3:NextContinuationToken', namespace)
+            if token is None:
+                break
+            params['continuation-token'] = token.text
+
+        os.makedirs(os.path.dirname(os.path.abspath(path_cache)), exist_ok = True)
+        with open(path_cache, 'w') as file:
+            json.dump(listing, file)
+
+    project_tiles = {}
+    for key, size in listing.items():
+
+        match = re.search(r'_x(\d+)y(\d+)_.*\.tif$', key)
+        if match:
+            project_tiles[(int(match.group(1)), int(match.group(2)))] = size
+
+    return project_tiles
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "List the 3DEP 1 m DEM tiles which intersect an area.")
+    parser.add_argument("area", nargs = '+', help = "A GeoJSON file, or a bounding box: lon_min lat_min lon_max lat_max.")
+    parser.add_argument("--path_cache", default = os.path.join('output_3DEP_tiles', 'project_listing.json'), help = "Cache file for the project listing.")
+    args = parser.parse_args()
+
+    if len(args.area) == 4:
+        rings = [bbox_to_ring(*[float(value) for value in args.area])]
+    else:
+        rings = read_geojson_rings(args.area[0])
+
+    tiles = find_intersecting_tiles(rings)
+    project_tiles = list_project_tiles(args.path_cache)
+    for x_tile, y_tile in tiles:
+
+        if (x_tile, y_tile) in project_tiles:
+            print('x{:d}y{:d} {:.1f} MB'.format(x_tile, y_tile,
+                    project_tiles[(x_tile, y_tile)] / 1.0E6))
+        else:
+            print('x{:d}y{:d} (not in project)'.format(x_tile, y_tile))
+
+    return
+
+if __name__ == '__main__':
+
+    main()
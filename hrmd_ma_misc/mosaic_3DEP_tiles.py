@@ -0,0 +1,273 @@
+'''
+Merge the USGS 3DEP DEM tiles downloaded by download_3DEP_data.py into a
+single raster with overviews.
+
+A virtual mosaic (a GDAL VRT file, which only references the tiles) is written
+first. The merged raster is then filled block by block: worker processes read
+windows of the mosaic, and the main process writes them to a tiled,
+compressed GeoTIFF, so memory use depends on the block size and number of
+workers, not on the size of the area. Finally overviews (reduced-resolution
+copies) are added, so the merged raster displays quickly at any zoom.
+
+Usage:
+
+python -m hrmd_ma_misc.mosaic_3DEP_tiles
+python -m hrmd_ma_misc.mosaic_3DEP_tiles --dir_tiles output_3DEP_tiles --max_workers 4
+'''
+# Imports: Standard library.
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import xml.etree.ElementTree as ET
+
+# Imports: Third party.
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+# Define global variables.
+dir_tiles_default = 'output_3DEP_tiles'
+tile_pattern_default = 'USGS_1M_*.tif'
+nodata_default = -999999.0
+
+# The dataset opened by each worker process (see init_worker()).
+worker_dataset = None
+
+def find_tile_files(dir_tiles, pattern = tile_pattern_default):
+    '''
+    Get the paths of the tiles in a folder, skipping incomplete downloads and
+    the outputs of this script.
+    '''
+
+    paths = sorted(glob.glob(os.path.join(dir_tiles, pattern)))
+    paths = [path for path in paths if not path.endswith(('.part', '_mosaic.tif'))]
+
+    return paths
+
+def write_vrt(paths_tiles, path_vrt):
+    '''
+    Write a virtual mosaic (VRT) of tiles which share the same CRS, pixel
+    size, data type and number of bands. The tile paths are stored relative
+    to the VRT file.
+    Returns the profile (width, height, transform etc.) of the mosaic.
+    '''
+
+    # Read the tile headers.
+    tiles = []
+    for path in paths_tiles:
+        with rasterio.open(path) as src:
+            tiles.append({'path' : path, 'bounds' : src.bounds, 'width' : src.width,
+                          'height' : src.height, 'res' : src.res, 'crs' : src.crs,
+                          'dtype' : src.dtypes[0], 'count' : src.count,
+                          'nodata' : src.nodata, 'block_shape' : src.block_shapes[0]})
+
+    if not tiles:
+        raise ValueError('No tiles to mosaic')
+
+    for key in ['res', 'crs', 'dtype', 'count']:
+        if len(set([str(tile[key]) for tile in tiles])) > 1:
+            raise ValueError('Tiles have different values of "{:}", cannot mosaic'.format(key))
+
+    x_res, y_res = tiles[0]['res']
+    left = min([tile['bounds'].left for tile in tiles])
+    top = max([tile['bounds'].top for tile in tiles])
+    right = max([tile['bounds'].right for tile in tiles])
+    bottom = min([tile['bounds'].bottom for tile in tiles])
+    width = int(round((right - left) / x_res))
+    height = int(round((top - bottom) / y_res))
+    nodata = tiles[0]['nodata'] if tiles[0]['nodata'] is not None else nodata_default
+
+    # GDAL names for numpy data types.
+    gdal_dtypes = {'uint8' : 'Byte', 'int16' : 'Int16', 'uint16' : 'UInt16',
+                   'int32' : 'Int32', 'uint32' : 'UInt32', 'float32' : 'Float32',
+                   'float64' : 'Float64'}
+    dtype = tiles[0]['dtype']
+
+    vrt = ET.Element('VRTDataset', rasterXSize = str(width), rasterYSize = str(height))
+    ET.SubElement(vrt, 'SRS').text = tiles[0]['crs'].to_wkt()
+    ET.SubElement(vrt, 'GeoTransform').text = ', '.join([repr(value) for value in
+                    [left, x_res, 0.0, top, 0.0, -y_res]])
+
+    dir_vrt = os.path.dirname(os.path.abspath(path_vrt))
+    for band in range(1, tiles[0]['count'] + 1):
+
+        vrt_band = ET.SubElement(vrt, 'VRTRasterBand', dataType = gdal_dtypes[dtype],
+                        band = str(band))
+        ET.SubElement(vrt_band, 'NoDataValue').text = repr(nodata)
+        for tile in tiles:
+
+            # Sources are drawn in order, and the tiles overlap slightly, so
+            # use their nodata value to avoid drawing over valid pixels.
+            source = ET.SubElement(vrt_band, 'ComplexSource')
+            ET.SubElement(source, 'SourceFilename', relativeToVRT = '1').text = \
+                    os.path.relpath(os.path.abspath(tile['path']), dir_vrt)
+            ET.SubElement(source, 'SourceBand').text = str(band)
+            ET.SubElement(source, 'SourceProperties',
+                    RasterXSize = str(tile['width']), RasterYSize = str(tile['height']),
+                    DataType = gdal_dtypes[dtype],
+                    BlockXSize = str(tile['block_shape'][1]),
+                    BlockYSize = str(tile['block_shape'][0]))
+            ET.SubElement(source, 'SrcRect', xOff = '0', yOff = '0',
+                    xSize = str(tile['width']), ySize = str(tile['height']))
+            ET.SubElement(source, 'DstRect',
+                    xOff = str(int(round((tile['bounds'].left - left) / x_res))),
+                    yOff = str(int(round((top - tile['bounds'].top) / y_res))),
+                    xSize = str(tile['width']), ySize = str(tile['height']))
+            if tile['nodata'] is not None:
+                ET.SubElement(source, 'NODATA').text = repr(tile['nodata'])
+
+    ET.ElementTree(vrt).write(path_vrt)
+
+    profile = {'width' : width, 'height' : height, 'count' : tiles[0]['count'],
+               'dtype' : dtype, 'crs' : tiles[0]['crs'], 'nodata' : nodata,
+               'transform' : rasterio.transform.from_origin(left, top, x_res, y_res)}
+
+    return profile
+
+def define_blocks(width, height, block_size):
+    '''
+    Split a raster into square windows of 'block_size' pixels (smaller at the
+    right and bottom edges).
+    '''
+
+    blocks = [Window(col_off, row_off, min(block_size, width - col_off),
+                     min(block_size, height - row_off))
+              for row_off in range(0, height, block_size)
+              for col_off in range(0, width, block_size)]
+
+    return blocks
+
+def init_worker(path_vrt):
+    '''
+    Open the mosaic once in each worker process.
+    '''
+
+    global worker_dataset
+    worker_dataset = rasterio.open(path_vrt)
+
+    return
+
+def read_block(window):
+    '''
+    Read a window of the mosaic in a worker process. Returns None if the
+    window contains only nodata, so it does not need to be written.
+    '''
+
+    data = worker_dataset.read(window = window)
+    if np.all(data == worker_dataset.nodata):
+        return None
+
+    return data
+
+def define_overview_factors(width, height, min_size = 256):
+    '''
+    Get the overview decimation factors (2, 4, 8, ...) down to an overview
+    which is about 'min_size' pixels across.
+    '''
+
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= min_size:
+
+        factors.append(factor)
+        factor = factor * 2
+
+    return factors
+
+def build_mosaic(dir_tiles = dir_tiles_default, path_out = None, pattern = tile_pattern_default, block_size = 2048, max_workers = 4, overwrite = False):
+    '''
+    Merge the tiles in a folder into a tiled, compressed GeoTIFF with
+    overviews, reading blocks of 'block_size' pixels in up to 'max_workers'
+    processes. The mosaic is not rebuilt if it is newer than all of the
+    tiles, unless 'overwrite' is set.
+    Returns the path of the merged raster.
+    '''
+
+    if path_out is None:
+        path_out = os.path.join(dir_tiles, '3DEP_mosaic.tif')
+
+    paths_tiles = find_tile_files(dir_tiles, pattern = pattern)
+    if os.path.exists(path_out) and not overwrite and paths_tiles:
+        if os.path.getmtime(path_out) >= max([os.path.getmtime(path) for path in paths_tiles]):
+            print('Mosaic {:} is up to date, skipping.'.format(path_out))
+            return path_out
+
+    # Write the virtual mosaic.
+    path_vrt = '{:}.vrt'.format(os.path.splitext(path_out)[0])
+    profile = write_vrt(paths_tiles, path_vrt)
+    print('Wrote virtual mosaic of {:d} tiles to {:} ({:d} x {:d} pixels).'.format(
+            len(paths_tiles), path_vrt, profile['width'], profile['height']))
+
+    # Blocks of the output are multiples of its internal tiles.
+    profile.update(driver = 'GTiff', tiled = True, blockxsize = 512, blockysize = 512,
+            compress = 'deflate', predictor = 3 if np.dtype(profile['dtype']).kind == 'f' else 2,
+            bigtiff = 'IF_SAFER', sparse_ok = True, num_threads = 'ALL_CPUS')
+    block_size = max(512, block_size - block_size % 512)
+    blocks = define_blocks(profile['width'], profile['height'], block_size)
+
+    # Write to a temporary file first so that a partial mosaic is never
+    # mistaken for a complete one.
+    part_path = '{:}.part'.format(path_out)
+    with rasterio.Env(GDAL_CACHEMAX = 512, COMPRESS_OVERVIEW = 'DEFLATE'):
+
+        with rasterio.open(part_path, 'w', **profile) as dst:
+
+            # Only a few blocks are read ahead of the one being written, so
+            # memory use does not grow with the size of the mosaic.
+            n_ahead = 2 * max_workers
+            with ProcessPoolExecutor(max_workers = max_workers, initializer = init_worker,
+                    initargs = (path_vrt,)) as executor:
+
+                def write_block(window, future):
+                    data = future.result()
+                    if data is not None:
+                        dst.write(data, window = window)
+
+                futures = deque()
+                for i, window in enumerate(blocks):
+
+                    futures.append((window, executor.submit(read_block, window)))
+                    if len(futures) >= n_ahead:
+                        write_block(*futures.popleft())
+
+                    if (i + 1) % 100 == 0:
+                        print('Read block {:>6d} of {:>6d}'.format(i + 1, len(blocks)))
+
+                while futures:
+                    write_block(*futures.popleft())
+
+        # Add the overviews.
+        factors = define_overview_factors(profile['width'], profile['height'])
+        print('Building overviews with factors {:}'.format(factors))
+        with rasterio.open(part_path, 'r+') as dst:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns = 'rio_overview', resampling = 'average')
+
+    os.replace(part_path, path_out)
+    print('Wrote mosaic to {:}'.format(path_out))
+
+    return path_out
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Merge downloaded 3DEP DEM tiles into one raster with overviews.")
+    parser.add_argument("--dir_tiles", default = dir_tiles_default, help = "Folder containing the tiles.")
+    parser.add_argument("--path_out", default = None, help = "Path of the merged raster (default: 3DEP_mosaic.tif in the tile folder).")
+    parser.add_argument("--pattern", default = tile_pattern_default, help = "File name pattern of the tiles.")
+    parser.add_argument("--block_size", type = int, default = 2048, help = "Size (pixels) of the blocks read by each worker.")
+    parser.add_argument("--max_workers", type = int, default = 4, help = "Number of worker processes.")
+    parser.add_argument("--overwrite", action = 'store_true', help = "Build the mosaic again even if it is up to date.")
+    args = parser.parse_args()
+
+    build_mosaic(dir_tiles = args.dir_tiles, path_out = args.path_out,
+            pattern = args.pattern, block_size = args.block_size,
+            max_workers = args.max_workers, overwrite = args.overwrite)
+
+    return
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,228 @@
+'''
+A local cache of HTTP API responses, used by download_US_census_data.py.
+
+Each response is stored in a file named by a hash of the normalised query
+(endpoint and parameters, excluding the API key), so the same query always
+maps to the same file, and changing any part of the query gives a new file.
+An SQLite index records the size and age of each entry, so old entries can be
+evicted by age ('ttl') and by total size ('max_bytes'). Hit and miss counts are
+kept for each run, and also accumulated in the index.
+'''
+# Imports: Standard library.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class ResponseCache:
+
+    def __init__(self, dir_cache, ttl = 30 * 24 * 3600, max_bytes = 2 * 1024 ** 3,
+            excluded_params = ('key',)):
+        '''
+        'dir_cache'         Directory to store the cache in (created if needed).
+        'ttl'               Age (in seconds) after which an entry is expired.
+        'max_bytes'         Maximum total size of the stored responses.
+        'excluded_params'   Names of query parameters which are ignored when
+                            building the key, such as the API key.
+        '''
+
+        self.dir_cache = dir_cache
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.excluded_params = set(excluded_params)
+
+        os.makedirs(dir_cache, exist_ok = True)
+        self.path_index = os.path.join(dir_cache, 'index.sqlite')
+
+        # The cache is shared between worker threads, so access to the index
+        # is serialised.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path_index, check_same_thread = False)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key      TEXT PRIMARY KEY,
+                    url      TEXT,
+                    size     INTEGER,
+                    created  REAL,
+                    accessed REAL
+                )''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS stats (
+                    name  TEXT PRIMARY KEY,
+                    value INTEGER
+                )''')
+
+        self.stats = {'hits' : 0, 'misses' : 0, 'expired' : 0, 'stores' : 0,
+                        'evictions' : 0}
+
+        return
+
+    def make_key(self, endpoint, params):
+        '''
+        Hash the normalised query. 'params' is a list of (name, value) tuples
+        (or a dictionary). Parameters are sorted by name, keeping the order of
+        repeated parameters (such as 'in'), and excluded parameters are removed.
+        '''
+
+        if isinstance(params, dict):
+            params = list(params.items())
+
+        params = [(name, str(value).strip()) for name, value in params
+                    if name not in self.excluded_params]
+        params = sorted(params, key = lambda param: param[0])
+        query = json.dumps([endpoint.rstrip('/'), params])
+
+        return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+
+        return os.path.join(self.dir_cache, key[:2], '{:}.json'.format(key))
+
+    def increment_stat(self, name):
+
+        self.stats[name] = self.stats[name] + 1
+        self.connection.execute('''
+            INSERT INTO stats (name, value) VALUES (?, 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1''', (name,))
+
+        return
+
+    def get(self, key):
+        '''
+        Return the stored response for a key, or None if it is missing or
+        expired.
+        '''
+
+        now = time.time()
+        with self.lock, self.connection:
+
+            row = self.connection.execute(
+                    'SELECT created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.increment_stat('misses')
+                return None
+
+            if now - row[0] > self.ttl:
+                self.delete(key)
+                self.increment_stat('expired')
+                self.increment_stat('misses')
+                return None
+
+            try:
+                with open(self.get_path(key), 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                # The file was removed or damaged outside of the cache.
+                self.delete(key)
+                self.increment_stat('misses')
+                return None
+
+            self.connection.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                    (now, key))
+            self.increment_stat('hits')
+
+        return data
+
+    def put(self, key, url, data):
+        '''
+        Store a response (any JSON-serialisable object), then evict old
+        entries if needed.
+        '''
+
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        # Write to a temporary file first so that a partial file is never
+        # mistaken for a complete response.
+        path_tmp = '{:}.{:d}.tmp'.format(path, threading.get_ident())
+        with open(path_tmp, 'w') as file:
+            json.dump(data, file)
+        os.replace(path_tmp, path)
+        size = os.path.getsize(path)
+
+        now = time.time()
+        with self.lock, self.connection:
+
+            self.connection.execute('''
+                INSERT OR REPLACE INTO entries (key, url, size, created, accessed)
+                VALUES (?, ?, ?, ?, ?)''', (key, url, size, now, now))
+            self.increment_stat('stores')
+            self.evict(now)
+
+        return
+
+    def delete(self, key):
+        '''
+        Remove an entry. The caller must hold the lock.
+        '''
+
+        self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+        return
+
+    def evict(self, now):
+        '''
+        Remove expired entries, then remove the least-recently used entries
+        until the total size is within the limit. The caller must hold the
+        lock.
+        '''
+
+        expired = self.connection.execute('SELECT key FROM entries WHERE created < ?',
+                    (now - self.ttl,)).fetchall()
+        for (key,) in expired:
+
+            self.delete(key)
+            self.increment_stat('evictions')
+
+        total_size = self.connection.execute(
+                        'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        entries = self.connection.execute(
+                    'SELECT key, size FROM entries ORDER BY accessed').fetchall()
+        for key, size in entries:
+
+            if total_size <= self.max_bytes:
+                break
+
+            self.delete(key)
+            self.increment_stat('evictions')
+            total_size = total_size - size
+
+        return
+
+    def get_summary(self):
+        '''
+        Describe the hit/miss counts for this run and for the lifetime of the
+        cache.
+        '''
+
+        with self.lock:
+            lifetime_stats = dict(self.connection.execute(
+                                'SELECT name, value FROM stats').fetchall())
+            n_entries, total_size = self.connection.execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+
+        lines = ['Response cache {:}: {:d} entries, {:.1f} MB'.format(
+                    self.dir_cache, n_entries, total_size / 1.0E6)]
+        for label, stats in [('this run', self.stats), ('lifetime', lifetime_stats)]:
+
+            lines.append('    {:<9} '.format(label + ':') + ', '.join(
+                ['{:} {:d}'.format(name, stats.get(name, 0)) for name in
+                    ['hits', 'misses', 'expired', 'stores', 'evictions']]))
+
+        return '\n'.join(lines)
+
+    def close(self):
+
+        self.connection.close()
+
+        return
@@ -0,0 +1,137 @@
+'''
+Shared fixtures for the tests: a local static file server which supports the
+HTTP features the download scripts rely on (range requests, ETag and
+Last-Modified, conditional requests).
+'''
+# Imports: Standard library.
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import threading
+
+# Imports: Third party.
+import pytest
+
+class StaticFileServer(ThreadingHTTPServer):
+    '''
+    Serve the files in 'dir_root', recording each request as a
+    (method, path, headers) tuple in 'requests'.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, dir_root):
+
+        self.dir_root = dir_root
+        self.requests = []
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), StaticFileHandler)
+
+        return
+
+    def get_url(self, file_name):
+
+        return 'http://127.0.0.1:{:d}/{:}'.format(self.server_address[1], file_name)
+
+    def count_requests(self, method = 'GET'):
+
+        with self.lock:
+            n_requests = len([request for request in self.requests if request[0] == method])
+
+        return n_requests
+
+class StaticFileHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+
+        return
+
+    def send_empty(self, status, headers = None):
+
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+        return
+
+    def respond(self, send_body):
+
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, dict(self.headers)))
+
+        path = os.path.join(server.dir_root, self.path.lstrip('/').split('?')[0])
+        if not os.path.isfile(path):
+            self.send_empty(404)
+            return
+
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        etag = '"{:x}-{:x}"'.format(int(mtime * 1000), size)
+        validators = {'ETag' : etag, 'Last-Modified' : formatdate(mtime, usegmt = True),
+                      'Accept-Ranges' : 'bytes'}
+        if self.headers.get('If-None-Match') == etag:
+            self.send_empty(304, validators)
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        # Only single ranges are supported, otherwise the whole file is sent.
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match is not None:
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= size:
+                self.send_empty(416, {'Content-Range' : 'bytes */{:d}'.format(size)})
+                return
+            status = 206
+
+        self.send_response(status)
+        for name, value in validators.items():
+            self.send_header(name, value)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {:d}-{:d}/{:d}'.format(start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if send_body:
+            with open(path, 'rb') as file:
+                file.seek(start)
+                self.wfile.write(file.read(end - start + 1))
+
+        return
+
+    def do_GET(self):
+
+        self.respond(True)
+
+        return
+
+    def do_HEAD(self):
+
+        self.respond(False)
+
+        return
+
+@pytest.fixture
+def file_server(tmp_path):
+    '''
+    A StaticFileServer for the folder 'served' in the test's temporary folder.
+    '''
+
+    dir_root = os.path.join(tmp_path, 'served')
+    os.makedirs(dir_root)
+    server = StaticFileServer(dir_root)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,83 @@
+'''
+Tests for benchmark_US_census_data.py.
+'''
+# Imports: Standard library.
+import json
+import resource
+from types import SimpleNamespace
+
+# Imports: Third party.
+import pytest
+import requests
+
+# Imports: Local.
+from hrmd_ma_misc import benchmark_US_census_data as benchmark
+from hrmd_ma_misc import download_US_census_data as census
+
+def test_get_peak_rss_MB(monkeypatch):
+
+    assert 1.0 < benchmark.get_peak_rss_MB() < 100000.0
+
+    # Linux reports KB, macOS bytes.
+    for platform, ru_maxrss in [('linux', 200 * 1024), ('darwin', 200 * 1024 ** 2)]:
+        monkeypatch.setattr(benchmark.sys, 'platform', platform)
+        monkeypatch.setattr(resource, 'getrusage', lambda who :
+                                SimpleNamespace(ru_maxrss = ru_maxrss))
+        assert benchmark.get_peak_rss_MB() == 200.0
+
+@pytest.fixture
+def stand_in(request):
+
+    server = benchmark.CensusAPIStandIn(**getattr(request, 'param', {}))
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.parametrize('stand_in', [{'n_counties' : 2, 'n_tracts' : 2,
+                            'n_block_groups' : 2, 'n_blocks' : 3}], indirect = True)
+def test_stand_in_responses(stand_in):
+
+    endpoint = stand_in.get_endpoint()
+    response = requests.get(endpoint, params = [('get', 'NAME,B01001_001E'),
+                    ('for', 'block:*'), ('in', 'state:12'), ('in', 'county:003'),
+                    ('in', 'tract:000200'), ('in', 'block group:*')])
+    rows = response.json()
+    assert rows[0] == ['NAME', 'B01001_001E', 'state', 'county', 'tract',
+                'block group', 'block']
+    assert [row[-2:] for row in rows[1:]] == [['1', '1000'], ['1', '1001'],
+                ['1', '1002'], ['2', '2000'], ['2', '2001'], ['2', '2002']]
+    assert rows[1][0] == 'block 1000, block group 1, tract 000200, county 003, state 12'
+
+    # The responses are deterministic.
+    assert requests.get(response.url).json() == rows
+
+    # Queries with no geographies get 'No Content', and bad queries an error.
+    assert requests.get(endpoint, params = [('get', 'NAME'), ('for', 'tract:*'),
+                ('in', 'state:12'), ('in', 'county:999')]).status_code == 204
+    assert requests.get(endpoint, params = [('get', 'NAME')]).status_code == 400
+
+@pytest.mark.parametrize('stand_in', [{'error_rate' : 1.0}], indirect = True)
+def test_stand_in_errors(stand_in):
+
+    response = requests.get(stand_in.get_endpoint(), params = [('get', 'NAME'),
+                    ('for', 'county:*'), ('in', 'state:12')])
+    assert response.status_code in [429, 500, 503]
+    assert response.headers['Retry-After'] == '1'
+    assert stand_in.n_errors == stand_in.n_requests == 1
+
+@pytest.mark.parametrize('stand_in', [{'n_counties' : 2, 'n_tracts' : 2}],
+                            indirect = True)
+def test_run_benchmark(stand_in, tmp_path, monkeypatch):
+
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    timings = benchmark.run_benchmark(stand_in, 'tract', ['Florida', 'Georgia'],
+                    max_workers = 2)
+
+    assert [timing['stage'] for timing in timings] == ['fetch', 'csv',
+                'csv_vectorized', 'parquet']
+    assert [timing['n_rows'] for timing in timings] == [2 * 2 * 2] * 4
+    assert all([timing['rows_per_s'] > 0.0 for timing in timings])
+    # The timings can be appended to a JSON-lines file.
+    assert json.loads(json.dumps(timings)) == timings
@@ -0,0 +1,137 @@
+'''
+Tests for census_catalog.py.
+'''
+# Imports: Standard library.
+import json
+import os
+
+# Imports: Third party.
+import pytest
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc.census_catalog import (VariableCatalog, define_headers_from_catalog,
+                                         make_header, parse_age_bracket)
+
+# The age brackets of group B01001, as labelled in variables.json.
+age_labels = ['Under 5 years', '5 to 9 years', '10 to 14 years', '15 to 17 years',
+              '18 and 19 years', '20 years', '21 years', '22 to 24 years',
+              '25 to 29 years', '30 to 34 years', '35 to 39 years', '40 to 44 years',
+              '45 to 49 years', '50 to 54 years', '55 to 59 years', '60 and 61 years',
+              '62 to 64 years', '65 and 66 years', '67 to 69 years', '70 to 74 years',
+              '75 to 79 years', '80 to 84 years', '85 years and over']
+
+def define_variables():
+    '''
+    A small version of variables.json for an ACS dataset, with group B01001
+    (sex by age), its margins of error, and one other variable.
+    '''
+
+    labels = ['Estimate!!Total:']
+    for sex in ['Male', 'Female']:
+
+        labels.append('Estimate!!Total:!!{:}:'.format(sex))
+        labels.extend(['Estimate!!Total:!!{:}:!!{:}'.format(sex, age_label) for
+                        age_label in age_labels])
+
+    variables = {'NAME' : {'label' : 'Geographic Area Name', 'concept' : '',
+                    'predicateType' : 'string'}}
+    for i, label in enumerate(labels):
+
+        for suffix in ['E', 'M']:
+
+            if suffix == 'M':
+                label = label.replace('Estimate', 'Margin of Error')
+            variables['B01001_{:03d}{:}'.format(i + 1, suffix)] = {'label' : label,
+                    'concept' : 'Sex by Age', 'group' : 'B01001',
+                    'predicateType' : 'int'}
+
+    variables['B19013_001E'] = {'label' : 'Estimate!!Median household income in '
+            'the past 12 months (in 2022 inflation-adjusted dollars)',
+            'concept' : 'Median Household Income', 'group' : 'B19013',
+            'predicateType' : 'int'}
+
+    return variables
+
+@pytest.fixture
+def catalog(tmp_path, file_server):
+
+    dir_dataset = os.path.join(file_server.dir_root, 'data', '2022', 'acs', 'acs5')
+    os.makedirs(dir_dataset)
+    with open(os.path.join(dir_dataset, 'variables.json'), 'w') as file:
+        json.dump({'variables' : define_variables()}, file)
+    with open(os.path.join(dir_dataset, 'groups.json'), 'w') as file:
+        json.dump({'groups' : [{'name' : 'B01001', 'description' : 'Sex by Age'},
+                    {'name' : 'B19013', 'description' : 'Median Household Income'}]},
+                    file)
+
+    catalog = VariableCatalog(os.path.join(tmp_path, 'catalog.sqlite'))
+    catalog.build(file_server.get_url('data/2022/acs/acs5'))
+    yield catalog
+    catalog.close()
+
+def test_build(catalog, file_server):
+
+    endpoint = file_server.get_url('data/2022/acs/acs5/')
+    assert catalog.is_built(endpoint)
+    assert file_server.count_requests() == 2
+
+    # A dataset which is already in the catalog is not downloaded again.
+    catalog.build(endpoint)
+    assert file_server.count_requests() == 2
+    catalog.build(endpoint, overwrite = True)
+    assert file_server.count_requests() == 4
+    assert catalog.get_variable(endpoint, 'B01001_003E') == (
+            'Estimate!!Total:!!Male:!!Under 5 years', 'Sex by Age', 'B01001')
+
+def test_search_and_check(catalog, file_server):
+
+    endpoint = file_server.get_url('data/2022/acs/acs5')
+    assert catalog.search(endpoint, 'median income') == [('B19013_001E',
+                catalog.get_variable(endpoint, 'B19013_001E')[0], 'Median Household Income')]
+    assert sorted([key for key, _, _ in catalog.search(endpoint, 'female over',
+                limit = 50)]) == ['B01001_049E', 'B01001_049M']
+    assert catalog.check_variables(endpoint, ['NAME', 'B01001_001E', 'B01001_050E']) == \
+            ['B01001_050E']
+
+def test_define_headers_from_catalog(catalog, file_server):
+
+    endpoint = file_server.get_url('data/2022/acs/acs5')
+    assert define_headers_from_catalog(catalog, endpoint, 'B01001') == \
+            census.define_headers()
+
+    keys, headers = define_headers_from_catalog(catalog, endpoint, 'B01001',
+                        suffixes = ('M',), include_name = False)
+    assert keys[:3] == ['B01001_001M', 'B01001_002M', 'B01001_003M']
+    assert headers[:3] == ['m', 'mM', 'mM_00_04']
+    assert define_headers_from_catalog(catalog, endpoint, 'B19013') == (
+            ['B19013_001E', 'NAME'], ['B19013001E', 'name'])
+
+    with pytest.raises(ValueError):
+        define_headers_from_catalog(catalog, endpoint, 'B99999')
+    with pytest.raises(ValueError):
+        define_headers_from_catalog(catalog, file_server.get_url('data/2019/acs/acs5'),
+                'B01001')
+
+def test_request_data_rejects_unknown_variables(catalog, file_server, tmp_path,
+        monkeypatch):
+
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    endpoint = file_server.get_url('data/2022/acs/acs5')
+    n_requests = len(file_server.requests)
+    with pytest.raises(ValueError, match = 'B01001_050E'):
+        census.request_data('not-a-real-key', endpoint = endpoint,
+                variable_keys = ['NAME', 'B01001_050E'], variable_headers = ['name', 'x'],
+                catalog = catalog)
+    assert len(file_server.requests) == n_requests
+
+def test_parse_age_bracket_and_make_header():
+
+    assert parse_age_bracket('Under 5 years') == (0, 4)
+    assert parse_age_bracket('18 and 19 years') == (18, 19)
+    assert parse_age_bracket('20 years') == (20, 20)
+    assert parse_age_bracket('85 years and over') == (85, None)
+    assert parse_age_bracket('Male') is None
+    assert make_header('B01001_026E', 'Estimate!!Total:!!Female:') == 'pF'
+    assert make_header('B01001_049M', 'Margin of Error!!Total:!!Female:!!85 years and over') \
+            == 'mF_85pls'
@@ -0,0 +1,106 @@
+'''
+Tests for census_store.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc.benchmark_US_census_data import CensusAPIStandIn
+from hrmd_ma_misc.census_store import CensusStore, describe_partition
+
+endpoint = 'http://localhost/data/2022/acs/acs5'
+
+def define_partition(state, county):
+
+    return [('for', 'tract:*'), ('in', 'state:{:}'.format(state)),
+            ('in', 'county:{:}'.format(county))]
+
+def test_describe_partition():
+
+    assert describe_partition(define_partition('12', '071')) == ('12', '071')
+    assert describe_partition([('for', 'county:*'), ('in', 'state:13')]) == ('13', '*')
+
+def test_find_missing_partitions(tmp_path):
+
+    store = CensusStore(os.path.join(tmp_path, 'store.sqlite'))
+    _, id_components = census.define_id_components('tract')
+    partitions = [define_partition('12', '071'), define_partition('12', '015')]
+    rows = [['NAME', 'B01001_001E', 'state', 'county', 'tract'],
+            ['Tract 1', '1200', '12', '71', '100']]
+    store.upsert_partition(endpoint, 'tract', partitions[0], ['NAME', 'B01001_001E'],
+            rows, id_components)
+    # A county with no tracts is held too, so it is not requested again.
+    store.upsert_partition(endpoint, 'tract', partitions[1], ['NAME', 'B01001_001E'],
+            [], id_components)
+
+    assert store.find_missing_partitions(endpoint, 'tract', ['B01001_001E'],
+                partitions) == []
+    assert store.find_missing_partitions(endpoint, 'tract', ['NAME', 'B01001_002E'],
+                partitions) == partitions
+    assert store.find_missing_partitions(endpoint, 'block group', ['NAME'],
+                partitions) == partitions
+    new_partition = define_partition('13', '001')
+    assert store.find_missing_partitions(endpoint, 'tract', ['NAME'],
+                partitions + [new_partition]) == [new_partition]
+    store.close()
+
+def test_upsert_and_iter_rows(tmp_path):
+
+    store = CensusStore(os.path.join(tmp_path, 'store.sqlite'))
+    _, id_components = census.define_id_components('county')
+    assert list(store.iter_rows(endpoint, 'county', ['NAME'])) == []
+
+    partition_12 = [('for', 'county:*'), ('in', 'state:12')]
+    partition_13 = [('for', 'county:*'), ('in', 'state:13')]
+    store.upsert_partition(endpoint, 'county', partition_12, ['NAME', 'B01001_001E'],
+            [['NAME', 'B01001_001E', 'state', 'county'],
+             ['County 3', '30', '12', '3'],
+             ['County 1', '10', '12', '1']], id_components)
+    store.upsert_partition(endpoint, 'county', partition_13, ['NAME'],
+            [['NAME', 'state', 'county'], ['County 1', '13', '1']], id_components)
+    # Newer values replace older ones, and other variables are kept.
+    store.upsert_partition(endpoint, 'county', partition_12, ['B01001_001E'],
+            [['B01001_001E', 'state', 'county'], ['11', '12', '1']], id_components)
+
+    assert list(store.iter_rows(endpoint, 'county', ['NAME', 'B01001_001E'])) == [
+                ['NAME', 'B01001_001E', 'state', 'county'],
+                ['County 1', '11', '12', '1'],
+                ['County 3', '30', '12', '3'],
+                ['County 1', None, '13', '1']]
+    assert list(store.iter_rows(endpoint, 'county', ['B01001_001E'],
+                state_codes = ['13'])) == [['B01001_001E', 'state', 'county'],
+                [None, '13', '1']]
+    store.close()
+
+def test_update_store(tmp_path):
+
+    server = CensusAPIStandIn(n_counties = 2, n_tracts = 2)
+    server.start()
+    store = CensusStore(os.path.join(tmp_path, 'store.sqlite'))
+    session = census.create_session(2)
+    variable_keys = ['NAME', 'B01001_001E']
+    try:
+        endpoint = server.get_endpoint()
+        for states in [[12], [12, 13]]:
+
+            county_codes_by_state = {'{:02d}'.format(state) : ['001', '003'] for
+                                        state in states}
+            partitions = census.define_query_partitions('tract', states,
+                            county_codes_by_state)
+            n_requests = server.n_requests
+            census.update_store(store, session, endpoint, 'tract', variable_keys,
+                    partitions, 'not-a-real-key', max_workers = 2)
+
+        n_requests_added = server.n_requests - n_requests
+        expected_rows = census.fetch_partitions(session, endpoint, variable_keys,
+                            partitions, 'not-a-real-key', max_workers = 2)
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    # Adding a state only requests that state's partitions.
+    assert n_requests_added == 2
+    assert list(store.iter_rows(endpoint, 'tract', variable_keys)) == expected_rows
+    store.close()
@@ -0,0 +1,199 @@
+'''
+Tests for compute_flood_exposure.py.
+'''
+# Imports: Standard library.
+import csv
+import json
+import os
+
+# Imports: Third party.
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+
+# Imports: Local.
+from hrmd_ma_misc import compute_flood_exposure as exposure
+from hrmd_ma_misc.download_US_census_data import define_headers
+
+# Two adjacent 10 x 10 tiles of 0.1 degree pixels: the west tile is all
+# flooded, the east tile is dry except for a recurring flood and some
+# pixels with insufficient data.
+pixel_size = 0.1
+tile_origins = {'h08v05' : (-82.0, 28.0), 'h09v05' : (-81.0, 28.0)}
+
+def define_box(x_min, y_min, x_max, y_max):
+
+    return {'type' : 'Polygon', 'coordinates' : [[[x_min, y_min], [x_max, y_min],
+                [x_max, y_max], [x_min, y_max], [x_min, y_min]]]}
+
+def write_granules(dir_granules, date = '2024275'):
+
+    data_west = np.full((10, 10), 3, dtype = 'uint8')
+    data_east = np.zeros((10, 10), dtype = 'uint8')
+    # The first two rows of the second tract (see write_geographies()).
+    data_east[0, 1:5] = exposure.insufficient_data_value
+    data_east[1, 1:5] = 2
+
+    paths_granules = []
+    for tile, data in zip(['h08v05', 'h09v05'], [data_west, data_east]):
+
+        path_granule = os.path.join(dir_granules,
+                            'MCDWD_L3_F2_NRT.A{:}.{:}.061.{:}052248.tif'.format(date,
+                                tile, date))
+        with rasterio.open(path_granule, 'w', driver = 'GTiff', width = 10, height = 10,
+                count = 1, dtype = 'uint8', crs = 'EPSG:4326',
+                transform = from_origin(*tile_origins[tile], pixel_size, pixel_size)) as dst:
+            dst.write(data, 1)
+        paths_granules.append(path_granule)
+
+    return paths_granules
+
+def write_geographies(path_geographies):
+    '''
+    Three tracts: one across both tiles (5 x 5 pixels in each), one in the
+    east tile (4 x 4 pixels), and one outside both tiles.
+    '''
+
+    boxes = {'12015010100' : define_box(-81.5, 27.0, -80.5, 27.5),
+             '12015010200' : define_box(-80.9, 27.6, -80.5, 28.0),
+             '12015010300' : define_box(-70.0, 27.0, -69.5, 27.5)}
+    geojson = {'type' : 'FeatureCollection', 'features' : [{'type' : 'Feature',
+                'properties' : {'GEOID' : geoid}, 'geometry' : geometry} for
+                geoid, geometry in boxes.items()]}
+    with open(path_geographies, 'w') as file:
+        json.dump(geojson, file)
+
+    return
+
+def write_census(path_census, populations):
+
+    variable_keys, _ = define_headers()
+    rows = [variable_keys + ['state', 'county', 'tract']]
+    for geoid, population in populations.items():
+
+        row = ['Census Tract {:}'.format(geoid[-4:-2]) if key == 'NAME' else
+                '10' for key in variable_keys]
+        row[variable_keys.index('B01001_001E')] = str(population)
+        # An unavailable estimate.
+        row[variable_keys.index('B01001_003E')] = '-666666666'
+        rows.append(row + [geoid[:2], geoid[2:5], geoid[5:]])
+    with open(path_census, 'w') as file:
+        json.dump(rows, file)
+
+    return
+
+def read_csv(path):
+
+    with open(path, 'r', newline = '') as file:
+        rows = list(csv.DictReader(file))
+
+    return rows
+
+@pytest.fixture
+def inputs(tmp_path):
+
+    dir_granules = os.path.join(tmp_path, 'granules')
+    os.makedirs(dir_granules)
+    paths_granules = write_granules(dir_granules)
+    path_geographies = os.path.join(tmp_path, 'tracts.geojson')
+    write_geographies(path_geographies)
+    path_census = os.path.join(tmp_path, 'US_pop_by_age_sex__tract.json')
+    write_census(path_census, {'12015010100' : 100, '12015010200' : 60,
+                    '12015010300' : 80})
+
+    return paths_granules, path_geographies, path_census
+
+def test_parse_granule_name():
+
+    assert exposure.parse_granule_name(
+            'dir/MCDWD_L3_F2_NRT.A2024275.h08v05.061.2024275052248.tif') == \
+            ('MCDWD_L3_F2_NRT', '2024275')
+    with pytest.raises(ValueError):
+        exposure.parse_granule_name('USGS_1M_17_x39y299.tif')
+
+def test_compute_flood_exposure(tmp_path, inputs):
+
+    paths_granules, path_geographies, path_census = inputs
+    dir_out = os.path.join(tmp_path, 'output')
+    dir_cache = os.path.join(tmp_path, 'cache')
+
+    paths_out = exposure.compute_flood_exposure(paths_granules, path_geographies,
+                    path_census, dir_out = dir_out, dir_cache = dir_cache,
+                    max_workers = 2)
+
+    # The two tiles are one flood map, and the tract outside both tiles has
+    # no valid pixels so is not written.
+    assert paths_out == [os.path.join(dir_out,
+                'flood_exposure__MCDWD_L3_F2_NRT_A2024275__tract.csv')]
+    rows = read_csv(paths_out[0])
+    assert [(row['GEOID'], row['name'], row['n_valid'], row['n_flooded'],
+                row['flood_frac']) for row in rows] == [
+                ('12015010100', 'Census Tract 01', '50', '25', '0.5000'),
+                ('12015010200', 'Census Tract 02', '12', '0', '0.0000')]
+    _, variable_headers = define_headers()
+    assert list(rows[0].keys()) == ['GEOID', 'name', 'n_valid', 'n_flooded',
+                'flood_frac'] + [header for header in variable_headers if header != 'name']
+    assert (rows[0]['p'], rows[0]['pM'], rows[0]['pM_00_04']) == ('50.0', '5.0', '0.0')
+
+    # Recurring floods can also be counted.
+    paths_out = exposure.compute_flood_exposure(paths_granules, path_geographies,
+                    path_census, dir_out = dir_out, dir_cache = dir_cache,
+                    flooded_values = (2, 3), max_workers = 2)
+    rows = read_csv(paths_out[0])
+    assert [(row['n_flooded'], row['flood_frac'], row['p']) for row in rows] == [
+                ('25', '0.5000', '50.0'), ('4', '0.3333', '20.0')]
+
+def test_label_cache(tmp_path, inputs, monkeypatch):
+
+    paths_granules, path_geographies, path_census = inputs
+    dir_cache = os.path.join(tmp_path, 'cache')
+    _, geometries, crs = exposure.read_geographies(path_geographies)
+
+    # One label raster per tile grid.
+    label_paths = exposure.prepare_label_rasters(paths_granules, path_geographies,
+                        geometries, crs, dir_cache = dir_cache)
+    assert len(set(label_paths.values())) == 2
+    assert sorted(os.listdir(dir_cache)) == sorted([os.path.basename(path) for path in
+                label_paths.values()])
+    with np.load(label_paths[paths_granules[1]]) as npz:
+        labels = npz['labels']
+    assert np.bincount(labels.ravel(), minlength = 4).tolist() == [59, 25, 16, 0]
+
+    # The granules of another day are on the same grids, so the labels are
+    # not rasterized again.
+    def build_label_raster(*args, **kwargs):
+        raise AssertionError('The label raster should be cached')
+    monkeypatch.setattr(exposure, 'build_label_raster', build_label_raster)
+    dir_granules = os.path.join(tmp_path, 'granules_next')
+    os.makedirs(dir_granules)
+    paths_granules_next = write_granules(dir_granules, date = '2024276')
+    label_paths_next = exposure.prepare_label_rasters(paths_granules_next,
+                            path_geographies, geometries, crs, dir_cache = dir_cache)
+    assert list(label_paths_next.values()) == list(label_paths.values())
+
+    n_valid, n_flooded = exposure.count_flooded_pixels(paths_granules_next[1],
+                            label_paths_next[paths_granules_next[1]], 3)
+    assert (n_valid.tolist(), n_flooded.tolist()) == ([59, 25, 12, 0], [0, 0, 0, 0])
+
+def test_read_population(tmp_path):
+
+    variable_keys, variable_headers = define_headers()
+    path_census = os.path.join(tmp_path, 'US_pop_by_age_sex__tract.json')
+    write_census(path_census, {'12015010200' : 60, '12015010100' : 100})
+
+    population, population_headers, names = exposure.read_population(path_census,
+            ['12015010100', '12015010300', '12015010200'], variable_keys, variable_headers)
+    assert population_headers == [header for header in variable_headers if header != 'name']
+    assert population[:, population_headers.index('p')].tolist() == [0.0, 100.0, 0.0, 60.0]
+    assert population[:, population_headers.index('pM_00_04')].tolist() == [0.0] * 4
+    assert names == ['', 'Census Tract 01', '', 'Census Tract 02']
+
+    # A census file with no geographies.
+    with open(path_census, 'w') as file:
+        file.write('[]')
+    population, population_headers, names = exposure.read_population(path_census,
+            ['12015010100'], variable_keys, variable_headers)
+    assert population.shape == (2, len(population_headers))
+    assert not population.any()
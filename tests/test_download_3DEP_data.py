@@ -0,0 +1,115 @@
+'''
+Tests for download_3DEP_data.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Third party.
+import pytest
+import requests
+
+# Imports: Local.
+from hrmd_ma_misc import download_3DEP_data
+from hrmd_ma_misc.download_manifest import DownloadManifest
+
+def make_tiled_geotiff(path, size = 1024, res = 1.0, origin = (400000.0, 3000000.0)):
+    '''
+    Write a synthetic tiled GeoTIFF (like a 3DEP tile), and return its data.
+    '''
+
+    np = pytest.importorskip('numpy')
+    rasterio = pytest.importorskip('rasterio')
+    from rasterio.transform import from_origin
+
+    data = np.arange(size * size, dtype = 'float32').reshape(1, size, size)
+    with rasterio.open(path, 'w', driver = 'GTiff', width = size, height = size,
+            count = 1, dtype = 'float32', crs = 'EPSG:26917',
+            transform = from_origin(origin[0], origin[1], res, res),
+            tiled = True, blockxsize = 256, blockysize = 256) as dst:
+        dst.write(data)
+
+    return data
+
+def test_read_tile_window(tmp_path, file_server):
+
+    rasterio = pytest.importorskip('rasterio')
+    data = make_tiled_geotiff(os.path.join(file_server.dir_root, 'tile.tif'))
+    url = file_server.get_url('tile.tif')
+    path_clip = os.path.join(tmp_path, 'tile_clip.tif')
+    manifest = DownloadManifest(os.path.join(tmp_path, 'download_manifest.sqlite'))
+    session = requests.Session()
+
+    # Easting 400100-400300, northing 2999500-2999800 are rows 200-500 and
+    # columns 100-300.
+    bounds = [400100.0, 2999500.0, 400300.0, 2999800.0]
+    assert download_3DEP_data.read_tile_window(url, bounds, path_clip,
+                session = session, manifest = manifest) == 'downloaded'
+    with rasterio.open(path_clip) as src:
+        assert (src.read() == data[:, 200:500, 100:300]).all()
+        assert src.bounds == tuple(bounds)
+    assert not os.path.exists(path_clip + '.part')
+
+    # Only parts of the tile were requested.
+    gets = [headers for method, _, headers in file_server.requests if method == 'GET']
+    assert gets and all(['Range' in headers for headers in gets])
+
+    # An unchanged tile is only checked with a HEAD request.
+    n_requests = file_server.count_requests('GET')
+    assert download_3DEP_data.read_tile_window(url, bounds, path_clip,
+                session = session, manifest = manifest) == 'unchanged'
+    assert file_server.count_requests('GET') == n_requests
+
+    # A new area is read again.
+    bounds = [400000.0, 2999000.0, 400100.0, 2999100.0]
+    assert download_3DEP_data.read_tile_window(url, bounds, path_clip,
+                session = session, manifest = manifest) == 'updated'
+    with rasterio.open(path_clip) as src:
+        assert (src.read() == data[:, 900:1000, 0:100]).all()
+
+    # Areas outside the tile are only requested once.
+    bounds = [500000.0, 2999000.0, 500100.0, 2999100.0]
+    path_empty = os.path.join(tmp_path, 'other_clip.tif')
+    assert download_3DEP_data.read_tile_window(url, bounds, path_empty,
+                session = session, manifest = manifest) == 'empty'
+    n_requests = len(file_server.requests)
+    assert download_3DEP_data.read_tile_window(url, bounds, path_empty,
+                session = session, manifest = manifest) == 'empty'
+    assert len(file_server.requests) == n_requests
+    assert not os.path.exists(path_empty)
+
+    manifest.close()
+
+def test_download_tiles(tmp_path, file_server, monkeypatch):
+
+    monkeypatch.setattr(download_3DEP_data, 'base_url',
+            file_server.get_url(download_3DEP_data.file_name_fmt))
+    download_dir = os.path.join(tmp_path, 'tiles')
+    os.makedirs(download_dir)
+    tiles = [(34, 303), (39, 299), (40, 300)]
+    tile_data = {}
+    for x_tile, y_tile in tiles[:2]:
+
+        file_name = download_3DEP_data.file_name_fmt.format(xtile = x_tile, ytile = y_tile)
+        tile_data[file_name] = os.urandom(200000)
+        with open(os.path.join(file_server.dir_root, file_name), 'wb') as file:
+            file.write(tile_data[file_name])
+
+    # One tile was interrupted part way through.
+    file_name = download_3DEP_data.file_name_fmt.format(xtile = 39, ytile = 299)
+    with open(os.path.join(download_dir, file_name + '.part'), 'wb') as file:
+        file.write(tile_data[file_name][:50000])
+
+    failed_tiles = download_3DEP_data.download_tiles(tiles, max_workers = 2,
+                        download_dir = download_dir, requests_per_second = None,
+                        max_retries = 0)
+
+    # The third tile does not exist on the server.
+    assert failed_tiles == [(40, 300)]
+    for file_name, data in tile_data.items():
+
+        with open(os.path.join(download_dir, file_name), 'rb') as file:
+            assert file.read() == data
+    assert not [name for name in os.listdir(download_dir) if name.endswith('.part')]
+    ranges = [headers.get('Range') for method, path, headers in file_server.requests
+                if method == 'GET' and 'x39y299' in path]
+    assert ranges == ['bytes=50000-']
@@ -0,0 +1,253 @@
+'''
+Tests for download_MCDWD_flood_data.py.
+'''
+# Imports: Standard library.
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+# Imports: Third party.
+import pytest
+
+# Imports: Local.
+from hrmd_ma_misc import download_MCDWD_flood_data as mcdwd
+from hrmd_ma_misc.download_manifest import DownloadManifest
+from hrmd_ma_misc.fetch_scheduler import FetchScheduler
+
+tiles = [[8, 5], [8, 6]]
+
+def define_granule_name(dataset, year, day_of_year, tile, extension = 'tif'):
+
+    return 'MCDWD_L3_F{:}_NRT.A{:04d}{:03d}.h{:02d}v{:02d}.061.{:04d}{:03d}052248.{:}'.format(
+                dataset, year, day_of_year, tile[0], tile[1], year, day_of_year,
+                extension)
+
+def publish_granules(file_server, dataset, year, day_of_year, published_tiles):
+    '''
+    Add granules for some tiles to a folder on the local stand-in for the
+    MODAPS server, and update the folder's JSON listing. Each folder also has
+    a preview image and a granule for a tile which is not a target.
+    '''
+
+    path_folder = 'MCDWD_L3_F{:}_NRT/{:04d}/{:03d}'.format(dataset, year, day_of_year)
+    dir_archive = os.path.join(file_server.dir_root, 'archives', path_folder)
+    os.makedirs(dir_archive, exist_ok = True)
+    for tile in published_tiles + [[20, 5]]:
+
+        with open(os.path.join(dir_archive, define_granule_name(dataset, year,
+                day_of_year, tile)), 'wb') as file:
+            file.write(os.urandom(5000))
+    with open(os.path.join(dir_archive, define_granule_name(dataset, year,
+            day_of_year, [20, 5], 'jpg')), 'wb') as file:
+        file.write(b'preview')
+
+    path_listing = os.path.join(file_server.dir_root, 'details', path_folder)
+    os.makedirs(os.path.dirname(path_listing), exist_ok = True)
+    listing = {'content' : [{'name' : name, 'size' : os.path.getsize(
+                    os.path.join(dir_archive, name))} for name in sorted(os.listdir(dir_archive))]}
+    with open(path_listing, 'w') as file:
+        json.dump(listing, file)
+
+    return
+
+def count_listing_requests(file_server):
+
+    return len([path for _, path, _ in file_server.requests if path.startswith('/details/')])
+
+@pytest.fixture
+def modaps(file_server, monkeypatch):
+    '''
+    Point the listing and download URLs at a local stand-in for the MODAPS
+    server: listings are JSON files under 'details', and granules are under
+    'archives'.
+    '''
+
+    monkeypatch.setattr(mcdwd, 'url_listing_fmt',
+            file_server.get_url('details/MCDWD_L3_F{:}_NRT/{:04d}/{:03d}'))
+    monkeypatch.setattr(mcdwd, 'url_folder_fmt',
+            file_server.get_url('archives/MCDWD_L3_F{:}_NRT/{:04d}/{:03d}/'))
+
+    return file_server
+
+def test_parse_tile_and_get_day_of_year():
+
+    assert mcdwd.parse_tile(' H08v05') == [8, 5]
+    with pytest.raises(Exception):
+        mcdwd.parse_tile('8,5')
+    assert mcdwd.get_day_of_year('2024-10-01') == (2024, 275)
+    assert mcdwd.get_day_of_year('2023-12-31') == (2023, 365)
+
+def test_select_granules():
+
+    listing = [{'name' : define_granule_name('1', 2024, 275, [8, 5])},
+               {'name' : define_granule_name('1', 2024, 275, [8, 5], 'jpg')},
+               {'name' : define_granule_name('1', 2024, 275, [18, 5])},
+               {'name' : define_granule_name('1', 2024, 275, [8, 6])}]
+    assert mcdwd.select_granules(listing, tiles) == [listing[0], listing[3]]
+    assert mcdwd.select_granules(listing, [[18, 5]]) == [listing[2]]
+
+def test_download_days(tmp_path, modaps):
+
+    dir_output = os.path.join(tmp_path, 'output')
+    for dataset in ['1', '2']:
+        publish_granules(modaps, dataset, 2024, 275, tiles)
+    session = mcdwd.create_session('not-a-real-token', 4)
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+
+    # The folder for dataset 3 does not exist yet, which is not a failure.
+    failed_jobs = mcdwd.download_days(session, manifest, [(2024, 275)], ['1', '2', '3'],
+                        tiles, dir_output, max_workers = 4)
+    assert failed_jobs == []
+    for dataset in ['1', '2']:
+
+        dir_folder = mcdwd.define_folder(dir_output, dataset, 2024, 275)
+        assert sorted(os.listdir(dir_folder)) == [define_granule_name(dataset,
+                    2024, 275, tile) for tile in tiles]
+    assert all([headers.get('Authorization') == 'Bearer not-a-real-token' for _, _,
+                    headers in modaps.requests])
+    assert count_listing_requests(modaps) == 3
+
+    # Granules which are already downloaded are only checked.
+    n_requests = len(modaps.requests)
+    mcdwd.download_days(session, manifest, [(2024, 275)], ['1', '2'], tiles, dir_output)
+    assert [headers.get('If-None-Match') is not None for _, path, headers in
+                modaps.requests[n_requests:] if path.startswith('/archives/')] == [True] * 4
+    manifest.close()
+
+def test_define_days():
+
+    assert mcdwd.define_days('2023-12-30', '2024-01-02') == [(2023, 364), (2023, 365),
+                (2024, 1), (2024, 2)]
+    assert mcdwd.define_days('2024-02-29', '2024-02-29') == [(2024, 60)]
+    with pytest.raises(Exception):
+        mcdwd.define_days('2024-01-02', '2024-01-01')
+
+def test_backfill(tmp_path, modaps):
+
+    dir_output = os.path.join(tmp_path, 'output')
+    publish_granules(modaps, '1', 2023, 365, tiles)
+    publish_granules(modaps, '1', 2024, 1, tiles[:1])
+    settings = {'bearer_token' : 'not-a-real-token', 'dir_output' : dir_output,
+                'tiles' : 'h08v05,h08v06', 'datasets' : '1'}
+    argv = ['--start', '2023-12-31', '--end', '2024-01-01']
+
+    mcdwd.main(argv, settings = settings)
+    assert mcdwd.find_missing_tiles(mcdwd.define_folder(dir_output, '1', 2023, 365),
+                tiles) == []
+    assert mcdwd.find_missing_tiles(mcdwd.define_folder(dir_output, '1', 2024, 1),
+                tiles) == [[8, 6]]
+
+    # A second run only lists the incomplete folder.
+    n_requests = len(modaps.requests)
+    publish_granules(modaps, '1', 2024, 1, tiles)
+    mcdwd.main(argv, settings = settings)
+    paths = [path for _, path, _ in modaps.requests[n_requests:]]
+    assert [path.split('?')[0] for path in paths if path.startswith('/details/')] == \
+            ['/details/MCDWD_L3_F1_NRT/2024/001']
+    assert [os.path.basename(path) for path in paths if path.startswith('/archives/')] == \
+            [define_granule_name('1', 2024, 1, [8, 6])]
+    assert mcdwd.find_missing_tiles(mcdwd.define_folder(dir_output, '1', 2024, 1),
+                tiles) == []
+
+def test_download_days_concurrency(tmp_path, modaps, monkeypatch):
+
+    # Wrap the downloads to record how many run at the same time.
+    lock = threading.Lock()
+    counts = {'active' : 0, 'peak' : 0}
+    download_file = mcdwd.download_file
+
+    def counting_download_file(*args, **kwargs):
+        with lock:
+            counts['active'] = counts['active'] + 1
+            counts['peak'] = max(counts['peak'], counts['active'])
+        try:
+            time.sleep(0.02)
+            return download_file(*args, **kwargs)
+        finally:
+            with lock:
+                counts['active'] = counts['active'] - 1
+
+    monkeypatch.setattr(mcdwd, 'download_file', counting_download_file)
+    days = mcdwd.define_days('2024-09-30', '2024-10-03')
+    for year, day_of_year in days:
+        publish_granules(modaps, '1', year, day_of_year, tiles)
+    session = mcdwd.create_session('not-a-real-token', 8)
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    scheduler = FetchScheduler(max_per_host = 2, requests_per_second = None)
+
+    failed_jobs = mcdwd.download_days(session, manifest, days, ['1'], tiles,
+                        str(tmp_path), max_workers = 8, scheduler = scheduler,
+                        skip_complete = True)
+    manifest.close()
+
+    assert failed_jobs == []
+    assert counts['peak'] == 2
+    assert sum([len(files) for _, _, files in os.walk(os.path.join(tmp_path,
+                'MCDWD_L3_F1_NRT'))]) == len(days) * len(tiles)
+
+def test_watch_days(tmp_path, modaps, monkeypatch):
+
+    dir_output = os.path.join(tmp_path, 'output')
+    days = [(2024, 275), (2024, 276)]
+    monkeypatch.setattr(mcdwd, 'define_recent_days', lambda n_days : days[-n_days:])
+
+    # Yesterday is already complete, today only has one tile so far. The rest
+    # is published during the second wait.
+    for dataset in ['1', '2']:
+        publish_granules(modaps, dataset, 2024, 275, tiles)
+        publish_granules(modaps, dataset, 2024, 276, tiles[:1])
+    session = mcdwd.create_session('not-a-real-token', 4)
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    mcdwd.download_days(session, manifest, days[:1], ['1', '2'], tiles, dir_output)
+
+    intervals = []
+    def sleep(interval):
+        intervals.append(interval)
+        if len(intervals) == 2:
+            for dataset in ['1', '2']:
+                publish_granules(modaps, dataset, 2024, 276, tiles)
+        return
+    monkeypatch.setattr(mcdwd, 'time', SimpleNamespace(time = time.time, sleep = sleep))
+
+    path_log = os.path.join(tmp_path, 'complete.txt')
+    n_requests = len(modaps.requests)
+    mcdwd.watch_days(session, manifest, ['1', '2'], tiles, dir_output,
+            on_complete = 'echo {year} {day_of_year} >> ' + path_log, min_interval = 1,
+            max_interval = 4, max_polls = 4)
+    manifest.close()
+
+    # The complete day is never polled, an unchanged listing gets a 304, and
+    # the interval backs off until granules arrive.
+    listings = [(path.split('?')[0], headers.get('If-None-Match') is not None) for
+                    _, path, headers in modaps.requests[n_requests:] if
+                    path.startswith('/details/')]
+    assert sorted(listings) == sorted([('/details/MCDWD_L3_F{:}_NRT/2024/276'.format(
+                dataset), conditional) for dataset in ['1', '2'] for conditional in
+                [False, True, True]])
+    assert intervals == [1, 2, 1]
+    assert mcdwd.count_missing_tiles(dir_output, ['1', '2'], tiles, 2024, 276) == 0
+    with open(path_log, 'r') as file:
+        assert file.read() == '2024 276\n'
+
+def test_watch_setting(tmp_path, monkeypatch):
+
+    calls = []
+    monkeypatch.setattr(mcdwd, 'watch_days', lambda *args, **kwargs :
+                            calls.append('watch'))
+    monkeypatch.setattr(mcdwd, 'download_days', lambda *args, **kwargs :
+                            calls.append('download'))
+    settings = {'watch' : 'yes', 'bearer_token' : 'not-a-real-token',
+                'dir_output' : str(tmp_path)}
+
+    # Watch mode can be set in the config file or the environment...
+    mcdwd.main([], settings = settings)
+    assert calls == ['watch']
+
+    # ...and turned off on the command line.
+    mcdwd.main(['2024-10-01', '--no-watch'], settings = settings)
+    assert calls == ['watch', 'download']
+
+    with pytest.raises(SystemExit):
+        mcdwd.main([], settings = dict(settings, watch = 'no'))
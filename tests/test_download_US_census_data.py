@@ -0,0 +1,547 @@
+'''
+Tests for download_US_census_data.py.
+'''
+# Imports: Standard library.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import json
+import os
+import sys
+
+# Imports: Third party.
+import pytest
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc.benchmark_US_census_data import CensusAPIStandIn
+
+def iter_failing_rows():
+
+    yield ['NAME', 'B01001_001E', 'state', 'county']
+    yield ['County 1', '100', '12', '001']
+    raise ConnectionError('Connection dropped')
+
+def test_define_query_partitions():
+
+    partitions = census.define_query_partitions('county', [12, 13])
+    assert partitions == [[('for', 'county:*'), ('in', 'state:12')],
+                          [('for', 'county:*'), ('in', 'state:13')]]
+
+    partitions = census.define_query_partitions('block group', [12],
+                    {'12' : ['015', '071']})
+    assert partitions == [
+        [('for', 'block group:*'), ('in', 'state:12'), ('in', 'county:015'),
+         ('in', 'tract:*')],
+        [('for', 'block group:*'), ('in', 'state:12'), ('in', 'county:071'),
+         ('in', 'tract:*')]]
+
+    with pytest.raises(ValueError):
+        census.define_query_partitions('zip code', [12])
+
+def test_fetch_partitions_keeps_partition_order():
+
+    # The jitter makes the responses arrive out of order.
+    server = CensusAPIStandIn(n_counties = 4, n_tracts = 3, jitter = 0.05)
+    server.start()
+    session = census.create_session(4)
+    try:
+        endpoint = server.get_endpoint()
+        county_codes_by_state = census.request_county_codes(session, endpoint,
+                                    [13, 12], 'not-a-real-key')
+        partitions = census.define_query_partitions('tract', [13, 12],
+                        county_codes_by_state)
+        rows = census.fetch_partitions(session, endpoint, ['NAME', 'B01001_001E'],
+                    partitions, 'not-a-real-key', max_workers = 4)
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    assert county_codes_by_state == {'13' : ['001', '003', '005', '007'],
+                                     '12' : ['001', '003', '005', '007']}
+    assert len(partitions) == 8
+    assert rows[0] == ['NAME', 'B01001_001E', 'state', 'county', 'tract']
+    assert len(rows) == 1 + 2 * 4 * 3
+    assert [row[2:] for row in rows[1:]] == [[state, county, tract] for state
+                in ['13', '12'] for county in ['001', '003', '005', '007'] for
+                tract in ['000100', '000200', '000300']]
+
+def test_merge_partition_results():
+
+    results = [[['NAME', 'state', 'county'], ['County 1', '12', '001']],
+               [],
+               [['NAME', 'state', 'county'], ['County 3', '12', '003']]]
+    assert census.merge_partition_results(results) == [['NAME', 'state', 'county'],
+                ['County 1', '12', '001'], ['County 3', '12', '003']]
+    assert census.merge_partition_results([[], []]) == []
+
+    with pytest.raises(ValueError):
+        census.merge_partition_results([[['NAME', 'state']], [['NAME', 'county']]])
+
+def test_define_variable_batches():
+
+    variable_keys = ['B01001_{:03d}E'.format(i) for i in range(1, 121)]
+    variable_batches = census.define_variable_batches(variable_keys)
+    assert [len(variable_batch) for variable_batch in variable_batches] == [50, 50, 20]
+    assert sum(variable_batches, []) == variable_keys
+    assert census.define_variable_batches(['NAME']) == [['NAME']]
+
+def test_join_batch_results():
+
+    variable_batches = [['NAME', 'B01001_001E'], ['B01001_002E']]
+    batch_results = [
+        [['NAME', 'B01001_001E', 'state', 'county'],
+         ['County 3', '30', '12', '003'],
+         ['County 1', '10', '12', '001']],
+        [['B01001_002E', 'state', 'county'],
+         ['5', '12', '001'],
+         ['7', '12', '005']]]
+    assert census.join_batch_results(variable_batches, batch_results) == [
+                ['NAME', 'B01001_001E', 'B01001_002E', 'state', 'county'],
+                ['County 3', '30', None, '12', '003'],
+                ['County 1', '10', '5', '12', '001'],
+                [None, None, '7', '12', '005']]
+
+    # A single batch is passed through unchanged.
+    assert census.join_batch_results(variable_batches[:1], batch_results[:1]) is \
+            batch_results[0]
+    assert census.join_batch_results(variable_batches, [[], []]) == []
+
+    with pytest.raises(ValueError):
+        census.join_batch_results(variable_batches, [batch_results[0],
+                [['B01001_002E', 'state'], ['5', '12']]])
+
+def test_iter_partition_results_in_batches():
+
+    server = CensusAPIStandIn(n_counties = 2, n_tracts = 2)
+    server.start()
+    session = census.create_session(4)
+    variable_keys = ['NAME', 'B01001_001E', 'B01001_002E', 'B01001_003E', 'B01001_004E']
+    partitions = census.define_query_partitions('tract', [12],
+                    {'12' : ['001', '003']})
+    try:
+        results = list(census.iter_partition_results(session, server.get_endpoint(),
+                        variable_keys, partitions, 'not-a-real-key', max_workers = 4,
+                        max_variables = 2))
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    assert server.n_requests == 2 * 3
+    for partition, result in zip(partitions, results):
+
+        assert result[0] == variable_keys + ['state', 'county', 'tract']
+        assert [row[-2:] for row in result[1:]] == [[partition[2][1][-3:], '000100'],
+                    [partition[2][1][-3:], '000200']]
+        assert None not in sum(result, [])
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 65536])
+def test_iter_json_rows(chunk_size):
+
+    rows = [['NAME', 'B01001_001E', 'state'],
+            ['Doña Ana County, New Mexico', '219561', '35'],
+            ['County "2", [North]', None, '35']]
+    data = ('[' + ',\n'.join([json.dumps(row, ensure_ascii = False) for row in
+                rows]) + ']').encode('utf-8')
+
+    # Bytes are decoded incrementally, even when a chunk ends inside a
+    # multi-byte character.
+    assert list(census.iter_json_rows(io.BytesIO(data), chunk_size = chunk_size)) == rows
+    assert list(census.iter_json_rows(io.StringIO(data.decode('utf-8')),
+                chunk_size = chunk_size)) == rows
+    assert list(census.iter_json_rows(io.BytesIO(b''), chunk_size = chunk_size)) == []
+
+    with pytest.raises(ValueError):
+        list(census.iter_json_rows(io.BytesIO(data[:-1]), chunk_size = chunk_size))
+
+def test_request_data_csv(tmp_path, monkeypatch):
+
+    server = CensusAPIStandIn(n_counties = 2, n_tracts = 2)
+    server.start()
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    variable_keys = ['NAME', 'B01001_001E']
+    variable_headers = ['Name', 'Total']
+    kwargs = {'endpoint' : server.get_endpoint(), 'target_states' : ['Florida'],
+              'target_adm_levels' : ['tract'], 'variable_keys' : variable_keys,
+              'variable_headers' : variable_headers}
+    try:
+        path_csv_direct, = census.request_data('not-a-real-key',
+                                output_format = 'csv', **kwargs)
+        os.rename(path_csv_direct, os.path.join(tmp_path, 'direct.csv'))
+        path_json, = census.request_data('not-a-real-key', **kwargs)
+    finally:
+        server.shutdown()
+        server.server_close()
+    census.convert_json_to_csv(path_json, variable_keys, variable_headers)
+
+    # Writing the CSV straight from the responses gives the same file as
+    # converting the JSON file.
+    with open(os.path.join(tmp_path, 'direct.csv'), 'rb') as file:
+        data_direct = file.read()
+    with open(path_csv_direct, 'rb') as file:
+        assert file.read() == data_direct
+    with open(path_csv_direct, 'r', newline = '') as file:
+        lines = list(csv.reader(file))
+    assert lines[0] == ['state', 'county', 'tract', 'GEOID', 'NAME', 'B01001_001E']
+    assert lines[1][-2:] == ['Name', 'Total']
+    assert [line[3] for line in lines[2:]] == ['12001000100', '12001000200',
+                '12003000100', '12003000200']
+
+def test_failed_write_leaves_no_output(tmp_path):
+
+    variable_keys, variable_headers = census.define_headers()
+
+    path_json = os.path.join(tmp_path, 'US_pop_by_age_sex__county.json')
+    with pytest.raises(ConnectionError):
+        census.write_rows_to_json(iter_failing_rows(), path_json)
+
+    path_csv = os.path.join(tmp_path, 'US_pop_by_age_sex__county.csv')
+    with pytest.raises(ConnectionError):
+        census.convert_rows_to_csv(iter_failing_rows(), path_csv, 'county',
+                variable_keys, variable_headers)
+
+    assert os.listdir(tmp_path) == []
+
+def test_failed_write_keeps_previous_output(tmp_path):
+
+    path_json = os.path.join(tmp_path, 'US_pop_by_age_sex__county.json')
+    census.write_rows_to_json([['NAME', 'state'], ['Florida', '12']], path_json)
+    with pytest.raises(ConnectionError):
+        census.write_rows_to_json(iter_failing_rows(), path_json)
+
+    with open(path_json, 'r') as file:
+        assert file.read() == '[["NAME", "state"],\n["Florida", "12"]]'
+    assert os.listdir(tmp_path) == ['US_pop_by_age_sex__county.json']
+
+def test_vectorized_csv_is_identical(tmp_path):
+
+    variable_keys = ['NAME', 'B01001_001E', 'B01001_002E']
+    variable_headers = ['Name', 'Total', 'Male']
+    rows = [['NAME', 'B01001_001E', 'B01001_002E', 'state', 'county', 'tract'],
+            ['Census Tract 1, Lee County, Florida', '1200', '600', '12', '71', '000100'],
+            ['Census Tract 2; "North"', '0', None, '12', '71', '000200'],
+            ['Census Tract 3', '-666666666', '15', '12', '1', '000300']]
+
+    path_csv = os.path.join(tmp_path, 'rows.csv')
+    path_csv_vectorized = os.path.join(tmp_path, 'rows_vectorized.csv')
+    census.convert_rows_to_csv(rows, path_csv, 'tract', variable_keys,
+            variable_headers)
+    census.convert_rows_to_csv_vectorized(rows, path_csv_vectorized, 'tract',
+            variable_keys, variable_headers)
+
+    with open(path_csv, 'rb') as file:
+        data = file.read()
+    with open(path_csv_vectorized, 'rb') as file:
+        data_vectorized = file.read()
+    assert b'\r\n' in data
+    assert data_vectorized == data
+
+def test_rollup_rows():
+
+    pytest.importorskip('pandas')
+    variable_keys = ['NAME', 'B01001_001E', 'B01001_002E']
+    rows = [['NAME', 'B01001_001E', 'B01001_002E', 'state', 'county', 'tract',
+             'block group'],
+            ['Block Group 1', '100', '40', '12', '71', '000100', '1'],
+            ['Block Group 2', '50', '-666666666', '12', '71', '000100', '2'],
+            ['Block Group 1', '7', '3', '12', '71', '000200', '1'],
+            ['Block Group 1', '20', '10', '12', '15', '000100', '1'],
+            ['Block Group 1', None, '5', '13', '1', '000100', '1']]
+
+    # A negative flag or a missing value makes the whole total missing.
+    assert census.rollup_rows(rows, 'block group', 'tract', variable_keys) == [
+                ['NAME', 'B01001_001E', 'B01001_002E', 'state', 'county', 'tract'],
+                [None, '20', '10', '12', '015', '000100'],
+                [None, '150', None, '12', '071', '000100'],
+                [None, '7', '3', '12', '071', '000200'],
+                [None, None, '5', '13', '001', '000100']]
+    assert census.rollup_rows(rows, 'block group', 'county', variable_keys)[1:] == [
+                [None, '20', '10', '12', '015'],
+                [None, '157', None, '12', '071'],
+                [None, None, '5', '13', '001']]
+    assert census.rollup_rows(rows, 'block group', 'state', variable_keys[1:]) == [
+                ['B01001_001E', 'B01001_002E', 'state'],
+                ['177', None, '12'],
+                [None, '5', '13']]
+
+    with pytest.raises(ValueError):
+        census.rollup_rows(rows, 'tract', 'block group', variable_keys)
+
+def test_define_rollup_targets():
+
+    rollup_adm_levels = ['state', 'county', 'tract']
+
+    paths_json = ['out/US_pop__place.json', 'out/US_pop__county.json',
+                  'out/US_pop__block_group.json']
+    path_finest, to_adm_levels = census.define_rollup_targets(paths_json,
+                                    rollup_adm_levels)
+    assert path_finest == 'out/US_pop__block_group.json'
+    assert to_adm_levels == ['state', 'tract']
+
+    assert census.define_rollup_targets(['out/US_pop__place.json'],
+                rollup_adm_levels) == (None, [])
+    assert census.define_rollup_targets(['out/US_pop__state.json',
+                'out/US_pop__county.json'], rollup_adm_levels) == \
+                ('out/US_pop__county.json', [])
+
+def test_define_job_path(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(census, 'dir_output', 'output')
+    job = {'year' : 2022, 'dataset' : 'acs/acs5', 'adm_level' : 'block group',
+           'states' : ['Florida', 'Georgia'], 'name' : 'US_pop_by_age_sex'}
+    assert census.define_job_path(job) == os.path.join('output', 'acs_acs5_2022',
+                'US_pop_by_age_sex__block_group.json')
+
+    # Unnamed jobs get the same path whatever the order of their states.
+    del job['name']
+    path_out = census.define_job_path(job)
+    assert census.define_job_path(dict(job, states = ['Georgia', 'Florida'])) == path_out
+    assert census.define_job_path(dict(job, variables = ['NAME'])) != path_out
+    assert os.path.basename(path_out).startswith('US_census_')
+
+    path_jobs = os.path.join(tmp_path, 'jobs.json')
+    jobs = census.define_download_jobs()
+    with open(path_jobs, 'w') as file:
+        json.dump(jobs, file)
+    assert census.load_jobs_from_json_file(path_jobs) == jobs
+    assert len(set([census.define_job_path(job) for job in jobs])) == len(jobs)
+
+def test_download_jobs(tmp_path, monkeypatch):
+
+    server = CensusAPIStandIn(n_counties = 3, n_tracts = 2)
+    server.start()
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    monkeypatch.setattr(census, 'define_endpoint', lambda year, dataset :
+                            server.get_endpoint())
+    jobs = [{'year' : 2022, 'dataset' : 'acs/acs5', 'adm_level' : 'tract',
+             'states' : ['Georgia', 'Florida'], 'variables' : ['NAME', 'B01001_001E'],
+             'name' : 'test'}]
+    try:
+        paths_out = census.download_jobs(jobs, 'not-a-real-key')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with open(paths_out[0], 'r') as file:
+        rows = json.load(file)
+    assert len(rows) == 1 + 2 * 3 * 2
+    county_codes = [row[3] for row in rows[1:] if row[2] == '12']
+    assert county_codes == sorted(county_codes)
+    assert not [name for name in os.listdir(os.path.dirname(paths_out[0]))
+                    if name.endswith('.part')]
+
+def test_main_without_optional_dependencies(tmp_path, monkeypatch, capsys):
+
+    # Block the 'census' extra, as after 'pip install .'.
+    monkeypatch.setitem(sys.modules, 'pandas', None)
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    server = CensusAPIStandIn(n_counties = 2, n_tracts = 2)
+    server.start()
+    try:
+        census.main(['--dir_output', str(tmp_path), '--endpoint', server.get_endpoint()],
+                settings = {'api_key' : 'not-a-real-key'})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    output = capsys.readouterr().out
+    assert 'pip install .[census]' in output
+    file_names = os.listdir(tmp_path)
+    assert 'US_pop_by_age_sex__block_group.csv' in file_names
+    assert not [name for name in file_names if name.endswith('.parquet')]
+
+def run_main(tmp_path, monkeypatch, argv):
+
+    monkeypatch.setattr(census, 'dir_output', str(tmp_path))
+    server = CensusAPIStandIn(n_counties = 2, n_tracts = 2)
+    server.start()
+    try:
+        census.main(['--dir_output', str(tmp_path), '--endpoint', server.get_endpoint()] + argv,
+                settings = {'api_key' : 'not-a-real-key'})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return sorted([name for name in os.listdir(tmp_path) if name.endswith('.json')])
+
+def test_main_rollup(tmp_path, monkeypatch):
+
+    pytest.importorskip('pandas')
+
+    # No roll-up unless asked.
+    assert run_main(tmp_path, monkeypatch, ['--adm_levels', 'tract',
+                '--columnar_format', 'none']) == ['US_pop_by_age_sex__tract.json']
+
+    # Levels which were requested are not rolled up.
+    assert run_main(tmp_path, monkeypatch, ['--adm_levels', 'county,block group',
+                '--rollup', '--rollup_adm_levels', 'state,county', '--columnar_format',
+                'none']) == ['US_pop_by_age_sex__block_group.json',
+                'US_pop_by_age_sex__county.json', 'US_pop_by_age_sex__state.json',
+                'US_pop_by_age_sex__tract.json']
+    with open(os.path.join(tmp_path, 'US_pop_by_age_sex__county.json'), 'r') as file:
+        rows = json.load(file)
+    assert rows[1][rows[0].index('NAME')] is not None
+
+def test_convert_rows_to_dataframe():
+
+    pd = pytest.importorskip('pandas')
+    variable_keys = ['NAME', 'B01001_001E', 'B01001_002E', 'B01001_003E']
+    variable_headers = ['Name', 'Total', 'Male', 'Male_<5']
+    rows = [['NAME', 'B01001_001E', 'B01001_002E', 'B01001_003E', 'state', 'county'],
+            ['County 1', '70000', '12', '-666666666', '12', '1'],
+            ['County 3', '250', None, '3', '12', '3']]
+
+    df = census.convert_rows_to_dataframe(rows, 'county', variable_keys,
+            variable_headers)
+    assert list(df.columns) == ['FIPS', 'state', 'county', 'Name', 'Total', 'Male',
+                'Male_<5']
+    assert list(df['FIPS']) == ['12001', '12003']
+    assert df['FIPS'].dtype == 'string'
+    assert isinstance(df['county'].dtype, pd.CategoricalDtype)
+    assert df['Total'].dtype == 'uint32'
+    assert df['Male'].dtype == 'Int8'
+    assert df['Male'].isna().tolist() == [False, True]
+    assert df['Male_<5'].dtype == 'int32'
+
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+def test_convert_json_to_columnar(tmp_path, file_format):
+
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    variable_keys, variable_headers = census.define_headers()
+    header = variable_keys + ['state', 'county']
+    rows = [header] + [['{:d}'.format(i) for _ in variable_keys[:-1]] +
+                ['County {:d}'.format(i), '12', '{:03d}'.format(i)] for i in [1, 3]]
+    path_json = os.path.join(tmp_path, 'US_pop_by_age_sex__county.json')
+    census.write_rows_to_json(rows, path_json)
+
+    census.convert_json_to_columnar(path_json, variable_keys, variable_headers,
+            file_format = file_format)
+    path_out = os.path.join(tmp_path, 'US_pop_by_age_sex__county.{:}'.format(file_format))
+    df = census.convert_rows_to_dataframe(rows, 'county', variable_keys,
+            variable_headers)
+    if file_format == 'parquet':
+        df_read = pd.read_parquet(path_out)
+    else:
+        df_read = pd.read_feather(path_out)
+    pd.testing.assert_frame_equal(df_read, df)
+    assert list(df_read.columns[3:]) == variable_headers
+
+    # The file is only rebuilt when the JSON file is newer.
+    mtime = os.path.getmtime(path_out)
+    os.utime(path_out, (mtime + 10.0, mtime + 10.0))
+    census.convert_json_to_columnar(path_json, variable_keys, variable_headers,
+            file_format = file_format)
+    assert os.path.getmtime(path_out) == mtime + 10.0
+
+def test_empty_table(tmp_path):
+
+    pytest.importorskip('pyarrow')
+    variable_keys, variable_headers = census.define_headers()
+    path_json = os.path.join(tmp_path, 'US_pop_by_age_sex__county.json')
+    census.write_rows_to_json([], path_json)
+
+    census.convert_json_to_columnar(path_json, variable_keys, variable_headers)
+    df = census.convert_rows_to_dataframe([], 'county', variable_keys, variable_headers)
+    assert len(df) == 0
+    assert list(df.columns[:3]) == ['FIPS', 'state', 'county']
+
+    path_csv = os.path.join(tmp_path, 'rows.csv')
+    path_csv_vectorized = os.path.join(tmp_path, 'rows_vectorized.csv')
+    census.convert_rows_to_csv([], path_csv, 'county', variable_keys, variable_headers)
+    census.convert_rows_to_csv_vectorized([], path_csv_vectorized, 'county',
+            variable_keys, variable_headers)
+    assert os.path.getsize(path_csv) == os.path.getsize(path_csv_vectorized) == 0
+
+    assert census.rollup_json(path_json, ['state'], variable_keys) == \
+            [os.path.join(tmp_path, 'US_pop_by_age_sex__state.json')]
+    with open(os.path.join(tmp_path, 'US_pop_by_age_sex__state.json'), 'r') as file:
+        assert json.load(file) == []
+
+def test_main_cache_is_opt_in(tmp_path, monkeypatch):
+
+    run_main(tmp_path, monkeypatch, ['--adm_levels', 'county', '--columnar_format', 'none'])
+    assert 'cache_census_API' not in os.listdir(tmp_path)
+
+    run_main(tmp_path, monkeypatch, ['--adm_levels', 'county', '--columnar_format', 'none',
+                '--cache'])
+    assert 'cache_census_API' in os.listdir(tmp_path)
+
+def test_main_store_is_opt_in(tmp_path, monkeypatch, capsys):
+
+    run_main(tmp_path, monkeypatch, ['--adm_levels', 'county', '--columnar_format', 'none'])
+    assert 'US_census_store.sqlite' not in os.listdir(tmp_path)
+
+    # Re-exporting the same data from the store does not rebuild the CSV.
+    argv = ['--adm_levels', 'county', '--columnar_format', 'none', '--store']
+    run_main(tmp_path, monkeypatch, argv)
+    assert 'US_census_store.sqlite' in os.listdir(tmp_path)
+    path_csv = os.path.join(tmp_path, 'US_pop_by_age_sex__county.csv')
+    mtime = os.path.getmtime(path_csv)
+    capsys.readouterr()
+    run_main(tmp_path, monkeypatch, argv)
+    assert 'is up to date, skipping conversion' in capsys.readouterr().out
+    assert os.path.getmtime(path_csv) == mtime
+
+def test_async_results_are_bounded(monkeypatch):
+
+    started = []
+    def fetch_partition(session, endpoint, query_str_GET, partition, api_key,
+            cache = None, scheduler = None):
+        started.append(partition)
+        return [['NAME', 'state'], [partition[0][1], '12']]
+
+    monkeypatch.setattr(census, 'fetch_partition', fetch_partition)
+    partitions = [[('for', str(i))] for i in range(50)]
+
+    async def consume():
+        n_results = 0
+        max_ahead = 0
+        semaphore = asyncio.Semaphore(4)
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            async for result in census.iter_partition_results_async(executor,
+                    semaphore, None, 'endpoint', ['NAME'], partitions, 'key',
+                    n_ahead = 5):
+                assert result[1][0] == str(n_results)
+                n_results = n_results + 1
+                await asyncio.sleep(0.001)
+                max_ahead = max(max_ahead, len(started) - n_results)
+        return n_results, max_ahead
+
+    n_results, max_ahead = asyncio.run(consume())
+    assert n_results == 50
+    assert max_ahead <= 5
+
+@pytest.mark.parametrize('adm_level, rows', [
+    ('county', [['NAME', 'B01001_001E', 'state', 'county'],
+                ['Lee County, Florida', '760822', '12', '71']]),
+    ('block group', [['NAME', 'B01001_001E', 'state', 'county', 'tract', 'block group'],
+                     ['Block Group 1', '1200', '12', '71', '000100', '1']]),
+])
+def test_csv_column_order(tmp_path, adm_level, rows):
+
+    variable_keys = ['NAME', 'B01001_001E']
+    variable_headers = ['Name', 'Total']
+    path_csv = os.path.join(tmp_path, 'rows.csv')
+    path_csv_vectorized = os.path.join(tmp_path, 'rows_vectorized.csv')
+    census.convert_rows_to_csv(rows, path_csv, adm_level, variable_keys,
+            variable_headers)
+    census.convert_rows_to_csv_vectorized(rows, path_csv_vectorized, adm_level,
+            variable_keys, variable_headers)
+
+    with open(path_csv, 'r', newline = '') as file:
+        lines = list(csv.reader(file))
+    geography_columns = rows[0][2:]
+    id_name, _ = census.define_id_components(adm_level)
+    assert lines[0] == geography_columns + [id_name, 'NAME', 'B01001_001E']
+    assert lines[1][-2:] == ['Name', 'Total']
+    assert lines[2][len(geography_columns)] == {'county' : '12071',
+                'block group' : '120710001001'}[adm_level]
+    with open(path_csv, 'rb') as file:
+        data = file.read()
+    with open(path_csv_vectorized, 'rb') as file:
+        assert file.read() == data
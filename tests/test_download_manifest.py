@@ -0,0 +1,156 @@
+'''
+Tests for download_manifest.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Third party.
+import requests
+
+# Imports: Local.
+from hrmd_ma_misc.download_manifest import (DownloadManifest, compute_sha256,
+        define_conditional_headers, download_file, parse_content_range)
+
+def write_served_file(file_server, file_name, data):
+
+    with open(os.path.join(file_server.dir_root, file_name), 'wb') as file:
+        file.write(data)
+
+    return file_server.get_url(file_name)
+
+def read_file(path):
+
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    return data
+
+def test_parse_content_range():
+
+    assert parse_content_range('bytes 1000-1999/5000') == (1000, 5000)
+    assert parse_content_range('bytes */5000') == (None, 5000)
+    assert parse_content_range('bytes 0-99/*') == (0, None)
+
+def test_download_file_resumes_part_file(tmp_path, file_server):
+
+    data = os.urandom(100000)
+    url = write_served_file(file_server, 'tile.tif', data)
+    file_path = os.path.join(tmp_path, 'tile.tif')
+    with open(file_path + '.part', 'wb') as file:
+        file.write(data[:30000])
+
+    assert download_file(requests.Session(), url, file_path) == 'downloaded'
+    assert read_file(file_path) == data
+    assert not os.path.exists(file_path + '.part')
+    method, _, headers = file_server.requests[-1]
+    assert (method, headers['Range']) == ('GET', 'bytes=30000-')
+
+def test_download_file_complete_part_file(tmp_path, file_server):
+
+    data = os.urandom(1000)
+    url = write_served_file(file_server, 'tile.tif', data)
+    file_path = os.path.join(tmp_path, 'tile.tif')
+
+    # The range starts at the end of the file, so the server answers 416 and
+    # the '.part' file is already complete.
+    with open(file_path + '.part', 'wb') as file:
+        file.write(data)
+    assert download_file(requests.Session(), url, file_path) == 'downloaded'
+    assert read_file(file_path) == data
+    assert file_server.count_requests('GET') == 1
+
+    # A '.part' file longer than the remote file is from an older version, so
+    # the download starts again.
+    os.remove(file_path)
+    with open(file_path + '.part', 'wb') as file:
+        file.write(os.urandom(2000))
+    assert download_file(requests.Session(), url, file_path) == 'downloaded'
+    assert read_file(file_path) == data
+    assert 'Range' not in file_server.requests[-1][2]
+
+def test_download_file_checks_untracked_files(tmp_path, file_server):
+
+    data = os.urandom(5000)
+    url = write_served_file(file_server, 'tile.tif', data)
+    file_path = os.path.join(tmp_path, 'tile.tif')
+
+    # A complete file (e.g. from the old wget loop) is only checked with HEAD.
+    with open(file_path, 'wb') as file:
+        file.write(data)
+    assert download_file(requests.Session(), url, file_path) == 'skipped'
+    assert file_server.count_requests('GET') == 0
+    assert file_server.count_requests('HEAD') == 1
+
+    # A truncated file is resumed.
+    with open(file_path, 'wb') as file:
+        file.write(data[:1234])
+    assert download_file(requests.Session(), url, file_path) == 'downloaded'
+    assert read_file(file_path) == data
+    assert file_server.requests[-1][2]['Range'] == 'bytes=1234-'
+
+def test_define_conditional_headers():
+
+    assert define_conditional_headers({'etag' : '"abc"', 'last_modified' : None}) == \
+            {'If-None-Match' : '"abc"'}
+    assert define_conditional_headers({'etag' : None,
+                'last_modified' : 'Mon, 01 Jan 2024 00:00:00 GMT'}) == \
+            {'If-Modified-Since' : 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    assert define_conditional_headers({'etag' : '', 'last_modified' : None}) == {}
+
+def test_download_file_with_manifest(tmp_path, file_server):
+
+    data = os.urandom(20000)
+    url = write_served_file(file_server, 'granule.tif', data)
+    file_path = os.path.join(tmp_path, 'granule.tif')
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest', 'manifest.sqlite'))
+    session = requests.Session()
+
+    assert download_file(session, url, file_path, manifest = manifest) == 'downloaded'
+    entry = manifest.get(url)
+    assert entry['path'] == file_path
+    assert entry['size'] == len(data)
+    assert entry['sha256'] == compute_sha256(file_path)
+    assert entry['etag'] and entry['last_modified']
+
+    # An unchanged file costs one conditional request with no body.
+    assert download_file(session, url, file_path, manifest = manifest) == 'unchanged'
+    method, _, headers = file_server.requests[-1]
+    assert (method, headers['If-None-Match']) == ('GET', entry['etag'])
+    assert 'If-Modified-Since' in headers
+    assert manifest.get(url)['checked'] >= entry['checked']
+    assert file_server.count_requests('GET') == 2
+
+    # A changed file is downloaded again in full.
+    data = os.urandom(30000)
+    write_served_file(file_server, 'granule.tif', data)
+    mtime = os.path.getmtime(os.path.join(file_server.dir_root, 'granule.tif')) + 10.0
+    os.utime(os.path.join(file_server.dir_root, 'granule.tif'), (mtime, mtime))
+    assert download_file(session, url, file_path, manifest = manifest) == 'updated'
+    assert read_file(file_path) == data
+    assert manifest.get(url)['size'] == len(data)
+
+    # A recorded file which was truncated locally is checked again.
+    with open(file_path, 'wb') as file:
+        file.write(data[:100])
+    assert download_file(session, url, file_path, manifest = manifest) == 'downloaded'
+    assert read_file(file_path) == data
+    manifest.close()
+
+def test_download_file_adopts_untracked_files(tmp_path, file_server):
+
+    data = os.urandom(20000)
+    url = write_served_file(file_server, 'granule.tif', data)
+    file_path = os.path.join(tmp_path, 'granule.tif')
+    with open(file_path, 'wb') as file:
+        file.write(data)
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    session = requests.Session()
+
+    # A complete file which is not in the manifest is recorded after a HEAD
+    # request, then checked with conditional requests.
+    assert download_file(session, url, file_path, manifest = manifest) == 'skipped'
+    assert manifest.get(url)['sha256'] == compute_sha256(file_path)
+    assert file_server.count_requests('GET') == 0
+    assert download_file(session, url, file_path, manifest = manifest) == 'unchanged'
+    assert file_server.count_requests('GET') == 1
+    manifest.close()
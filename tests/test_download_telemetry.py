@@ -0,0 +1,46 @@
+'''
+Tests for download_telemetry.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Third party.
+import pytest
+import requests
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc.benchmark_US_census_data import CensusAPIStandIn
+from hrmd_ma_misc.download_telemetry import (redact_secrets, start_telemetry,
+        stop_telemetry)
+
+api_key = 'not-a-real-key-0123456789'
+
+def test_redact_secrets():
+
+    text = "HTTPError('503 Server Error for url: http://h/data?get=NAME&for=state%3A%2A&key={:}')".format(api_key)
+    assert api_key not in redact_secrets(text)
+    assert 'key=REDACTED' in redact_secrets(text)
+    assert redact_secrets('http://h/data?key=abc&get=NAME') == 'http://h/data?key=REDACTED&get=NAME'
+    assert redact_secrets('http://h/data?monkey=1') == 'http://h/data?monkey=1'
+
+def test_api_key_not_in_telemetry_log(tmp_path):
+
+    server = CensusAPIStandIn(error_rate = 1.0)
+    server.start()
+    path_log = os.path.join(tmp_path, 'telemetry.jsonl')
+    start_telemetry(path_log, 'census')
+    try:
+        with requests.Session() as session:
+            with pytest.raises(requests.HTTPError):
+                census.fetch_partition(session, server.get_endpoint(), 'NAME',
+                        [('for', 'state:*')], api_key)
+    finally:
+        stop_telemetry()
+        server.shutdown()
+        server.server_close()
+
+    with open(path_log, 'r') as file:
+        log = file.read()
+    assert '"error"' in log
+    assert api_key not in log
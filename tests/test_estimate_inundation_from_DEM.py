@@ -0,0 +1,77 @@
+'''
+Tests for estimate_inundation_from_DEM.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Third party.
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+
+# Imports: Local.
+from hrmd_ma_misc import estimate_inundation_from_DEM as inundation
+
+def brute_force_min(array, size):
+
+    half_size = size // 2
+    result = np.empty_like(array)
+    for i in range(array.shape[0]):
+
+        for j in range(array.shape[1]):
+
+            result[i, j] = array[max(i - half_size, 0) : i + half_size + 1,
+                                 max(j - half_size, 0) : j + half_size + 1].min()
+
+    return result
+
+@pytest.mark.parametrize('size', [1, 3, 5, 7, 13, 31])
+def test_sliding_min_2d(size):
+
+    rng = np.random.default_rng(size)
+    array = rng.normal(0.0, 1.0, (23, 17)).astype('float32')
+    array[rng.random(array.shape) < 0.1] = np.inf
+
+    assert np.array_equal(inundation.sliding_min_2d(array, size),
+                brute_force_min(array, size))
+
+def test_compute_inundation():
+
+    dem = np.array([[1.0, 2.0, 3.0],
+                    [2.0, np.nan, 5.0],
+                    [6.0, 7.0, 9.0]], dtype = 'float32')
+
+    assert inundation.compute_inundation(dem, 'water_level', 2.0).tolist() == \
+            [[1, 1, 0], [1, 255, 0], [0, 0, 0]]
+    # The lowest point within one pixel, ignoring no data.
+    assert inundation.compute_inundation(dem, 'hand', 1.0, window_size = 3).tolist() == \
+            [[1, 1, 1], [1, 255, 0], [0, 0, 0]]
+    with pytest.raises(ValueError):
+        inundation.compute_inundation(dem, 'bathtub', 1.0)
+
+@pytest.mark.parametrize('method, threshold', [('water_level', 8.0), ('hand', 1.0)])
+def test_estimate_inundation(tmp_path, method, threshold):
+
+    # 2 x 2 blocks of 512 pixels, the last ones partial.
+    path_dem = inundation.make_synthetic_dem(os.path.join(tmp_path, 'dem.tif'),
+                    size = 700)
+    path_out = os.path.join(tmp_path, 'mask_{:}.tif'.format(method))
+    drainage_radius = 20.0
+
+    assert inundation.estimate_inundation(path_dem, path_out, method = method,
+                threshold = threshold, drainage_radius = drainage_radius,
+                block_size = 512, max_workers = 2) == path_out
+    assert not os.path.exists(path_out + '.part')
+
+    # The block-wise mask is the same as for the whole array at once.
+    with rasterio.open(path_dem) as src:
+        dem = src.read(1, masked = True).astype('float32').filled(np.nan)
+    with rasterio.open(path_out) as src:
+        assert (src.nodata, src.block_shapes[0]) == (inundation.mask_nodata, (512, 512))
+        mask = src.read(1)
+    mask_whole = inundation.compute_inundation(dem, method, threshold,
+                    window_size = 2 * int(drainage_radius) + 1)
+    assert np.array_equal(mask, mask_whole)
+    assert (mask[:14, :14] == inundation.mask_nodata).all()
+    assert 0.0 < np.mean(mask == 1) < 1.0
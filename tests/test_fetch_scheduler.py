@@ -0,0 +1,74 @@
+'''
+Tests for fetch_scheduler.py.
+'''
+# Imports: Standard library.
+import os
+import sqlite3
+import time
+
+# Imports: Third party.
+import pytest
+import requests
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc.benchmark_US_census_data import CensusAPIStandIn
+from hrmd_ma_misc.download_telemetry import start_telemetry, stop_telemetry
+from hrmd_ma_misc.fetch_scheduler import FailedJobQueue, FetchScheduler, TokenBucket
+
+api_key = 'not-a-real-key-0123456789'
+
+def test_api_key_not_in_retries_or_failed_jobs(tmp_path, capsys):
+
+    server = CensusAPIStandIn(error_rate = 1.0)
+    server.start()
+    path_log = os.path.join(tmp_path, 'telemetry.jsonl')
+    path_db = os.path.join(tmp_path, 'failed_jobs.sqlite')
+    failed_jobs = FailedJobQueue(path_db, 'census')
+    scheduler = FetchScheduler(max_retries = 1, backoff_base = 0.01,
+                    max_retry_after = 0.01, failed_jobs = failed_jobs)
+    start_telemetry(path_log, 'census')
+    try:
+        with requests.Session() as session:
+            with pytest.raises(requests.HTTPError):
+                census.fetch_partition(session, server.get_endpoint(), 'NAME',
+                        [('for', 'state:*')], api_key, scheduler = scheduler)
+    finally:
+        stop_telemetry()
+        failed_jobs.close()
+        server.shutdown()
+        server.server_close()
+
+    assert scheduler.n_retries == 1
+    assert api_key not in capsys.readouterr().out
+    with open(path_log, 'r') as file:
+        assert api_key not in file.read()
+    with sqlite3.connect(path_db) as connection:
+        errors = [error for error, in connection.execute('SELECT error FROM failed_jobs')]
+    assert len(errors) == 1
+    assert api_key not in errors[0]
+
+def test_no_rate_limit_by_default():
+
+    scheduler = FetchScheduler(max_per_host = 4)
+    time_start = time.monotonic()
+    results = [scheduler.call('http://127.0.0.1/', lambda i : i, i) for i in range(100)]
+    assert results == list(range(100))
+    assert time.monotonic() - time_start < 1.0
+
+def test_unlimited_bucket_honours_pause():
+
+    bucket = TokenBucket(None)
+    bucket.slow_down()
+    bucket.pause(0.2)
+    time_start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - time_start >= 0.15
+
+def test_rate_limit():
+
+    bucket = TokenBucket(20.0)
+    time_start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - time_start >= 0.45
@@ -0,0 +1,95 @@
+'''
+Tests for index_3DEP_tiles.py.
+'''
+# Imports: Standard library.
+import json
+import os
+
+# Imports: Third party.
+import pytest
+
+# Imports: Local.
+from hrmd_ma_misc import index_3DEP_tiles
+from hrmd_ma_misc.index_3DEP_tiles import (bbox_to_ring, find_intersecting_tiles,
+        get_tile_bounds, get_utm_bounds, list_project_tiles, lonlat_to_utm,
+        read_geojson_rings)
+
+def test_lonlat_to_utm():
+
+    pyproj = pytest.importorskip('pyproj')
+    transformer = pyproj.Transformer.from_crs('EPSG:4269', 'EPSG:26917', always_xy = True)
+    for lon, lat in [(-82.09, 26.98), (-82.53, 27.34), (-84.0, 24.5), (-78.1, 31.0)]:
+
+        easting, northing = lonlat_to_utm(lon, lat, 17)
+        easting_expected, northing_expected = transformer.transform(lon, lat)
+        assert abs(easting - easting_expected) < 1.0E-3
+        assert abs(northing - northing_expected) < 1.0E-3
+
+def test_get_tile_bounds():
+
+    assert get_tile_bounds(39, 299) == (390000.0, 2980000.0, 400000.0, 2990000.0)
+
+def test_find_intersecting_tiles():
+
+    # The Port Charlotte and Sarasota examples in download_3DEP_data.py.
+    assert find_intersecting_tiles([bbox_to_ring(-82.10, 26.97, -82.08, 26.99)]) == [(39, 299)]
+    assert find_intersecting_tiles([bbox_to_ring(-82.54, 27.33, -82.52, 27.35)]) == [(34, 303)]
+    assert find_intersecting_tiles([bbox_to_ring(-82.10, 26.97, -82.08, 26.99),
+                bbox_to_ring(-82.54, 27.33, -82.52, 27.35)]) == [(34, 303), (39, 299)]
+
+    # Every tile which intersects a larger box is in the box's UTM bounds,
+    # and no tile is listed twice.
+    rings = [bbox_to_ring(-82.2, 26.9, -82.0, 27.1)]
+    tiles = find_intersecting_tiles(rings)
+    bounds = get_utm_bounds(rings)
+    assert (39, 299) in tiles
+    assert len(set(tiles)) == len(tiles)
+    for x_tile, y_tile in tiles:
+
+        x_min, y_min, x_max, y_max = get_tile_bounds(x_tile, y_tile)
+        assert (x_min <= bounds[2]) and (x_max >= bounds[0])
+        assert (y_min <= bounds[3]) and (y_max >= bounds[1])
+
+def test_read_geojson_rings(tmp_path):
+
+    triangle = [[-82.10, 26.97], [-82.08, 26.97], [-82.09, 26.99], [-82.10, 26.97]]
+    square = [[-82.54, 27.33], [-82.52, 27.33], [-82.52, 27.35], [-82.54, 27.35],
+              [-82.54, 27.33]]
+    geojson = {'type' : 'FeatureCollection', 'features' : [
+                {'type' : 'Feature', 'properties' : {},
+                 'geometry' : {'type' : 'Polygon', 'coordinates' : [triangle]}},
+                {'type' : 'Feature', 'properties' : {},
+                 'geometry' : {'type' : 'MultiPolygon', 'coordinates' : [[square]]}}]}
+    path_geojson = os.path.join(tmp_path, 'area.geojson')
+    with open(path_geojson, 'w') as file:
+        json.dump(geojson, file)
+
+    rings = read_geojson_rings(path_geojson)
+    assert rings == [[tuple(point) for point in triangle], [tuple(point) for point in square]]
+    assert find_intersecting_tiles(rings) == [(34, 303), (39, 299)]
+
+def test_list_project_tiles(tmp_path, file_server, monkeypatch):
+
+    listing = '''<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+  <Contents><Key>{0:}USGS_1M_17_x39y299_FL_Peninsular_FDEM_2018_D19_DRRA.tif</Key><Size>250000000</Size></Contents>
+  <Contents><Key>{0:}USGS_1M_17_x34y303_FL_Peninsular_FDEM_2018_D19_DRRA.tif</Key><Size>1000</Size></Contents>
+  <Contents><Key>{0:}USGS_1M_17_x34y303_FL_Peninsular_FDEM_2018_D19_DRRA.xml</Key><Size>10</Size></Contents>
+</ListBucketResult>'''.format(index_3DEP_tiles.project_prefix)
+    with open(os.path.join(file_server.dir_root, 'listing.xml'), 'w') as file:
+        file.write(listing)
+    monkeypatch.setattr(index_3DEP_tiles, 'bucket_url', file_server.get_url('listing.xml'))
+    path_cache = os.path.join(tmp_path, 'project_listing.json')
+
+    expected_tiles = {(39, 299) : 250000000, (34, 303) : 1000}
+    assert list_project_tiles(path_cache) == expected_tiles
+    params = file_server.requests[0][1].split('?')[1]
+    assert 'list-type=2' in params
+
+    # The listing is cached.
+    assert list_project_tiles(path_cache) == expected_tiles
+    assert file_server.count_requests() == 1
+    mtime = os.path.getmtime(path_cache) - 8 * 24 * 3600
+    os.utime(path_cache, (mtime, mtime))
+    assert list_project_tiles(path_cache) == expected_tiles
+    assert file_server.count_requests() == 2
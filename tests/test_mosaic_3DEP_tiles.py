@@ -0,0 +1,71 @@
+'''
+Tests for mosaic_3DEP_tiles.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Third party.
+import pytest
+
+np = pytest.importorskip('numpy')
+rasterio = pytest.importorskip('rasterio')
+from rasterio.transform import from_origin
+
+# Imports: Local.
+from hrmd_ma_misc import mosaic_3DEP_tiles
+
+nodata = -999999.0
+
+def write_tile(path, data, origin):
+
+    with rasterio.open(path, 'w', driver = 'GTiff', width = data.shape[1],
+            height = data.shape[0], count = 1, dtype = 'float32', crs = 'EPSG:26917',
+            transform = from_origin(origin[0], origin[1], 1.0, 1.0), nodata = nodata,
+            tiled = True, blockxsize = 256, blockysize = 256) as dst:
+        dst.write(data, 1)
+
+    return
+
+def test_define_blocks_and_overview_factors():
+
+    blocks = mosaic_3DEP_tiles.define_blocks(1100, 600, 512)
+    assert [(block.col_off, block.row_off, block.width, block.height) for block in
+                blocks] == [(0, 0, 512, 512), (512, 0, 512, 512), (1024, 0, 76, 512),
+                            (0, 512, 512, 88), (512, 512, 512, 88), (1024, 512, 76, 88)]
+    assert mosaic_3DEP_tiles.define_overview_factors(2048, 1024) == [2, 4, 8]
+    assert mosaic_3DEP_tiles.define_overview_factors(200, 100) == []
+
+def test_build_mosaic(tmp_path):
+
+    # Two tiles side by side which overlap by 24 pixels. Like the 3DEP
+    # tiles, the overlap is a nodata buffer in the second tile.
+    size = 1024
+    data_left = np.arange(size * size, dtype = 'float32').reshape(size, size)
+    data_right = -np.arange(size * size, dtype = 'float32').reshape(size, size)
+    data_right[:, :24] = nodata
+    write_tile(os.path.join(tmp_path, 'USGS_1M_17_x39y299_a.tif'), data_left,
+            (400000.0, 3000000.0))
+    write_tile(os.path.join(tmp_path, 'USGS_1M_17_x40y299_b.tif'), data_right,
+            (400000.0 + size - 24, 3000000.0))
+    # Incomplete downloads are ignored.
+    with open(os.path.join(tmp_path, 'USGS_1M_17_x41y299_c.tif.part'), 'wb') as file:
+        file.write(b'II*\x00')
+
+    path_out = mosaic_3DEP_tiles.build_mosaic(dir_tiles = str(tmp_path),
+                    block_size = 512, max_workers = 2)
+
+    assert path_out == os.path.join(tmp_path, '3DEP_mosaic.tif')
+    assert not os.path.exists(path_out + '.part')
+    with rasterio.open(path_out) as src:
+        assert (src.width, src.height) == (2 * size - 24, size)
+        assert src.nodata == nodata
+        assert src.block_shapes[0] == (512, 512)
+        assert src.overviews(1) == [2, 4]
+        mosaic = src.read(1)
+    assert (mosaic[:, :size] == data_left).all()
+    assert (mosaic[:, size:] == data_right[:, 24:]).all()
+
+    # The mosaic is only rebuilt when a tile is newer.
+    mtime = os.path.getmtime(path_out)
+    assert mosaic_3DEP_tiles.build_mosaic(dir_tiles = str(tmp_path)) == path_out
+    assert os.path.getmtime(path_out) == mtime
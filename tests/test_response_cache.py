@@ -0,0 +1,123 @@
+'''
+Tests for response_cache.py.
+'''
+# Imports: Standard library.
+import os
+
+# Imports: Local.
+from hrmd_ma_misc import download_US_census_data as census
+from hrmd_ma_misc import response_cache
+from hrmd_ma_misc.benchmark_US_census_data import CensusAPIStandIn
+from hrmd_ma_misc.response_cache import ResponseCache
+
+class FakeClock:
+
+    def __init__(self, now = 1.0E9):
+
+        self.now = now
+
+        return
+
+    def time(self):
+
+        return self.now
+
+def test_make_key(tmp_path):
+
+    cache = ResponseCache(str(tmp_path))
+    endpoint = 'https://api.census.gov/data/2022/acs/acs5'
+    params = [('get', 'NAME'), ('for', 'tract:*'), ('in', 'state:12'),
+              ('in', 'county:001'), ('key', 'secret')]
+    key = cache.make_key(endpoint, params)
+
+    # The API key, the parameter order and a trailing slash do not matter.
+    assert cache.make_key(endpoint + '/', [('key', 'other')] + params[:-1]) == key
+    assert cache.make_key(endpoint, list(reversed(params[:2])) + params[2:]) == key
+
+    # The order of repeated parameters, and any change to the query, do.
+    assert cache.make_key(endpoint, params[:2] + [params[3], params[2]]) != key
+    assert cache.make_key(endpoint, [('get', 'NAME,B01001_001E')] + params[1:]) != key
+    cache.close()
+
+def test_get_and_put(tmp_path):
+
+    cache = ResponseCache(str(tmp_path))
+    key = cache.make_key('http://localhost/data', {'get' : 'NAME'})
+    assert cache.get(key) is None
+    cache.put(key, 'http://localhost/data', [['NAME'], ['Florida']])
+    assert cache.get(key) == [['NAME'], ['Florida']]
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+
+    # A damaged file is a miss, not an error.
+    with open(cache.get_path(key), 'w') as file:
+        file.write('[["NAME"], ["Flor')
+    assert cache.get(key) is None
+    cache.close()
+
+    # Lifetime counts are kept in the index.
+    cache = ResponseCache(str(tmp_path))
+    assert 'hits 1, misses 2, expired 0, stores 1' in cache.get_summary().split('\n')[2]
+    cache.close()
+
+def test_ttl(tmp_path, monkeypatch):
+
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, 'time', clock.time)
+    cache = ResponseCache(str(tmp_path), ttl = 3600)
+    key = cache.make_key('http://localhost/data', {'get' : 'NAME'})
+    cache.put(key, 'http://localhost/data', [['NAME']])
+
+    clock.now = clock.now + 3599
+    assert cache.get(key) == [['NAME']]
+    clock.now = clock.now + 2
+    assert cache.get(key) is None
+    assert cache.stats['expired'] == 1
+    assert not os.path.exists(cache.get_path(key))
+    cache.close()
+
+def test_max_bytes(tmp_path, monkeypatch):
+
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, 'time', clock.time)
+    data = [['NAME'], ['x' * 90]]
+    cache = ResponseCache(str(tmp_path), max_bytes = 250)
+    keys = [cache.make_key('http://localhost/data', {'get' : str(i)}) for i in range(3)]
+    for key in keys[:2]:
+
+        clock.now = clock.now + 1
+        cache.put(key, 'http://localhost/data', data)
+
+    # Reading the first entry makes the second one the least recently used.
+    clock.now = clock.now + 1
+    assert cache.get(keys[0]) == data
+    clock.now = clock.now + 1
+    cache.put(keys[2], 'http://localhost/data', data)
+
+    assert cache.stats['evictions'] == 1
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == data
+    assert cache.get(keys[2]) == data
+    cache.close()
+
+def test_fetch_partition_uses_cache(tmp_path):
+
+    server = CensusAPIStandIn(n_counties = 2)
+    server.start()
+    cache = ResponseCache(str(tmp_path))
+    session = census.create_session(1)
+    partition = [('for', 'county:*'), ('in', 'state:12')]
+    try:
+        rows = census.fetch_partition(session, server.get_endpoint(), 'NAME',
+                    partition, 'not-a-real-key', cache = cache)
+        rows_cached = census.fetch_partition(session, server.get_endpoint(), 'NAME',
+                        partition, 'another-key', cache = cache)
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+        cache.close()
+
+    assert rows_cached == rows
+    assert len(rows) == 3
+    assert server.n_requests == 1